@@ -1,10 +1,13 @@
 import asyncio
 import serial_asyncio
 import logging
-from rich.text import Text
 import struct
 from pathlib import Path
-import os, json
+import os, json, time
+import curves
+from registry import MotorRegistry
+from busbudget import BusBudget
+from events import CommandSent, ReplyReceived, CommError, PositionUpdated, TemperatureUpdated, MotorFound, MotorLost, ParamChanged, ConfigApplied
 
 """
 
@@ -25,6 +28,12 @@ https://www.analog.com/media/en/dsp-documentation/software-manuals/TMCM-1161-TMC
 logger = logging.getLogger(__name__)
 
 timeout=0.1
+reconnect_min_delay=0.05 # first retry delay after the serial link drops, doubled on every failed attempt
+reconnect_max_delay=2.0
+PPS_PER_VELOCITY_UNIT = 30.5 # microsteps/s per TMCL velocity unit with the default 16MHz clock and pulse divisor 3
+READ_COMMANDS = frozenset((6, 10, 15)) # GAP, GGP, GIO: identical concurrent reads share one bus transaction
+read_cache_ttl = 0.02 # seconds a completed read is reused by identical reads, invalidated by any write to the module
+log_markup = True # Rich markup (colors) in the frame debug lines, off for plain logging (kinelink --headless)
 
 BASE_DIR = Path(__file__).resolve().parent
 CONFIG_DIR = BASE_DIR / "configs"
@@ -40,8 +49,18 @@ class MotorProtocol(asyncio.Protocol):
 
     def print_packet(packet: bytes, direction: str) -> str:
         hex_str = "".join(f"{b:02X}" for b in packet)
+        if not log_markup:
+            return f"{direction}: {hex_str}"
         style = "bold green" if direction == "TX" else "bold blue"
-        return(Text(f"[{style}]{direction}: {hex_str}[/{style}]"))
+        return f"[{style}]{direction}: {hex_str}[/{style}]"
+
+    def _expire(future):
+        if not future.done():
+            future.set_exception(asyncio.TimeoutError())
+
+    def _account(self, sent, ok):
+        elapsed = time.perf_counter() - sent
+        self.motor_manager.bus.record(elapsed, elapsed if ok else None)
 
     def connection_made(self, transport):
         self.transport = transport
@@ -71,21 +90,37 @@ class MotorProtocol(asyncio.Protocol):
         if self.response_future and not self.response_future.done():
             self.response_future.set_exception(exc or ConnectionError("Serial connection lost"))
         self.transport = None
+        self.motor_manager.serial_lost(self)
         
     async def send_command(self, command, future):
         async with self._send_lock:
+            if self.transport is None:
+                if not future.done():
+                    future.set_exception(RuntimeError("No transport available"))
+                logging.debug("Command dropped, no transport available")
+                return None
             self.buffer.clear()
             self.response_future = future
             self.transport.write(command)
+            sent = time.perf_counter()
             logging.debug(MotorProtocol.print_packet(command, "TX"))
 
+            # Timeout handled here: the reply future is failed with TimeoutError if no reply arrives in time.
+            # (asyncio.wait_for is avoided, on python < 3.12 it can swallow the cancellation of the worker)
+            expire = asyncio.get_running_loop().call_later(timeout, MotorProtocol._expire, future)
+            ok = False
             try:
-                # Timeout handled here
-                return await asyncio.wait_for(future, timeout=timeout)
+                reply = await asyncio.shield(future)
+                ok = True
+                return reply
             except asyncio.TimeoutError:
                 logging.debug(f"Command timed out after {timeout}s")
-                if not future.done():
-                    future.set_exception(asyncio.TimeoutError())
+                return None
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise # the worker itself is cancelled
+                # the caller gave up (ie its motor worker was stopped by remove_motor), the worker keeps going
+                logging.debug("Command cancelled by its caller")
                 return None
             except Exception as e:
                 logging.error(f"Command failed: {e}")
@@ -93,18 +128,60 @@ class MotorProtocol(asyncio.Protocol):
                     future.set_exception(e)
                 return None
             finally:
+                expire.cancel()
                 self.response_future = None
+                self._account(sent, ok)
+
+    async def transact_many(self, commands, stop_on_missing=False):
+        """
+            Pipelined transactions: the send lock is taken once and every frame is written as soon as the
+            reply of the previous one is in, without going through the command queue and its pacing.
+            Returns the parsed replies, None for a frame without a valid reply.
+            stop_on_missing: the frames after the first one without reply are not sent (None replies).
+        """
+        loop = asyncio.get_running_loop()
+        replies = []
+        async with self._send_lock:
+            for command in commands:
+                if self.transport is None or (stop_on_missing and replies and replies[-1] is None):
+                    replies.append(None)
+                    continue
+                future = loop.create_future()
+                self.buffer.clear()
+                self.response_future = future
+                self.transport.write(command)
+                sent = time.perf_counter()
+                expire = loop.call_later(timeout, MotorProtocol._expire, future)
+                ok = False
+                try:
+                    replies.append(await asyncio.shield(future))
+                    ok = True
+                except asyncio.CancelledError:
+                    if not future.cancelled():
+                        raise
+                    replies.append(None)
+                except Exception:
+                    replies.append(None)
+                finally:
+                    expire.cancel()
+                    self.response_future = None
+                    self._account(sent, ok)
+        return replies
 
 class MotorManager:
-    def __init__(self, port='/dev/ttyUSB0', baudrate=115200, default_maxspeed=100, default_minspeed=10, default_accel=100, default_maxpos=5000, module_range=255):
+    def __init__(self, port='/dev/ttyUSB0', baudrate=115200, default_maxspeed=100, default_minspeed=10, default_accel=100, default_maxpos=5000, module_range=255, simulator=None, broker=None):
         """
             TMCL command class, defines all motion command as well as command builder, serial packet builder, command sender, response parser.
             It also includes a Scanner to automatically detect available motors through the serial interface.
+            If simulator (a simbus.SimulatedBus) is given, it is used instead of the serial port.
+            If broker (Unix socket path of a broker.BrokerServer) is given, the bus of the process serving it is used.
         """
         self.port = port
+        self.simulator = simulator
+        self.broker = broker
         self.baudrate = baudrate
         self.protocol = None
-        self.connected={}
+        self.connected=MotorRegistry() # addr -> params, dict-like, hot fields in typed arrays (see registry.py)
         self.scanned={}
         self.module_range=module_range
         self.default_maxspeed = default_maxspeed
@@ -112,7 +189,24 @@ class MotorManager:
         self.default_accel = default_accel
         self.default_maxpos = default_maxpos
         self.command_queue = asyncio.Queue()
-        self.motor_queues={}
+        self.motor_queues=self.connected.queues # list indexed by address, None for empty slots
+        self._motor_tasks={}
+        self.transport = None
+        self.last_commanded={} # addr -> last commanded state, replayed after a serial reconnect
+        self._link_down = asyncio.Event()
+        self.luts=self.connected.luts # list indexed by address: {"speed": table, "pos": table}, DMX value -> speed/position
+        self._fine_luts={} # addr -> 16-bit tables, built on demand
+        self.motion = None # optional motion.MotionTracker, notified of every move
+        self.control = None # optional control.ControlLoop, fixed-rate output of the desired state of the motors
+        self._inflight_reads={} # (addr, cmd, type, bank) -> reply future of the pending read
+        self._recent_reads={} # addr -> {(cmd, type, bank): (time, reply)}
+        self.coalesced_reads=0 # reads answered without a bus transaction of their own
+        self.state_version=0 # bumped when the last commanded state of a motor changes, ETag of /p/commanded
+        self.events = None # optional events.EventBus, gets commands, replies, topology and telemetry changes
+        self.telemetry={} # addr -> last position/temperature read on the bus and transaction counters, for monitoring without extra bus traffic
+        self.bus=BusBudget(baudrate) # bus time per transaction and utilization, admission of low priority commands under load
+        self.downloading=set() # modules in program download mode (tmclprog.py), other frames to them are refused instead of stored
+        self.panics=0 # panic() calls, a program download in progress gives up on a panic
 
     async def initialize(self):
         logging.info("Initializing connected motors, please wait ...")
@@ -144,12 +238,7 @@ class MotorManager:
                 # Keep only addresses that actually exist on the bus
                 for addr, v in loaded_int.items():
                     if addr in self.scanned:
-                        conn[addr] = {
-                            "maxspeed": int(v.get("maxspeed", self.default_maxspeed)),
-                            "accel": int(v.get("accel", self.default_accel)),
-                            "maxpos": int(v.get("maxpos", self.default_maxpos)),
-                            "minspeed": int(v.get("minspeed", self.default_minspeed)),
-                        }
+                        conn[addr] = self.motor_params(v, addr)
                     else:
                         logging.warning(f"Configured motor {addr} found in default.json but not present on bus; skipping")
 
@@ -160,29 +249,181 @@ class MotorManager:
         # For any scanned address not present in the loaded configuration, add defaults
         for addr in self.scanned:
             if addr not in conn:
-                conn[addr] = {
-                    "maxspeed": self.default_maxspeed,
-                    "accel": self.default_accel,
-                    "maxpos": self.default_maxpos,
-                    "minspeed": self.default_minspeed,
-                }
+                conn[addr] = self.motor_params()
                 logging.info(f"Added scanned motor {addr} with default params")
 
         # Create per-motor queues/workers. Do not send SAP/MST commands here if transport/protocol
         # isn't ready — defer hardware commands until `start()` has been called and the protocol is available.
-        for a in list(conn.keys()):
+        for a, params in conn.items():
+            self.add_motor(a, params)
+        self._publish(ConfigApplied, name="default" if os.path.exists(default_path) else "defaults", motors=sorted(conn))
+        logging.info("Initialization complete")
+
+    def motor_params(self, v=None, addr=None):
+        """Build a clean host-side parameter dict for a motor, from a config/snapshot entry or from the defaults."""
+        v = v or {}
+        params = {
+            "maxspeed": int(v.get("maxspeed", self.default_maxspeed)),
+            "accel": int(v.get("accel", self.default_accel)),
+            "maxpos": int(v.get("maxpos", self.default_maxpos)),
+            "minspeed": int(v.get("minspeed", self.default_minspeed)),
+        }
+        for key in ("speed_curve", "pos_curve"):
+            try:
+                params[key] = curves.normalize_curve(v.get(key))
+            except ValueError as e:
+                logging.warning(f"Invalid {key} for motor {addr} in config, using linear: {e}")
+                params[key] = dict(curves.DEFAULT_CURVE)
+        return params
+
+    @property
+    def version(self):
+        """Version of `connected`, bumped on every change (motors added/removed, parameters), used for API ETags."""
+        return self.connected.version
+
+    def add_motor(self, addr, params):
+        """Register a motor: store its params, build its lookup tables and start its command worker."""
+        found = self.connected.add(addr, params)
+        if found:
+            self._publish(MotorFound, addr=addr)
+        self.rebuild_luts(addr)
+        if self.motor_queues[addr] is None:
             try:
                 q = asyncio.Queue(maxsize=1)
-                self.motor_queues[a] = q
-                asyncio.create_task(self._motor_worker(a, q))
+                self.motor_queues[addr] = q
+                self._motor_tasks[addr] = asyncio.create_task(self._motor_worker(addr, q))
             except Exception as e:
-                logging.error(f"Failed to create worker for motor {a}: {e}")
+                logging.error(f"Failed to create worker for motor {addr}: {e}")
+
+    def remove_motor(self, addr):
+        """Forget a motor that left the bus and stop its command worker."""
+        # also empties the lookup tables and the queue of the slot
+        if self.connected.remove(addr):
+            self._publish(MotorLost, addr=addr)
+        self.telemetry.pop(addr, None)
+        self._fine_luts.pop(addr, None)
+        self.bus.forget(addr)
+        task = self._motor_tasks.pop(addr, None)
+        if task:
+            task.cancel()
+
+    def restore(self, snapshot: dict):
+        """
+            Warm start: register the motors of a persisted runtime snapshot without scanning the bus.
+            Call validate_topology() afterwards to check the snapshot against the real bus.
+        """
+        for k, v in snapshot.get("motors", {}).items():
+            try:
+                addr = int(k)
+            except Exception:
+                logging.warning(f"Invalid address key in runtime snapshot: {k}")
+                continue
+            self.add_motor(addr, self.motor_params(v, addr))
+        for k, target in snapshot.get("targets", {}).items():
+            try:
+                self._remember(int(k), target=target)
+            except Exception:
+                continue
+        self._publish(ConfigApplied, name="runtime snapshot", motors=sorted(self.connected))
+        logging.info(f"Restored {len(self.connected)} modules from runtime snapshot")
+
+    async def validate_topology(self):
+        """
+            Check restored motors against the bus in the background.
+            Known addresses are probed and get their speed/accel pushed first, then a full scan
+            adds new modules with default params and drops the ones that are gone.
+        """
+        for addr in self.connected.addrs:
+            if await self.gio(addr, 9, 1) is None:
+                logging.warning(f"Restored motor {addr} did not answer, will be confirmed by the background scan")
+                continue
+            if addr in self.connected:
+                await self.sap(addr, 4, self.connected.maxspeed[addr])
+                await self.sap(addr, 5, self.connected.accel[addr])
+        logging.info("Known modules validated, scanning the bus in background")
+        found = await self.scan()
+        for addr in self.connected.addrs:
+            if addr not in found:
+                logging.warning(f"Motor {addr} from runtime snapshot not present on bus; removing")
+                self.remove_motor(addr)
+        for addr in found:
+            if addr not in self.connected:
+                self.add_motor(addr, self.motor_params())
+                logging.info(f"Added scanned motor {addr} with default params")
+        logging.info(f"Topology validated - {len(self.connected)} modules")
 
-        self.connected = conn
-        logging.info("Initialization complete")
+    def rebuild_luts(self, addr):
+        """
+            Bake the DMX response curves of a motor into lookup tables.
+            CH1 (1-255) maps onto minspeed..maxspeed, CH4 (2-255) maps onto 1..maxpos.
+            Must be called whenever one of these parameters or a curve changes.
+        """
+        self.luts[addr] = self._build_luts(self.connected[addr])
+        self._fine_luts.pop(addr, None)
+
+    @staticmethod
+    def _build_luts(params):
+        speed_curve = curves.normalize_curve(params.get("speed_curve"))
+        pos_curve = curves.normalize_curve(params.get("pos_curve"))
+        return {
+            "speed": curves.build_table(speed_curve, 1, 255, params["minspeed"], params["maxspeed"]),
+            "pos": curves.build_table(pos_curve, 2, 255, 1, params["maxpos"]),
+        }
+
+    def fine_luts(self, addr):
+        """Return the 65536-entry (16-bit channel) lookup tables of a motor, building them on first use."""
+        tables = self._fine_luts.get(addr)
+        if tables is None:
+            params = self.connected[addr]
+            speed_curve = curves.normalize_curve(params.get("speed_curve"))
+            pos_curve = curves.normalize_curve(params.get("pos_curve"))
+            tables = {
+                "speed": curves.build_table(speed_curve, 257, 65535, params["minspeed"], params["maxspeed"], size=65536),
+                "pos": curves.build_table(pos_curve, 514, 65535, 1, params["maxpos"], size=65536),
+            }
+            self._fine_luts[addr] = tables
+        return tables
+
+    def set_motor_param(self, addr, key, value):
+        """
+            Update a host-side motor parameter and rebuild its lookup tables if the DMX mapping changed.
+            The tables are built first: a value they can not be built from raises ValueError and changes nothing.
+        """
+        params = self.connected[addr]
+        if key in ("speed_curve", "pos_curve"):
+            value = curves.normalize_curve(value)
+        luts = None
+        if key in ("maxspeed", "minspeed", "maxpos", "speed_curve", "pos_curve"):
+            try:
+                if key in ("maxspeed", "minspeed", "maxpos"):
+                    value = int(value)
+                luts = self._build_luts(dict(params, **{key: value}))
+            except (TypeError, OverflowError) as e:
+                raise ValueError(f"Invalid {key} {value!r}: {e}")
+        params[key] = value
+        if luts is not None:
+            self.luts[addr] = luts
+            self._fine_luts.pop(addr, None)
+        self._publish(ParamChanged, addr=addr, key=key, value=value)
 
     async def start(self):
+        await self._open_serial()
+
+        # Start the background worker that sends TMCL commands
+        asyncio.create_task(self._serial_worker())
+        # Start the supervisor that reopens the serial port if the adapter drops
+        asyncio.create_task(self._serial_supervisor())
+
+    async def _open_serial(self):
         loop = asyncio.get_running_loop()
+        if self.broker is not None:
+            import broker
+            self.transport, self.protocol = await broker.create_broker_connection(loop, lambda: broker.BrokerClientProtocol(self), self.broker)
+            return
+        if self.simulator is not None:
+            import simbus
+            self.transport, self.protocol = await simbus.create_simulated_connection(loop, lambda: MotorProtocol(self), self.simulator)
+            return
         transport, protocol = await serial_asyncio.create_serial_connection(
             loop,
             lambda: MotorProtocol(self),
@@ -192,17 +433,132 @@ class MotorManager:
         self.transport = transport
         self.protocol = protocol
 
-        # Start the background worker that sends TMCL commands
-        asyncio.create_task(self._serial_worker())
+    def serial_lost(self, protocol):
+        """Called by MotorProtocol when its transport is gone, wakes up the supervisor."""
+        if protocol is not self.protocol:
+            return
+        self.transport = None
+        self.bus.forget()
+        self._link_down.set()
+
+    async def _serial_supervisor(self):
+        """
+            Reopen the serial port with exponential backoff whenever the link drops,
+            then revalidate the known modules and replay their last commanded state.
+            No bus scan is done here, only addresses already in self.connected are probed.
+        """
+        while True:
+            await self._link_down.wait()
+            t0 = asyncio.get_running_loop().time()
+            delay = reconnect_min_delay
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    await self._open_serial()
+                    break
+                except Exception as e:
+                    logging.debug(f"Serial reconnect attempt {attempt} on {self.port} failed: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, reconnect_max_delay)
+            self._link_down.clear()
+            await self._replay_state()
+            elapsed = asyncio.get_running_loop().time() - t0
+            logging.info(f"Serial link restored on {self.port} after {attempt} attempt(s) in {elapsed:.2f}s")
+
+    async def _replay_state(self):
+        """Probe every known module once and push back its last commanded speed, accel and target position."""
+        for addr in self.connected.addrs:
+            resp = await self.gio(addr, 9, 1)
+            if resp is None:
+                logging.warning(f"Motor {addr} did not answer after serial reconnect")
+                continue
+            state = self.last_commanded.get(addr)
+            if not state:
+                continue
+            if "maxspeed" in state:
+                await self.sap(addr, 4, state["maxspeed"])
+            if "accel" in state:
+                await self.sap(addr, 5, state["accel"])
+            if state.get("target") is not None:
+                await self.mvp(addr, 0, 0, state["target"])
+            logging.debug(f"Replayed state {state} on motor {addr}")
+
+    def _track(self, addr, cmd, param, value, external=True):
+        """
+            Bookkeeping of a motion command before it is sent: last commanded state (replayed after a reconnect), motion tracking,
+            and the state the control loop believes sent, for commands that do not come from the loop itself (external).
+        """
+        if external and self.control is not None:
+            self.control.note_sent(addr, cmd, param, value)
+        if cmd in (1, 2, 3): # ROR, ROL, MST
+            self._remember(addr, target=None)
+            if self.motion:
+                self.motion.notify_stop(addr, "rotating" if cmd != 3 else "stopped")
+        elif cmd == 4: # MVP
+            self._remember(addr, target=value if param == 0 else None)
+            if self.motion:
+                self.motion.notify_move(addr, value if param == 0 else None)
+        elif cmd == 5 and param == 4:
+            self._remember(addr, maxspeed=value)
+        elif cmd == 5 and param == 5:
+            self._remember(addr, accel=value)
+        elif cmd == 13 and param == 0: # RFS start, the motor heads for its reference switch
+            self._remember(addr, target=None)
+            if self.motion:
+                self.motion.notify_stop(addr, "homing")
+
+    async def send_batch(self, commands, external=True):
+        """
+            Send motion commands [(addr, cmd, type, bank, value), ...] back to back (see transact_many) with the same
+            bookkeeping as the single command methods. Returns the parsed replies. external=False for the frames of the control loop.
+        """
+        frames = []
+        refused = [c[0] in self.downloading for c in commands] # see _serial_worker
+        for (addr, cmd, param, bank, value), skip in zip(commands, refused):
+            if skip:
+                continue
+            self._track(addr, cmd, param, value, external)
+            self._forget_reads(addr)
+            frames.append(self.tmcl_packet_builder(addr, cmd, param, bank, value))
+        sent = iter(await self.protocol.transact_many(frames) if self.protocol is not None else [None] * len(frames))
+        replies = [None if skip else next(sent) for skip in refused]
+        for (addr, cmd, param, bank, value), reply in zip(commands, replies):
+            self._observe(addr, cmd, param, bank, reply)
+            self.bus.note(addr, cmd, param, value, reply)
+        return replies
+
+    def submit(self, addr, **desired) -> bool:
+        """
+            Set the desired state of a motor (maxspeed, target, rotate), sent by the control loop at its next tick. See control.py
+            Returns False (nothing done) when no control loop runs.
+        """
+        if self.control is None:
+            return False
+        self.control.submit(addr, **desired)
+        return True
+
+    def _remember(self, addr, **state):
+        """Keep the last commanded state of a motor so it can be replayed after a reconnect."""
+        current = self.last_commanded.setdefault(addr, {})
+        if any(k not in current or current[k] != v for k, v in state.items()):
+            current.update(state)
+            self.state_version += 1
 
     async def _serial_worker(self):
         logging.debug("_serial_worker")
         while True:
             command, future = await self.command_queue.get()
+            if future.done():
+                continue # caller gave up (cancelled) before its turn
+            if command[0] in self.downloading:
+                future.set_exception(RuntimeError(f"Motor {command[0]} is in program download mode"))
+                continue # it would be stored in the program EEPROM instead of executed
             if self.transport:
                 await self.protocol.send_command(command, future)
-            else:
+            elif not future.done():
                 future.set_exception(RuntimeError("No transport available"))
+            self.bus.hold(0.005) # the pacing gap is sender time too
             await asyncio.sleep(0.005)
 
     async def _motor_worker(self, addr, queue):
@@ -280,11 +636,13 @@ class MotorManager:
             4:  "Invalid value",
             5:  "Configuration EEPROM locked",
             6:  "Command not available",
-            101: "Command loaded into TMCL program EEPROM"
         }
 
         if status == 100:
             logging.debug(f"{status} - TMCL command {cmd} executed successfully")
+        elif status == 101:
+            # download mode (see tmclprog.py): the instruction was stored in the program EEPROM, not executed
+            logging.debug(f"{status} - TMCL command {cmd} loaded into TMCL program EEPROM")
         elif status in status_messages:
             logging.error(status_messages[status])
             return None
@@ -324,13 +682,121 @@ class MotorManager:
         return found
 
     async def tmcl_command_builder (self, addr:int, cmd:int, param:int, bank:int, value:int, name:str="TMCL"):
+        if cmd in READ_COMMANDS:
+            return await self._read(addr, cmd, param, bank, value, name)
+        send, reply = await self.bus.admit(self, addr, cmd, param, bank, value)
+        if not send:
+            return reply # repeated SAP merged under load
+        # a write makes the reads of this module stale
+        self._forget_reads(addr)
         command=self.tmcl_packet_builder(addr,cmd,param,bank,value)
         future= asyncio.get_event_loop().create_future()
+        # the serial worker is the only sender, the reply (or the timeout) resolves the future
         await self.command_queue.put((command, future))
         logging.debug(f"{name} {cmd} -> addr:{addr}, param:{param}, bank:{bank}, val:{value}")
-        r = await self.protocol.send_command(command, future)
-        return r
+        self._publish(CommandSent, addr=addr, cmd=cmd, param=param, bank=bank, value=value)
+        try:
+            reply = await future
+        except Exception:
+            reply = None
+        self._observe(addr, cmd, param, bank, reply)
+        self.bus.note(addr, cmd, param, value, reply)
+        return reply
+
+    async def _read(self, addr:int, cmd:int, param:int, bank:int, value:int, name:str):
+        """
+            Single-flight read: identical reads (same addr/cmd/type/bank) pending on the bus, or completed
+            less than read_cache_ttl ago, share one transaction and its reply.
+        """
+        loop = asyncio.get_running_loop()
+        key = (addr, cmd, param, bank)
+        recent = self._recent_reads.get(addr, {}).get(key[1:])
+        if recent is not None and loop.time() - recent[0] <= read_cache_ttl:
+            self.coalesced_reads += 1
+            return recent[1]
+        future = self._inflight_reads.get(key)
+        if future is None:
+            send, reply = await self.bus.admit(self, addr, cmd, param, bank, value)
+            if not send:
+                return reply # stale reply or shed under load
+            future = self._inflight_reads.get(key) # an identical read may have been sent while this one was deferred
+        if future is None:
+            future = loop.create_future()
+            self._inflight_reads[key] = future
+            future.add_done_callback(lambda f: self._read_done(key, f))
+            self.command_queue.put_nowait((self.tmcl_packet_builder(addr,cmd,param,bank,value), future))
+            logging.debug(f"{name} {cmd} -> addr:{addr}, param:{param}, bank:{bank}, val:{value}")
+            self._publish(CommandSent, addr=addr, cmd=cmd, param=param, bank=bank, value=value)
+        else:
+            self.coalesced_reads += 1
+        try:
+            # shielded: a caller giving up must not cancel the reply other callers wait for
+            return await asyncio.shield(future)
+        except Exception:
+            return None
+
+    def _read_done(self, key, future):
+        ok = not future.cancelled() and future.exception() is None
+        self._observe(*key, future.result() if ok else None)
+        if self._inflight_reads.get(key) is future:
+            del self._inflight_reads[key]
+            if not future.cancelled() and future.exception() is None and future.result() is not None:
+                self._recent_reads.setdefault(key[0], {})[key[1:]] = (asyncio.get_running_loop().time(), future.result())
+
+    def _publish(self, event_class, **data):
+        # the event is only built if somebody listens to it (CommandSent/ReplyReceived come with every frame)
+        if self.events is not None and self.events.wants(event_class):
+            self.events.publish(event_class(**data))
+
+    def _observe(self, addr, cmd, param, bank, reply):
+        """Update the telemetry cache of a known motor from one bus transaction (reply None: no valid reply)."""
+        if addr not in self.connected:
+            return # scans and panic sweeps of empty addresses
+        t = self.telemetry.get(addr)
+        if t is None:
+            t = self.telemetry[addr] = {"pos": None, "pos_at": None, "temp": None, "temp_at": None, "tx": 0, "errors": 0, "consecutive_errors": 0}
+        t["tx"] += 1
+        if reply is None:
+            t["errors"] += 1
+            t["consecutive_errors"] += 1
+            self._publish(CommError, addr=addr, cmd=cmd, consecutive=t["consecutive_errors"])
+            return
+        t["consecutive_errors"] = 0
+        self._publish(ReplyReceived, addr=addr, cmd=cmd, status=reply[2], value=reply[4])
+        if cmd == 6 and param == 1:
+            t["pos_at"] = time.time()
+            if t["pos"] != reply[4]:
+                t["pos"] = reply[4]
+                self._publish(PositionUpdated, addr=addr, pos=reply[4])
+        elif cmd == 15 and param == 9 and bank == 1:
+            t["temp_at"] = time.time()
+            if t["temp"] != reply[4]:
+                t["temp"] = reply[4]
+                self._publish(TemperatureUpdated, addr=addr, temp=reply[4])
+
+    def _forget_reads(self, addr):
+        self._recent_reads.pop(addr, None)
+        for key in [k for k in self._inflight_reads if k[0] == addr]:
+            # reads queued before the write still get their reply, later reads go to the bus again
+            del self._inflight_reads[key]
         
+    async def transact_many(self, frames, chunk:int=32):
+        """
+            Send many TMCL frames (see tmcl_packet_builder) as pipelined transactions, return their parsed replies.
+            The bus is held for `chunk` frames at a time, queued commands (panic, Art-Net) get through in between.
+            Frames sent here bypass the shared reads of tmcl_command_builder.
+        """
+        replies = []
+        for i in range(0, len(frames), chunk):
+            if self.protocol is None:
+                replies.extend([None] * (len(frames) - i))
+                break
+            part = frames[i:i + chunk]
+            refused = [f[0] in self.downloading for f in part] # see _serial_worker
+            sent = iter(await self.protocol.transact_many([f for f, skip in zip(part, refused) if not skip]))
+            replies.extend(None if skip else next(sent) for skip in refused)
+        return replies
+
 ## TMCL COMMAND DEFINITION
 
     async def ror(self, addr:int, vel:int):
@@ -339,6 +805,7 @@ class MotorManager:
             Args: addr = module address, vel= velocity
             TMCL ROR command (1)
         """
+        self._track(addr, 1, 0, vel)
         return await self.tmcl_command_builder(addr=addr, cmd=1,param=0,bank=0,value=vel,name="ROR")
 
     async def rol(self, addr:int, vel:int):
@@ -347,12 +814,14 @@ class MotorManager:
             Args: addr = module address, vel= velocity
             TMCL ROL command (2)
         """
+        self._track(addr, 2, 0, vel)
         return await self.tmcl_command_builder(addr=addr, cmd=2,param=0,bank=0,value=vel,name="ROL")
 
     async def mst(self, addr:int):
         """ Stop motor movement
             Args: addr = module address
             TMCL MST command (3)"""
+        self._track(addr, 3, 0, 0)
         return await self.tmcl_command_builder(addr=addr, cmd=3,param=0,bank=0,value=0,name="MST")
  
     async def mvp (self, addr:int, param:int, bank:int, value:int):
@@ -369,6 +838,7 @@ class MotorManager:
                 2= COORD (go to coordinate), bank = 0...255, value= coordinate number (0..20)
             TMCL SGP command (4)
         """
+        self._track(addr, 4, param, value)
         return await self.tmcl_command_builder(addr=addr, cmd=4,param=param,bank=bank,value=value,name="MVP")
 
     async def sap(self, addr:int, param:int, value:int):
@@ -377,6 +847,7 @@ class MotorManager:
             Args: addr = module address, param= type of instruction, value= intendent value of the paramater
             TMCL SAP command (5)
         """
+        self._track(addr, 5, param, value)
         return await self.tmcl_command_builder(addr=addr, cmd=5,param=param,bank=0,value=value,name="SAP")
 
     async def gap(self, addr:int, param:int):
@@ -446,6 +917,7 @@ class MotorManager:
 
             TMCL RFS command (13)
         """
+        self._track(addr, 13, param, 0)
         return await self.tmcl_command_builder(addr=addr, cmd=13,param=param,bank=0,value=0,name="RFS")
 
     async def sio(self, addr:int, param:int, value:int):
@@ -492,7 +964,13 @@ class MotorManager:
 
     #### CUSTOM COMMANDE #####
     async def panic(self):
-        for i in range(0,256):
+        self.panics += 1 # program downloads give up at their next chunk
+        # known motors first so they stop within milliseconds, then sweep every other address
+        known = self.connected.addrs
+        for i in known:
             await self.mst(i)
+        for i in range(0,256):
+            if i not in known:
+                await self.mst(i)
 
     
@@ -1,7 +1,11 @@
 
 import asyncio
 import logging
+import socket
 import struct
+import time
+from array import array
+from events import UniverseChanged, DmxReceived
 
 """
 CH1    
@@ -22,6 +26,9 @@ CH5     Homing                  002-255     go to position 0
 
 ARTNET_HEADER = b"Art-Net\x00"
 OPCODE_DMX = 0x5000  # little-endian
+# ArtDmx header: ID, OpCode (LE), ProtVer+Sequence+Physical (skipped), universe (LE), length (BE, as two bytes)
+ARTDMX_HEADER = struct.Struct("<8sH4xHBB")
+ARTDMX_HEADER_SIZE = ARTDMX_HEADER.size # 18
 
 class utils():
     def map_value(x, src_min, src_max, dst_min, dst_max):
@@ -29,11 +36,57 @@ class utils():
             return dst_min
         return ((x - src_min) / (src_max - src_min)) * (dst_max - dst_min) + dst_min
     
+class ArtNetStats:
+    __slots__ = ("received", "accepted", "filtered", "superseded", "batches", "dropped", "pps", "_window_start", "_window_count")
+
+    def __init__(self):
+        """
+            Ingestion counters: packets received, handed to the decoder, filtered out, superseded by a newer frame in the same batch,
+            and motor commands of a frame dropped because the motor queue was full.
+        """
+        self.received = 0
+        self.accepted = 0
+        self.filtered = 0
+        self.superseded = 0
+        self.batches = 0
+        self.dropped = 0
+        self.pps = 0.0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    def tick(self, n=1):
+        self.received += n
+        self._window_count += n
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed >= 1.0:
+            self.pps = self._window_count / elapsed
+            self._window_start = now
+            self._window_count = 0
+
+    def report(self):
+        if time.monotonic() - self._window_start >= 2.0:
+            self.pps = 0.0 # no packet for a while
+        return {
+            "received": self.received,
+            "accepted": self.accepted,
+            "filtered": self.filtered,
+            "superseded": self.superseded,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "packets_per_second": round(self.pps, 1),
+        }
+
 class ArtNetProtocol(asyncio.DatagramProtocol):
+    source = "artnet" # name of the input in events
+
     def __init__(self, motor_manager=None, universe=0):
         self.enabled = True
         self.motor_manager = motor_manager
         self.universe = universe
+        self.stats = ArtNetStats()
+        self._last_dmx_data = None
+        self._last_ch1s = array("h", [-1]) * 256 # last CH1 value handled per motor address
     def disable (self):
         self.enabled=False
     def enable (self):
@@ -41,31 +94,39 @@ class ArtNetProtocol(asyncio.DatagramProtocol):
     def set_universe (self, new_universe:int):
         """Dynamically update artnet universe"""
         logging.info(f"Art-Net universe changed from {self.universe} to {new_universe}")
-        self.universe=new_universe
+        previous, self.universe = self.universe, new_universe
+        self._publish(UniverseChanged, universe=new_universe, previous=previous, source=self.source)
+
+    @property
+    def last_frame(self):
+        """Last DMX frame processed (bytes), None before the first one"""
+        return self._last_dmx_data
+
+    def _publish(self, event_class, **data):
+        events = getattr(self.motor_manager, "events", None)
+        if events is not None and events.wants(event_class):
+            events.publish(event_class(**data))
 
     def connection_made(self, transport):
         self.transport = transport
         logging.info(f"Art-Net listener listening on {transport.get_extra_info('sockname')}")
 
     def datagram_received(self, data: bytes, addr):
-        if not self.enabled:
-            return
-        if not data.startswith(ARTNET_HEADER):
+        self.stats.tick()
+        if not self.enabled or len(data) < ARTDMX_HEADER_SIZE:
             return
-        opcode = struct.unpack("<H", data[8:10])[0]
-        if opcode != OPCODE_DMX:
+        header, opcode, universe, len_hi, len_lo = ARTDMX_HEADER.unpack_from(data)
+        if header != ARTNET_HEADER or opcode != OPCODE_DMX or universe != self.universe:
+            self.stats.filtered += 1
             return
-        universe = struct.unpack("<H", data[14:16])[0]
-        if universe != self.universe:
-            return
-        length = struct.unpack(">H", data[16:18])[0]
+        length = (len_hi << 8) | len_lo
         dmx_data = data[18:18+length]
+        self.stats.accepted += 1
         self._process_dmx(dmx_data, self.motor_manager)
 
     def error_received(self, exc):
         logging.error(f"Art-Net receive error: {exc}")
 
-
     def _process_dmx(self, dmx_data: bytes, motor_manager):
         """
         Process incoming DMX data and trigger TMCL commands.
@@ -77,23 +138,34 @@ class ArtNetProtocol(asyncio.DatagramProtocol):
             CH5 - homing
         """
         # --- DMX frame deduplication ---
-        if hasattr(self, "_last_dmx_data") and dmx_data == self._last_dmx_data:
+        if dmx_data == self._last_dmx_data:
             logging.debug("artnet dropped")
             return  # Drop identical frame silently
         self._last_dmx_data = dmx_data
+        self._publish(DmxReceived, universe=self.universe, source=self.source, data=bytes(dmx_data))
 
-        for motor_addr, connected in motor_manager.connected.items():
+        # registry arrays are indexed by motor address (see registry.py)
+        registry = motor_manager.connected
+        maxspeeds, all_luts, queues = registry.maxspeed, registry.luts, registry.queues
+        last_ch1s = self._last_ch1s
+        control = motor_manager.control
+        size = len(dmx_data)
+        for motor_addr in registry.addrs:
             base = motor_addr-1
-            if base <0 or base+4 >=len(dmx_data):
+            if base <0 or base+4 >=size:
                 continue
             try:
                 ch1, ch2, ch3, ch4, ch5 = dmx_data[base:base+5]
                 logging.debug(f"{motor_addr,ch1,ch2,ch3,ch4,ch5}")
-                maxpos = connected.get("maxpos")
-                maxspeed = connected.get("maxspeed")
-                minspeed = connected.get("minspeed")
-                q= motor_manager.motor_queues.get(motor_addr)
-                if not q :
+                maxspeed = maxspeeds[motor_addr]
+                luts = all_luts[motor_addr]
+                if control is not None:
+                    # fixed-rate output: only update the desired state, the control loop sends it at its next tick
+                    if luts:
+                        self._submit_dmx(motor_manager, motor_addr, maxspeed, luts, ch1, ch2, ch3, ch4, ch5)
+                    continue
+                q= queues[motor_addr]
+                if not q or not luts:
                     continue
                 # --- Clear old pending commands ---
                 while not q.empty():
@@ -118,19 +190,15 @@ class ArtNetProtocol(asyncio.DatagramProtocol):
                 
                 # --- CH1: Change Speed (deduplicate per motor) ---
                 if 1 <= ch1 <= 255:
-                    # initialize per-motor last-value dict lazily
-                    if not hasattr(self, "_last_ch1s"):
-                        self._last_ch1s = {}
-                    last_ch1s = self._last_ch1s
-
                     # If this motor's CH1 is unchanged, skip queuing
-                    if last_ch1s.get(motor_addr) == ch1:
+                    if last_ch1s[motor_addr] == ch1:
                         pass
                     else:
-                        val = int(utils.map_value(ch1, 1, 255, minspeed, maxspeed))
+                        val = luts["speed"][ch1]
                         try:
                             q.put_nowait((motor_manager.sap, (motor_addr, 4, val)))
                         except Exception:
+                            self.stats.dropped += 1
                             logging.debug(f"Failed to queue SAP for motor {motor_addr}")
                         last_ch1s[motor_addr] = ch1
 
@@ -154,7 +222,7 @@ class ArtNetProtocol(asyncio.DatagramProtocol):
 
                 # --- CH4: Move to position ---
                 if ch4 >= 2:
-                    pos = int(utils.map_value(ch4, 2,255,1,maxpos ))
+                    pos = luts["pos"][ch4]
                     #asyncio.create_task(motor_manager.mvp(motor_addr, 0, 0, pos))
                     q.put_nowait((motor_manager.mvp, (motor_addr, 0,0, pos)))
 
@@ -164,8 +232,112 @@ class ArtNetProtocol(asyncio.DatagramProtocol):
                     q.put_nowait((motor_manager.mvp, (motor_addr, 0,0, 0)))
             except IndexError:
                 continue
+            except asyncio.QueueFull:
+                # the rest of the channels of this motor are not handled either
+                self.stats.dropped += 1
+                logging.debug(f"Motor {motor_addr} queue full, DMX command dropped")
             except Exception as e:
                 logging.warning(f"Error processing DMX for motor {motor_addr}: {e}")
 
+    @staticmethod
+    def _submit_dmx(motor_manager, motor_addr, maxspeed, luts, ch1, ch2, ch3, ch4, ch5):
+        """Same channel layout and priorities as _process_dmx, as a desired state for the control loop (control.py)."""
+        if 1 <= ch1 <= 255:
+            motor_manager.submit(motor_addr, maxspeed=luts["speed"][ch1])
+        elif 3 <= ch2 <= 255:
+            motor_manager.submit(motor_addr, rotate=int(utils.map_value(ch1, 3,255,1, maxspeed)))
+        elif 1 <= ch2 <= 2:
+            motor_manager.submit(motor_addr, rotate=0)
+        elif 3 <= ch3 <= 255:
+            motor_manager.submit(motor_addr, rotate=-int(utils.map_value(ch1, 3,255,1, maxspeed)))
+        elif 1 <= ch3 <= 2:
+            motor_manager.submit(motor_addr, rotate=0)
+        if ch4 >= 2:
+            motor_manager.submit(motor_addr, target=luts["pos"][ch4])
+        if ch5 >= 2:
+            motor_manager.submit(motor_addr, target=0)
+
+class ArtNetBatchReader:
+    def __init__(self, protocol: ArtNetProtocol, sock: socket.socket, batch: int = 64, bufsize: int = 1024):
+        """
+            Batched Art-Net ingestion, used instead of the asyncio datagram transport at high packet rates.
+            When the socket becomes readable, it is drained (up to `batch` datagrams per wake up) into
+            preallocated buffers, packets are filtered on header, opcode and universe straight from the
+            buffer, and only the newest frame of the patched universe is handed to protocol._process_dmx.
+            Acts as the transport of the protocol (get_extra_info, close).
+        """
+        self.protocol = protocol
+        self.sock = sock
+        self.batch = batch
+        self._buffers = [bytearray(bufsize) for _ in range(batch)]
+        self._views = [memoryview(b) for b in self._buffers]
+        self._loop = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self.sock.setblocking(False)
+        self._loop.add_reader(self.sock.fileno(), self._drain)
+        self.protocol.connection_made(self)
+
+    def get_extra_info(self, name, default=None):
+        if name == "sockname":
+            return self.sock.getsockname()
+        if name == "socket":
+            return self.sock
+        return default
 
+    def close(self):
+        if self._loop is not None:
+            self._loop.remove_reader(self.sock.fileno())
+            self._loop = None
+        self.sock.close()
+
+    def _drain(self):
+        protocol = self.protocol
+        stats = protocol.stats
+        universe = protocol.universe
+        recv_into = self.sock.recv_into
+        newest = None
+        n = 0
+        for i in range(self.batch):
+            try:
+                nbytes = recv_into(self._buffers[i])
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                protocol.error_received(e)
+                break
+            n += 1
+            if nbytes < ARTDMX_HEADER_SIZE:
+                stats.filtered += 1
+                continue
+            header, opcode, univ, len_hi, len_lo = ARTDMX_HEADER.unpack_from(self._views[i])
+            if header != ARTNET_HEADER or opcode != OPCODE_DMX or univ != universe:
+                stats.filtered += 1
+                continue
+            if newest is not None:
+                stats.superseded += 1
+            newest = (i, min((len_hi << 8) | len_lo, nbytes - ARTDMX_HEADER_SIZE))
+        if n == 0:
+            return
+        stats.tick(n)
+        stats.batches += 1
+        if newest is None or not protocol.enabled:
+            return
+        i, length = newest
+        stats.accepted += 1
+        protocol._process_dmx(bytes(self._views[i][ARTDMX_HEADER_SIZE:ARTDMX_HEADER_SIZE + length]), protocol.motor_manager)
 
+async def start_batched_artnet(interface, port, universe, motor_manager=None, batch=64):
+    """Same as a datagram endpoint with ArtNetProtocol, but reading the socket through an ArtNetBatchReader."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        # room for a few batches worth of packets while the loop is busy
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    except OSError:
+        pass
+    sock.bind((interface, port))
+    protocol = ArtNetProtocol(motor_manager, universe)
+    reader = ArtNetBatchReader(protocol, sock, batch=batch)
+    reader.start()
+    return reader, protocol
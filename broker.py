@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import os
+import stat
+import struct
+from TMCL import MotorManager
+
+"""
+
+Serial bus broker
+Written for STRUCTURALS, 2025
+
+Only one process can open the serial port. With --broker_socket, the Kinelink that
+owns it also serves TMCL transactions on a local Unix socket, and other processes
+(maintenance scripts, diagnostics, a second Kinelink for another universe started
+with --broker_connect) use the bus through it instead of fighting for the port.
+
+Binary protocol, big endian, requests can be pipelined (sent without waiting for
+the previous replies), replies come back with the id of their request:
+
+    request     id (u32) | TMCL frame (9 bytes, see MotorManager.tmcl_packet_builder)
+    reply       id (u32) | status (u8) | TMCL reply frame (9 bytes, zeros without reply)
+
+    status      0 reply received, 1 no valid reply (timeout, error status, no
+                serial link), 2 invalid request (bad checksum), 3 refused: the
+                module is in program download mode (tmclprog.py)
+
+The requests of every client are queued together and sent in batches through the
+MotorManager of the owner (send_batch): one scheduler, the send lock of the serial
+protocol, interleaved with the owner's own traffic (Art-Net, API), with the same
+bookkeeping (last commanded state, shared reads, telemetry, bus budget).
+
+A client is a MotorManager with broker=<socket path>: BrokerClientProtocol stands in
+for MotorProtocol (send_command, transact_many), reconnects like a serial adapter.
+Unlike MotorProtocol.transact_many, a batch of a client is not atomic: the broker
+interleaves it with the traffic of the owner and of the other clients. Program
+download (which needs nothing else between 132 and 133) is refused over a broker,
+run it on the owner.
+
+"""
+
+REQUEST = struct.Struct(">I9s")
+REPLY = struct.Struct(">IB9s")
+OK, NO_REPLY, INVALID, REFUSED = 0, 1, 2, 3
+BATCH_MAX = 8 # requests sent per batch at most, the owner's commands get the bus in between
+client_timeout = 5.0 # seconds a client waits for a reply: the broker answers every request (bus timeouts apply there), this only covers a stuck broker
+
+def _frame(parsed) -> bytes:
+    """TMCL reply frame back from a parsed reply (reply_addr, addr, status, cmd, value)."""
+    data = bytearray(9)
+    data[0:8] = struct.pack(">BBBBi", *parsed)
+    data[8] = sum(data[0:8]) & 0xFF
+    return bytes(data)
+
+class BrokerConnection(asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.buffer = bytearray()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.clients.add(self)
+        logging.info(f"Broker client connected ({len(self.server.clients)} clients)")
+
+    def data_received(self, data):
+        self.buffer += data
+        while len(self.buffer) >= REQUEST.size:
+            rid, frame = REQUEST.unpack_from(self.buffer)
+            del self.buffer[:REQUEST.size]
+            if frame[8] != sum(frame[:8]) & 0xFF:
+                self.server.invalid += 1
+                self.reply(rid, INVALID, None)
+                continue
+            self.server.queue.put_nowait((self, rid, struct.unpack(">BBBBi", frame[:8])))
+
+    def reply(self, rid, status, parsed):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.write(REPLY.pack(rid, status, _frame(parsed) if parsed else bytes(9)))
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self.server.clients.discard(self)
+        logging.info(f"Broker client disconnected ({len(self.server.clients)} clients)")
+
+class BrokerServer:
+    def __init__(self, motor_manager, path):
+        """
+            Args:
+                motor_manager = MotorManager owning the serial port
+                path = Unix socket to serve the bus on (ie /run/kinelink/bus.sock)
+        """
+        self.motor_manager = motor_manager
+        self.path = str(path)
+        self.queue = asyncio.Queue()
+        self.clients = set()
+        self.requests = 0
+        self.batches = 0
+        self.no_reply = 0
+        self.invalid = 0
+        self.refused = 0
+        self._server = None
+        self._task = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            if not stat.S_ISSOCK(os.stat(self.path).st_mode):
+                raise RuntimeError(f"{self.path} exists and is not a socket")
+            os.unlink(self.path) # left behind by a previous run
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._server = await asyncio.get_running_loop().create_unix_server(lambda: BrokerConnection(self), self.path)
+        os.chmod(self.path, 0o660)
+        self._task = asyncio.create_task(self._run())
+        logging.info(f"Bus broker listening on {self.path}")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._server:
+            self._server.close()
+            for conn in list(self.clients):
+                conn.transport.close()
+            await self._server.wait_closed()
+            self._server = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < BATCH_MAX and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            downloading = self.motor_manager.downloading
+            if any(fields[0] in downloading for _, _, fields in batch):
+                # it would be stored in the program of the module, not executed: an error, not a reply
+                for conn, rid, fields in batch:
+                    if fields[0] in downloading:
+                        self.refused += 1
+                        conn.reply(rid, REFUSED, None)
+                batch = [b for b in batch if b[2][0] not in downloading]
+                if not batch:
+                    continue
+            try:
+                replies = await self.motor_manager.send_batch([fields for _, _, fields in batch])
+            except Exception as e:
+                logging.warning(f"Broker batch failed: {e}")
+                replies = [None] * len(batch)
+            self.batches += 1
+            self.requests += len(batch)
+            for (conn, rid, _), reply in zip(batch, replies):
+                if reply is None:
+                    self.no_reply += 1
+                conn.reply(rid, OK if reply is not None else NO_REPLY, reply)
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "clients": len(self.clients),
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch": round(self.requests / self.batches, 2) if self.batches else None,
+            "no_reply": self.no_reply,
+            "invalid": self.invalid,
+            "refused": self.refused,
+            "queued": self.queue.qsize(),
+        }
+
+class BrokerClientProtocol(asyncio.Protocol):
+    def __init__(self, motor_manager):
+        """Client side of the broker, same interface as TMCL.MotorProtocol for the MotorManager."""
+        self.motor_manager = motor_manager
+        self.transport = None
+        self.buffer = bytearray()
+        self.pending = {} # request id -> reply future
+        self._next_id = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        logging.info("Connected to the bus broker !")
+
+    def data_received(self, data):
+        self.buffer += data
+        while len(self.buffer) >= REPLY.size:
+            rid, status, frame = REPLY.unpack_from(self.buffer)
+            del self.buffer[:REPLY.size]
+            future = self.pending.pop(rid, None)
+            if future is None or future.done():
+                continue # the client gave up on it
+            if status != OK:
+                future.set_exception(asyncio.TimeoutError())
+                continue
+            try:
+                future.set_result(MotorManager.parse_tmcl_response(frame, frame[1], frame[3]))
+            except Exception as e:
+                future.set_exception(e)
+
+    def connection_lost(self, exc):
+        logging.warning("Bus broker connection lost")
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc or ConnectionError("Bus broker connection lost"))
+        self.pending.clear()
+        self.transport = None
+        self.motor_manager.serial_lost(self)
+
+    def _send(self, command):
+        """Write one request, returns its id and reply future."""
+        future = asyncio.get_running_loop().create_future()
+        self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+        self.pending[self._next_id] = future
+        self.transport.write(REQUEST.pack(self._next_id, bytes(command)))
+        return self._next_id, future
+
+    async def _reply(self, rid, future):
+        expire = asyncio.get_running_loop().call_later(client_timeout, _expire, future)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise
+            return None
+        except Exception:
+            return None
+        finally:
+            expire.cancel()
+            self.pending.pop(rid, None)
+
+    async def send_command(self, command, future):
+        if self.transport is None:
+            if not future.done():
+                future.set_exception(RuntimeError("No transport available"))
+            return None
+        reply = await self._reply(*self._send(command))
+        if not future.done():
+            if reply is None:
+                future.set_exception(asyncio.TimeoutError())
+            else:
+                future.set_result(reply)
+        return reply
+
+    async def transact_many(self, commands, stop_on_missing=False):
+        """
+            Pipelined: every request is written at once, the broker batches them. Not atomic, other traffic
+            reaches the bus in between. With stop_on_missing, the replies after the first missing one are dropped
+            (the requests are already sent).
+        """
+        if self.transport is None:
+            return [None] * len(commands)
+        sent = [self._send(command) for command in commands]
+        replies = list(await asyncio.gather(*(self._reply(rid, f) for rid, f in sent)))
+        if stop_on_missing and None in replies:
+            first = replies.index(None)
+            replies[first:] = [None] * (len(replies) - first)
+        return replies
+
+def _expire(future):
+    if not future.done():
+        future.set_exception(asyncio.TimeoutError())
+
+async def create_broker_connection(loop, protocol_factory, path):
+    """Same contract as serial_asyncio.create_serial_connection, over the Unix socket of a BrokerServer."""
+    return await loop.create_unix_connection(protocol_factory, str(path))
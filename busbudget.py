@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from control import FRAME_BITS, TURNAROUND
+
+"""
+
+Serial bus time budget
+Written for STRUCTURALS, 2025
+
+Every TMCL transaction costs bus time: 9 bytes out, 9 bytes back (wire time, fixed by
+the baudrate) plus the turnaround of the module. BusBudget calibrates that cost from
+the round trip times measured by MotorProtocol (moving average of the replies, the
+turnaround is what exceeds the wire time) and tracks the bus utilization over a
+sliding window: the share of the window the sender was busy (transactions, pacing
+gaps of the command queue, timeouts).
+
+Above `threshold` utilization, commands of known motors go through admission:
+
+    critical    MST, RFS stop                               always sent
+    motion      ROR, ROL, MVP, SAP speed/accel, RFS start   always sent
+    config      other writes                                always sent
+    telemetry   GAP, GGP, GIO, RFS status                   merged, deferred or shed
+
+    merge   a speed/accel SAP repeating the value last executed by the module is answered
+            with its previous reply, a read of a value read less than `stale_ttl`
+            ago is answered with that (stale) reply
+    defer   other reads wait (out of the command queue) for the utilization to go
+            back under the threshold, at most `max_defer` seconds
+    shed    a read still waiting past `max_defer` while the utilization is above
+            `shed_threshold` returns None, like a read without reply
+
+Motion frames (DMX, API, OSC, control loop) are never held back: under overload the
+bus time goes to them, and the telemetry of the UI gets older instead of the DMX
+commands timing out.
+
+"""
+
+CRITICAL, MOTION, CONFIG, TELEMETRY = range(4)
+PRIORITY_NAMES = ("critical", "motion", "config", "telemetry")
+DEFER_STEP = 0.01 # seconds between two looks at the utilization of a deferred read
+MERGED_SAPS = (4, 5) # SAP types that are pure settings (max speed, accel): repeating one changes nothing
+
+def priority(cmd: int, param: int) -> int:
+    if cmd == 3 or (cmd == 13 and param == 1):
+        return CRITICAL
+    if cmd in (1, 2, 4) or (cmd == 5 and param in (4, 5)) or (cmd == 13 and param == 0):
+        return MOTION
+    if cmd in (6, 10, 15) or (cmd == 13 and param == 2):
+        return TELEMETRY
+    return CONFIG
+
+class BusBudget:
+    def __init__(self, baudrate: int = 115200, window: float = 1.0, threshold: float = 0.8, shed_threshold: float = 0.95, max_defer: float = 0.5, stale_ttl: float = 1.0):
+        """
+            Args:
+                baudrate = serial baudrate, gives the wire time of a frame
+                window = seconds of the sliding utilization window
+                threshold = utilization (0-1) above which admission applies, 0 disables admission
+                shed_threshold = utilization above which a deferred read is dropped
+                max_defer = seconds a read is deferred at most
+                stale_ttl = age in seconds of a reply still good enough to answer a read under load
+        """
+        self.wire_time = FRAME_BITS / baudrate
+        self.turnaround = TURNAROUND # calibrated from the measured round trips
+        self.rtt = None # moving average of the round trip time, seconds
+        self.window = window
+        self.threshold = threshold
+        self.shed_threshold = shed_threshold
+        self.max_defer = max_defer
+        self.stale_ttl = stale_ttl
+        self.transactions = 0
+        self.timeouts = 0
+        self.merged = 0
+        self.deferred = 0
+        self.shed = 0
+        self.admitted = [0] * len(PRIORITY_NAMES)
+        self.peak = 0.0
+        self.saps = {} # (addr, type) -> (value, reply) of the last SAP acknowledged by the module
+        self._busy = deque() # (end, seconds) of every busy period in the window
+        self._busy_total = 0.0
+
+    @property
+    def frame_cost(self) -> float:
+        """Calibrated bus time of one transaction, seconds."""
+        return self.wire_time + self.turnaround
+
+    def record(self, busy: float, rtt: float | None = None):
+        """One transaction kept the sender busy for `busy` seconds, rtt is its round trip (None: no reply)."""
+        now = time.monotonic()
+        self._busy.append((now, busy))
+        self._busy_total += busy
+        self.transactions += 1
+        if rtt is None:
+            self.timeouts += 1
+        else:
+            self.rtt = rtt if self.rtt is None else self.rtt + 0.05 * (rtt - self.rtt)
+            self.turnaround = max(0.0, self.rtt - self.wire_time)
+
+    def hold(self, busy: float):
+        """Sender time that is not a transaction (pacing gap of the command queue)."""
+        self._busy.append((time.monotonic(), busy))
+        self._busy_total += busy
+
+    def utilization(self) -> float:
+        limit = time.monotonic() - self.window
+        while self._busy and self._busy[0][0] < limit:
+            self._busy_total -= self._busy.popleft()[1]
+        if not self._busy:
+            self._busy_total = 0.0 # no float drift left behind
+        u = min(1.0, self._busy_total / self.window)
+        self.peak = max(self.peak, u)
+        return u
+
+    def note(self, addr, cmd, param, value, reply):
+        """
+            Remember the speed/accel SAPs executed by a module, forget them on anything that can change its
+            parameters or its motion, and on replies of a module storing instead of executing (status 101, download mode).
+        """
+        if reply is not None and reply[2] == 101:
+            self.forget(addr)
+        elif cmd == 5 and param in MERGED_SAPS and reply is not None:
+            self.saps[(addr, param)] = (value, reply)
+        elif cmd in (1, 2, 3, 4, 5, 8, 13, 129): # motion, other SAP or SAP without reply, RSAP, a program started on the module
+            self.forget(addr)
+
+    def forget(self, addr=None):
+        if addr is None:
+            self.saps.clear() # link lost, the modules may have been power cycled
+        else:
+            for key in [k for k in self.saps if k[0] == addr]:
+                del self.saps[key]
+
+    async def admit(self, motor_manager, addr, cmd, param, bank, value):
+        """
+            Admission of one command, returns (True, None) to send it, or (False, reply) to answer it
+            with `reply` without touching the bus.
+        """
+        prio = priority(cmd, param)
+        if not self.threshold or addr not in motor_manager.connected or (prio != TELEMETRY and not (cmd == 5 and param in MERGED_SAPS)):
+            self.admitted[prio] += 1
+            return True, None
+        if self.utilization() >= self.threshold:
+            if cmd == 5: # speed or accel, pure settings
+                last = self.saps.get((addr, param))
+                if last is not None and last[0] == value:
+                    self.merged += 1
+                    return False, last[1]
+            elif prio == TELEMETRY:
+                loop = asyncio.get_running_loop()
+                recent = motor_manager._recent_reads.get(addr, {}).get((cmd, param, bank))
+                if recent is not None and loop.time() - recent[0] <= self.stale_ttl:
+                    self.merged += 1
+                    return False, recent[1]
+                self.deferred += 1
+                deadline = loop.time() + self.max_defer
+                while loop.time() < deadline:
+                    await asyncio.sleep(DEFER_STEP)
+                    if self.utilization() < self.threshold:
+                        break
+                else:
+                    if self.utilization() >= self.shed_threshold:
+                        self.shed += 1
+                        logging.debug(f"Bus overloaded, read {cmd}/{param} of motor {addr} shed")
+                        return False, None
+        self.admitted[prio] += 1
+        return True, None
+
+    def report(self) -> dict:
+        utilization = self.utilization()
+        return {
+            "utilization": round(utilization, 3),
+            "peak_utilization": round(self.peak, 3),
+            "window_s": self.window,
+            "threshold": self.threshold,
+            "overloaded": bool(self.threshold) and utilization >= self.threshold,
+            "wire_time_ms": round(self.wire_time * 1000, 3),
+            "turnaround_ms": round(self.turnaround * 1000, 3),
+            "frame_cost_ms": round(self.frame_cost * 1000, 3),
+            "rtt_ms": round(self.rtt * 1000, 3) if self.rtt is not None else None,
+            "capacity_fps": round(1 / self.frame_cost),
+            "transactions": self.transactions,
+            "timeouts": self.timeouts,
+            "admitted": dict(zip(PRIORITY_NAMES, self.admitted)),
+            "merged": self.merged,
+            "deferred": self.deferred,
+            "shed": self.shed,
+        }
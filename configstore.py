@@ -0,0 +1,218 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+"""
+
+Configuration repository
+Written for STRUCTURALS, 2025
+
+Keeps the configuration files of CONFIG_DIR parsed in memory and does every file
+operation in a single worker thread, so saving or listing configurations never
+blocks the event loop (and therefore never stalls Art-Net processing).
+
+Files are written atomically (temp file + fsync + rename) and the default.json /
+default_artnet.json symlinks are swapped with a rename as well, so a crash or a
+power cut can never leave a half written or missing boot configuration.
+
+"""
+
+DEFAULT_NAME = "default"
+
+def fsync_dir(directory):
+    """fsync a directory so a rename done inside it survives a power cut."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def write_json_atomic(path, data, indent=4) -> str:
+    """
+        Blocking atomic JSON write: temp file in the same directory, fsync, rename over path.
+        Returns the written text.
+    """
+    path = Path(path)
+    text = json.dumps(data, indent=indent)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.stem}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return text
+
+class ConfigRepository:
+    def __init__(self, config_dir, refresh_interval: float = 1.0):
+        """
+            Args:
+                config_dir = directory holding the <name>.json and <name>_artnet.json files
+                refresh_interval = seconds during which list/load are served from memory without
+                                   checking the files on disk for external changes
+        """
+        self.config_dir = Path(config_dir)
+        self.refresh_interval = refresh_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kinelink-config")
+        self._cache = {}  # name -> (stamp, data)
+        self._cache_lock = threading.Lock()
+        self._default = None  # name of the configuration default.json points to
+        self._last_refresh = None
+
+    @staticmethod
+    def valid_name(name: str) -> bool:
+        return bool(name) and not name.startswith(".") and "/" not in name and "\\" not in name and "\0" not in name
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    ## blocking helpers, only ever called from the worker thread
+
+    def _path(self, name):
+        return self.config_dir / f"{name}.json"
+
+    def _stamp(self, path):
+        st = os.stat(path)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _atomic_write(self, name, data):
+        path = self._path(name)
+        text = write_json_atomic(path, data)
+        with self._cache_lock:
+            self._cache[name] = (self._stamp(path), json.loads(text))
+
+    def _atomic_symlink(self, target_name, link_name):
+        link = self._path(link_name)
+        tmp = self.config_dir / f".{link_name}.{os.getpid()}.{threading.get_ident()}.lnk"
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        os.symlink(f"{target_name}.json", tmp)
+        try:
+            os.replace(tmp, link)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        with self._cache_lock:
+            self._cache.pop(link_name, None)
+
+    def _default_target(self):
+        link = self._path(DEFAULT_NAME)
+        if not os.path.islink(link):
+            return None
+        return os.path.basename(os.readlink(link))[:-len(".json")]
+
+    def _scan(self):
+        """Reload every configuration file whose inode, mtime or size changed since the last scan."""
+        fresh = {}
+        with os.scandir(self.config_dir) as it:
+            for entry in it:
+                if entry.name.startswith(".") or not entry.name.endswith(".json"):
+                    continue
+                name = entry.name[:-len(".json")]
+                try:
+                    stamp = self._stamp(entry.path)
+                except OSError:
+                    continue  # dangling symlink
+                cached = self._cache.get(name)
+                if cached and cached[0] == stamp:
+                    fresh[name] = cached
+                    continue
+                try:
+                    with open(entry.path, "r") as f:
+                        fresh[name] = (stamp, json.load(f))
+                except Exception as e:
+                    logging.warning(f"Failed to read configuration {entry.name}: {e}")
+        with self._cache_lock:
+            self._cache = fresh
+        return self._default_target()
+
+    def _save(self, name, data, artnet_data, default):
+        self._atomic_write(name, data)
+        self._atomic_write(f"{name}_artnet", artnet_data)
+        if default:
+            self._atomic_symlink(name, DEFAULT_NAME)
+            self._atomic_symlink(f"{name}_artnet", f"{DEFAULT_NAME}_artnet")
+        fsync_dir(self.config_dir)
+        return self._scan()
+
+    def _delete(self, name):
+        if not os.path.lexists(self._path(name)):
+            return False
+        if name != DEFAULT_NAME and self._default_target() == name:
+            # never leave the boot configuration pointing to a deleted file
+            for link_name in (DEFAULT_NAME, f"{DEFAULT_NAME}_artnet"):
+                try:
+                    os.unlink(self._path(link_name))
+                except FileNotFoundError:
+                    pass
+        for n in (name, f"{name}_artnet"):
+            try:
+                os.unlink(self._path(n))
+            except FileNotFoundError:
+                pass
+        fsync_dir(self.config_dir)
+        self._scan()
+        return True
+
+    ## asynchronous API, safe to call from the event loop
+
+    async def refresh(self, force: bool = False):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if not force and self._last_refresh is not None and now - self._last_refresh < self.refresh_interval:
+            return
+        self._default = await self._run(self._scan)
+        self._last_refresh = loop.time()
+
+    async def list(self):
+        """Return [{"name": ..., "is_default": ...}] for every configuration file."""
+        await self.refresh()
+        return [
+            {"name": name, "is_default": name == DEFAULT_NAME or name == self._default}
+            for name in sorted(self._cache)
+        ]
+
+    async def load(self, name: str):
+        """Return the parsed content of <name>.json, or None if it does not exist."""
+        if not self.valid_name(name):
+            return None
+        await self.refresh()
+        cached = self._cache.get(name)
+        return cached[1] if cached else None
+
+    async def save(self, name: str, data: dict, artnet_data: dict, default: bool = False):
+        """
+            Write <name>.json and <name>_artnet.json atomically, and make them the boot configuration if default is True.
+            data must not be mutated while the write is in progress, pass a copy.
+        """
+        if not self.valid_name(name):
+            raise ValueError(f"Invalid configuration name {name!r}")
+        self._default = await self._run(self._save, name, data, artnet_data, default)
+        self._last_refresh = asyncio.get_running_loop().time()
+
+    async def delete(self, name: str) -> bool:
+        if not self.valid_name(name):
+            return False
+        deleted = await self._run(self._delete, name)
+        self._default = await self._run(self._default_target)
+        self._last_refresh = asyncio.get_running_loop().time()
+        return deleted
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import time
+from sequencer import LatenessHistogram
+
+"""
+
+Fixed-rate control loop
+Written for STRUCTURALS, 2025
+
+Optional deterministic output stage. Inputs (Art-Net, sACN, API) only set the
+desired state of the motors with MotorManager.submit(); at every tick (100 Hz by
+default, scheduled with loop.call_at on the monotonic clock) the loop compares the
+desired state of every motor with what was last sent, builds the frames of this
+tick and sends them back to back (MotorManager.send_batch).
+
+A tick sends at most `budget` frames, sized so a tick fits in its period on the
+bus. Motors are served round robin, what does not fit is sent at the next tick,
+and only the latest desired value of a motor is ever sent (intermediate values
+are merged, not queued).
+
+Tick jitter (callback lateness), bus time per tick, overruns (a tick still
+sending when the next one is due) and deferred frames are recorded, so the load
+of an installation can be sized before it goes live (/p/control).
+
+"""
+
+FRAME_BITS = 2 * 9 * 10 # request + reply, 9 bytes of 10 bits on the wire
+TURNAROUND = 0.0005 # module processing and RS485 direction switch, seconds per transaction
+
+def default_budget(rate: float, baudrate: int, headroom: float = 0.8) -> int:
+    """Frames per tick that fit in `headroom` of a tick period at the given baudrate."""
+    frame_time = FRAME_BITS / baudrate + TURNAROUND
+    return max(1, int(headroom / rate / frame_time))
+
+class DesiredState:
+    __slots__ = ("maxspeed", "target", "rotate", "mode", "sent_maxspeed", "sent_target", "sent_rotate")
+
+    def __init__(self):
+        self.maxspeed = None
+        self.target = None
+        self.rotate = None # signed velocity: >0 ROR, <0 ROL, 0 MST
+        self.mode = None # "position" or "rotate", the last one submitted wins
+        self.sent_maxspeed = None
+        self.sent_target = None
+        self.sent_rotate = None
+
+    def pending(self):
+        """Commands (cmd, type, value) needed to bring the motor to its desired state."""
+        commands = []
+        if self.maxspeed is not None and self.maxspeed != self.sent_maxspeed:
+            commands.append((5, 4, self.maxspeed))
+        if self.mode == "position" and self.target != self.sent_target:
+            commands.append((4, 0, self.target))
+        elif self.mode == "rotate" and self.rotate != self.sent_rotate:
+            if self.rotate > 0:
+                commands.append((1, 0, self.rotate))
+            elif self.rotate < 0:
+                commands.append((2, 0, -self.rotate))
+            else:
+                commands.append((3, 0, 0))
+        return commands
+
+    def mark_sent(self, cmd, param, value):
+        if cmd == 5:
+            self.sent_maxspeed = value
+        elif cmd == 4:
+            self.sent_target, self.sent_rotate = value, None
+        else:
+            self.sent_rotate, self.sent_target = (value if cmd == 1 else -value if cmd == 2 else 0), None
+
+class ControlLoop:
+    def __init__(self, motor_manager, rate: float = 100.0, budget: int | None = None):
+        """
+            Args:
+                motor_manager = MotorManager driving the bus
+                rate = ticks per second
+                budget = max frames per tick, derived from the baudrate if None
+        """
+        self.motor_manager = motor_manager
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.budget = budget or default_budget(rate, motor_manager.baudrate)
+        self.desired = {} # addr -> DesiredState
+        self.jitter = LatenessHistogram()
+        self.bus_time = LatenessHistogram()
+        self.ticks = 0
+        self.overruns = 0
+        self.missed = 0 # ticks skipped because the loop was late by more than a period
+        self.deferred = 0 # frames left for a later tick by the budget, counted at every tick they wait
+        self.frames = 0
+        self._cursor = 0 # round robin start of the next tick
+        self._start = None
+        self._n = 0
+        self._handle = None
+        self._sending = None
+
+    def submit(self, addr, maxspeed=None, target=None, rotate=None):
+        """Set the desired state of a motor. Only the latest value of each field is kept."""
+        state = self.desired.get(addr)
+        if state is None:
+            state = self.desired[addr] = DesiredState()
+        if maxspeed is not None:
+            state.maxspeed = int(maxspeed)
+        if target is not None:
+            state.target, state.mode = int(target), "position"
+        if rotate is not None:
+            state.rotate, state.mode = int(rotate), "rotate"
+
+    def note_sent(self, addr, cmd, param, value):
+        """
+            A motion command sent outside the loop (API, OSC, sequencer, homing, broker clients). It becomes the desired
+            and the sent state of the motor: the loop does not fight it, and sends the next value an input submits even if
+            it equals the one the loop sent before.
+        """
+        state = self.desired.get(addr)
+        if state is None:
+            return
+        if cmd == 5 and param == 4:
+            state.maxspeed = value
+        elif cmd == 4 and param == 0:
+            state.target, state.mode = value, "position"
+        elif cmd in (1, 2, 3):
+            state.rotate, state.mode = (value if cmd == 1 else -value if cmd == 2 else 0), "rotate"
+        elif cmd == 4 or (cmd == 13 and param == 0):
+            # relative move or homing, the position it ends at is not known here: nothing pending until the next input
+            state.mode, state.sent_target, state.sent_rotate = None, None, None
+            return
+        else:
+            return
+        state.mark_sent(cmd, param, value)
+
+    def forget(self, addr):
+        self.desired.pop(addr, None)
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._start = loop.time()
+        self._n = 0
+        self._schedule(loop)
+        logging.info(f"Control loop at {self.rate:g} Hz, {self.budget} frames per tick")
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _schedule(self, loop):
+        self._n += 1
+        deadline = self._start + self._n * self.period
+        now = loop.time()
+        if now > deadline + self.period:
+            # far behind (blocked loop): skip the missed ticks instead of bursting them out
+            skipped = int((now - deadline) / self.period)
+            self.missed += skipped
+            self._n += skipped
+            deadline = self._start + self._n * self.period
+        self._handle = loop.call_at(deadline, self._tick, deadline)
+
+    def _tick(self, deadline):
+        loop = asyncio.get_running_loop()
+        self.jitter.add((loop.time() - deadline) * 1000)
+        self.ticks += 1
+        self._schedule(loop)
+        if self._sending is not None and not self._sending.done():
+            self.overruns += 1 # previous tick still on the bus, its frames are not sent twice
+            return
+        commands = self._build()
+        if commands:
+            self._sending = asyncio.create_task(self._send(commands))
+
+    def _build(self):
+        """Frames of this tick, round robin over the motors, at most `budget` of them."""
+        mm = self.motor_manager
+        addrs = [a for a in sorted(self.desired) if a in mm.connected]
+        if not addrs:
+            return []
+        start = self._cursor % len(addrs)
+        commands = []
+        first_deferred = None
+        for i in range(len(addrs)):
+            addr = addrs[(start + i) % len(addrs)]
+            pending = self.desired[addr].pending()
+            if not pending:
+                continue
+            room = self.budget - len(commands)
+            if len(pending) > room:
+                if room > 0 and first_deferred is None:
+                    pending, rest = pending[:room], pending[room:] # a motor never waits for a budget it can not fit in
+                else:
+                    rest = pending
+                    pending = []
+                self.deferred += len(rest)
+                if first_deferred is None:
+                    first_deferred = (start + i) % len(addrs)
+            commands.extend((addr, cmd, param, 0, value) for cmd, param, value in pending)
+        # the first motor left out is served first at the next tick
+        self._cursor = first_deferred if first_deferred is not None else start + 1
+        return commands
+
+    async def _send(self, commands):
+        t0 = time.perf_counter()
+        try:
+            replies = await self.motor_manager.send_batch(commands, external=False)
+        except Exception as e:
+            logging.warning(f"Control tick failed: {e}")
+            return
+        self.bus_time.add((time.perf_counter() - t0) * 1000)
+        self.frames += len(commands)
+        for (addr, cmd, param, _, value), reply in zip(commands, replies):
+            state = self.desired.get(addr)
+            if state is not None and reply is not None:
+                state.mark_sent(cmd, param, value) # no reply: retried at the next tick
+
+    def stats(self) -> dict:
+        return {
+            "rate_hz": self.rate,
+            "budget_frames": self.budget,
+            "ticks": self.ticks,
+            "frames": self.frames,
+            "overruns": self.overruns,
+            "missed_ticks": self.missed,
+            "deferred_frames": self.deferred,
+            "motors": len(self.desired),
+            "jitter": self.jitter.report(),
+            "bus_time": self.bus_time.report(),
+        }
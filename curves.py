@@ -0,0 +1,114 @@
+import math
+from array import array
+
+"""
+
+Response curves for DMX to motion mapping
+Written for STRUCTURALS, 2025
+
+A curve shapes a normalized input t (0..1) into a normalized output (0..1).
+Curves are stored as small dicts in the configuration files, for example:
+    {"type": "linear"}
+    {"type": "exp", "k": 3}             k > 0 gives finer control at low values (|k| <= 50)
+    {"type": "scurve", "k": 8}          k is the steepness around the middle (0 < k <= 50)
+    {"type": "custom", "points": [[0, 0], [0.5, 0.2], [1, 1]]}
+
+Curves are never evaluated on the Art-Net hot path, they are baked into integer
+lookup tables once per motor (256 entries for 8-bit channels, 65536 for 16-bit).
+
+"""
+
+CURVE_TYPES = ("linear", "exp", "scurve", "custom")
+DEFAULT_CURVE = {"type": "linear"}
+K_MAX = 50.0 # |k| of exp and scurve, steeper than this only rounds to a step and math.exp overflows far above it
+
+def _k(curve, default) -> float:
+    try:
+        k = float(curve.get("k", default))
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid curve k {curve.get('k')!r}")
+    if not math.isfinite(k) or abs(k) > K_MAX:
+        raise ValueError(f"Curve k must be a finite number between -{K_MAX:g} and {K_MAX:g}")
+    return k
+
+def normalize_curve(curve) -> dict:
+    """
+        Validate a curve description and return a clean copy of it.
+        Accepts None (linear), a curve type name or a curve dict. Raises ValueError if invalid.
+    """
+    if curve is None:
+        return dict(DEFAULT_CURVE)
+    if isinstance(curve, str):
+        curve = {"type": curve}
+    if not isinstance(curve, dict):
+        raise ValueError(f"Invalid curve {curve!r}, expected a dict")
+    kind = curve.get("type", "linear")
+    if kind not in CURVE_TYPES:
+        raise ValueError(f"Unknown curve type {kind!r}, expected one of {CURVE_TYPES}")
+    if kind == "linear":
+        return {"type": "linear"}
+    if kind == "exp":
+        return {"type": "exp", "k": _k(curve, 3.0)}
+    if kind == "scurve":
+        k = _k(curve, 8.0)
+        if k <= 0:
+            raise ValueError("S-curve steepness k must be > 0")
+        return {"type": "scurve", "k": k}
+    points = curve.get("points")
+    if not points or len(points) < 2:
+        raise ValueError("Custom curve needs at least 2 points")
+    try:
+        clean = [(float(x), float(y)) for x, y in points]
+    except (TypeError, ValueError):
+        raise ValueError("Custom curve points must be [x, y] pairs of numbers")
+    if not all(math.isfinite(v) for p in clean for v in p):
+        raise ValueError("Custom curve points must be finite")
+    clean = sorted((min(max(x, 0.0), 1.0), min(max(y, 0.0), 1.0)) for x, y in clean)
+    return {"type": "custom", "points": [list(p) for p in clean]}
+
+def shape(curve: dict, t: float) -> float:
+    """Evaluate a normalized curve at t (0..1)."""
+    kind = curve["type"]
+    if kind == "exp":
+        k = curve["k"]
+        if abs(k) < 1e-6:
+            return t
+        return (math.exp(k * t) - 1) / (math.exp(k) - 1)
+    if kind == "scurve":
+        k = curve["k"]
+        lo = 1 / (1 + math.exp(k / 2))
+        hi = 1 / (1 + math.exp(-k / 2))
+        return (1 / (1 + math.exp(-k * (t - 0.5))) - lo) / (hi - lo)
+    if kind == "custom":
+        points = curve["points"]
+        if t <= points[0][0]:
+            return points[0][1]
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            if t <= x1:
+                if x1 == x0:
+                    return y1
+                return y0 + (t - x0) / (x1 - x0) * (y1 - y0)
+        return points[-1][1]
+    return t
+
+def build_table(curve: dict, src_min: int, src_max: int, dst_min: int, dst_max: int, size: int = 256) -> array:
+    """
+        Bake a curve into an integer lookup table.
+
+        Args:
+            curve = normalized curve dict (see normalize_curve)
+            src_min, src_max = channel range mapped onto the curve, in units of the table index
+            dst_min, dst_max = output range (speed or position)
+            size = 256 for 8-bit channels, 65536 for 16-bit channels
+        Returns:
+            array('i') of `size` entries, entries below src_min hold dst_min, entries above src_max hold dst_max
+    """
+    table = array("i", bytes(4 * size))
+    span = src_max - src_min
+    for x in range(size):
+        if span == 0:
+            t = 0.0
+        else:
+            t = min(max((x - src_min) / span, 0.0), 1.0)
+        table[x] = int(shape(curve, t) * (dst_max - dst_min) + dst_min)
+    return table
@@ -0,0 +1,170 @@
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, deque
+from sequencer import LatenessHistogram
+
+"""
+
+Runtime diagnostics
+Written for STRUCTURALS, 2025
+
+Everything in Kinelink (serial worker, Art-Net/sACN input, web API, timelines,
+control loop) shares one asyncio loop. These tools find out which part of it
+uses the CPU or blocks it, on a running node, without restarting it (/d/ routes):
+
+    Profiler          samples the stack of the loop thread every few ms for N seconds
+                      (collapsed stacks, for flamegraph.pl / speedscope), or runs
+                      cProfile on the loop thread for N seconds (pstats text)
+    SlowCallbackLog   asyncio debug mode for a limited time: every callback running
+                      longer than a threshold (datagram_received, data_received,
+                      request handlers, ...) is kept in a bounded log
+    LoopMonitor       loop lag: how late a periodic wake up runs, histogram in ms
+    task_counts()     running tasks grouped by coroutine
+
+"""
+
+def _frame_label(frame):
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{code.co_name}"
+
+class Profiler:
+    def __init__(self):
+        self.running = False
+
+    async def sample(self, seconds: float, interval: float = 0.005) -> dict:
+        """Sample the loop thread stack every `interval` seconds, returns {"root;...;leaf": samples}."""
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        self.running = True
+        target = threading.get_ident() # the loop thread, this coroutine runs on it
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, self._sample, target, seconds, interval)
+        finally:
+            self.running = False
+
+    @staticmethod
+    def _sample(target, seconds, interval):
+        stacks = Counter()
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            frame = sys._current_frames().get(target)
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            if labels:
+                stacks[";".join(reversed(labels))] += 1
+            time.sleep(interval)
+        return dict(stacks.most_common())
+
+    async def pstats(self, seconds: float, sort: str = "cumulative", limit: int = 40) -> str:
+        """cProfile the loop thread for `seconds`, returns the pstats report of the `limit` top functions."""
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        self.running = True
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+            self.running = False
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).strip_dirs().sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+def collapsed(stacks: dict) -> str:
+    """Collapsed stack text, one "frame;frame;frame count" line per stack."""
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.items())
+
+class SlowCallbackLog(logging.Handler):
+    def __init__(self, maxlen: int = 200):
+        """Collects the "Executing <callback> took N seconds" reports of asyncio debug mode."""
+        super().__init__(logging.WARNING)
+        self.entries = deque(maxlen=maxlen)
+        self.enabled_until = None
+        self._previous = None
+        self._handle = None
+
+    def emit(self, record):
+        if record.msg.startswith("Executing") and record.args:
+            self.entries.append({"time": round(record.created, 3), "callback": str(record.args[0]), "duration_ms": round(record.args[-1] * 1000, 1)})
+
+    def enable(self, threshold_ms: float = 50, duration: float = 60):
+        """Asyncio debug mode for `duration` seconds (it slows the loop down), reporting callbacks longer than threshold_ms."""
+        loop = asyncio.get_running_loop()
+        if self._previous is None:
+            self._previous = (loop.get_debug(), loop.slow_callback_duration)
+            logging.getLogger("asyncio").addHandler(self)
+        loop.slow_callback_duration = threshold_ms / 1000
+        loop.set_debug(True)
+        if self._handle:
+            self._handle.cancel()
+        self._handle = loop.call_later(duration, self.disable)
+        self.enabled_until = time.time() + duration
+        logging.info(f"Slow callback reporting above {threshold_ms:g} ms for {duration:g}s")
+
+    def disable(self):
+        if self._previous is None:
+            return
+        loop = asyncio.get_running_loop()
+        debug, loop.slow_callback_duration = self._previous
+        loop.set_debug(debug)
+        logging.getLogger("asyncio").removeHandler(self)
+        self._previous = None
+        self.enabled_until = None
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        logging.info("Slow callback reporting disabled")
+
+    def report(self) -> dict:
+        return {
+            "enabled": self._previous is not None,
+            "enabled_until": round(self.enabled_until, 3) if self.enabled_until else None,
+            "threshold_ms": round(asyncio.get_running_loop().slow_callback_duration * 1000, 1),
+            "callbacks": list(self.entries),
+        }
+
+class LoopMonitor:
+    def __init__(self, interval: float = 0.25):
+        """Measures the event loop lag: how late a wake up scheduled every `interval` seconds runs."""
+        self.interval = interval
+        self.lag = LatenessHistogram()
+        self.last_ms = None
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last_ms = (loop.time() - expected) * 1000
+            self.lag.add(self.last_ms)
+
+    def report(self) -> dict:
+        return {"interval_s": self.interval, "last_ms": round(self.last_ms, 3) if self.last_ms is not None else None, **self.lag.report()}
+
+def task_counts() -> dict:
+    """Running tasks grouped by coroutine, most frequent first."""
+    counts = Counter()
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        counts[getattr(coro, "__qualname__", type(coro).__name__)] += 1
+    return dict(counts.most_common())
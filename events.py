@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field, asdict
+from typing import ClassVar
+
+"""
+
+Internal event bus
+Written for STRUCTURALS, 2025
+
+Producers (MotorManager, Art-Net/sACN inputs, web API) publish typed events,
+consumers (notifier, /ws/events WebSocket clients, recorders, ...) read them from
+their own bounded queue. publish() never blocks and never touches the serial bus:
+a subscriber that does not keep up loses its oldest events, the producer and the
+other subscribers are never slowed down.
+
+Producers check EventBus.wants(EventClass) before building high rate events
+(one per bus transaction or DMX frame), so nothing is built nobody listens to.
+
+"""
+
+@dataclass(slots=True, kw_only=True)
+class Event:
+    type: ClassVar[str] = "event"
+    time: float = field(default_factory=time.time)
+
+    def to_dict(self) -> dict:
+        return {"type": self.type, **asdict(self)}
+
+@dataclass(slots=True, kw_only=True)
+class CommandSent(Event):
+    type: ClassVar[str] = "command_sent"
+    addr: int
+    cmd: int
+    param: int
+    bank: int
+    value: int
+
+@dataclass(slots=True, kw_only=True)
+class ReplyReceived(Event):
+    type: ClassVar[str] = "reply_received"
+    addr: int
+    cmd: int
+    status: int
+    value: int
+
+@dataclass(slots=True, kw_only=True)
+class CommError(Event):
+    type: ClassVar[str] = "comm_error"
+    addr: int
+    cmd: int
+    consecutive: int
+
+@dataclass(slots=True, kw_only=True)
+class PositionUpdated(Event):
+    type: ClassVar[str] = "position"
+    addr: int
+    pos: int
+
+@dataclass(slots=True, kw_only=True)
+class TemperatureUpdated(Event):
+    type: ClassVar[str] = "temperature"
+    addr: int
+    temp: int
+
+@dataclass(slots=True, kw_only=True)
+class MotorFound(Event):
+    type: ClassVar[str] = "motor_found"
+    addr: int
+
+@dataclass(slots=True, kw_only=True)
+class MotorLost(Event):
+    type: ClassVar[str] = "motor_lost"
+    addr: int
+
+@dataclass(slots=True, kw_only=True)
+class ParamChanged(Event):
+    type: ClassVar[str] = "param_changed"
+    addr: int
+    key: str
+    value: object
+
+@dataclass(slots=True, kw_only=True)
+class ConfigApplied(Event):
+    type: ClassVar[str] = "config_applied"
+    name: str
+    motors: list
+
+@dataclass(slots=True, kw_only=True)
+class UniverseChanged(Event):
+    type: ClassVar[str] = "universe_changed"
+    universe: int
+    previous: int
+    source: str
+
+@dataclass(slots=True, kw_only=True)
+class DmxReceived(Event):
+    type: ClassVar[str] = "dmx"
+    universe: int
+    source: str
+    data: bytes
+
+    def to_dict(self) -> dict:
+        return {"type": self.type, "time": self.time, "universe": self.universe, "source": self.source, "data": list(self.data)}
+
+EVENT_TYPES = {cls.type: cls for cls in (CommandSent, ReplyReceived, CommError, PositionUpdated, TemperatureUpdated, MotorFound, MotorLost, ParamChanged, ConfigApplied, UniverseChanged, DmxReceived)}
+
+class Subscription:
+    """Bounded queue of one subscriber. When full, the oldest event is dropped to make room."""
+    def __init__(self, types, maxsize):
+        self.types = types
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def put(self, event):
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def get_nowait(self):
+        return self.queue.get_nowait()
+
+class EventBus:
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.subscriptions = set()
+        self._wanted = {} # event type -> number of subscriptions receiving it
+        self._wanted_all = 0
+        self.published = 0
+
+    def subscribe(self, types=None, maxsize=None) -> Subscription:
+        """
+            Subscribe to the given event types (Event classes or type names, every event if None).
+            Returns a Subscription, read events with `await sub.get()`.
+        """
+        if types is not None:
+            types = frozenset(t if isinstance(t, str) else t.type for t in types)
+            unknown = types - EVENT_TYPES.keys()
+            if unknown:
+                raise ValueError(f"Unknown event types {sorted(unknown)}")
+        sub = Subscription(types, maxsize or self.maxsize)
+        self.subscriptions.add(sub)
+        self._count(types, 1)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        if sub in self.subscriptions:
+            self.subscriptions.discard(sub)
+            self._count(sub.types, -1)
+            if sub.dropped:
+                logging.debug(f"Event subscriber dropped {sub.dropped} events")
+
+    def _count(self, types, delta):
+        if types is None:
+            self._wanted_all += delta
+            return
+        for t in types:
+            self._wanted[t] = self._wanted.get(t, 0) + delta
+
+    def wants(self, event_class) -> bool:
+        """True if at least one subscriber receives this event type."""
+        return self._wanted_all > 0 or self._wanted.get(event_class.type, 0) > 0
+
+    def publish(self, event: Event):
+        self.published += 1
+        for sub in self.subscriptions:
+            if sub.types is None or event.type in sub.types:
+                sub.put(event)
+
+    def stats(self) -> dict:
+        return {
+            "published": self.published,
+            "subscribers": [{"types": sorted(s.types) if s.types else "*", "queued": s.queue.qsize(), "dropped": s.dropped} for s in self.subscriptions],
+        }
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+from configstore import write_json_atomic
+
+"""
+
+Fleet controller for several Kinelink nodes
+Written for STRUCTURALS, 2025
+
+Each Kinelink process drives one serial bus. The fleet layer lets one node (or a
+script) drive many of them through their HTTP API:
+    - FleetRegistry keeps the list of nodes (name -> base url) in configs/fleet/nodes.json
+    - FleetClient fans batched commands out to many nodes concurrently, over pooled
+      keep-alive HTTP connections, and aggregates /p/connected and telemetry views
+    - FleetClient.panic() hits /p/panic on every node in parallel
+
+Several nodes can be tested on one machine with simulated buses, for example:
+    python3 kinelink.py -sim 10-13 -p 8001 -ap 6455 -r 14
+    python3 kinelink.py -sim 10-11 -p 8002 -ap 6456 -r 14
+    python3 fleet.py add a http://127.0.0.1:8001
+    python3 fleet.py add b http://127.0.0.1:8002
+    python3 fleet.py connected
+
+"""
+
+BASE_DIR = Path(__file__).resolve().parent
+FLEET_PATH = BASE_DIR / "configs" / "fleet" / "nodes.json"
+
+class FleetRegistry:
+    def __init__(self, path=FLEET_PATH):
+        self.path = Path(path)
+        self.nodes = {}
+        self._save_lock = None # serializes the writes of save_async, created in the event loop
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            self.nodes = {}
+            return
+        try:
+            with open(self.path, "r") as f:
+                loaded = json.load(f)
+            self.nodes = {str(k): str(v).rstrip("/") for k, v in loaded.items()}
+        except Exception as e:
+            logging.error(f"Failed to load fleet registry {self.path}: {e}")
+            self.nodes = {}
+
+    def save(self, nodes=None):
+        """Blocking write (fsync), use save_async from the event loop."""
+        os.makedirs(self.path.parent, exist_ok=True)
+        write_json_atomic(self.path, self.nodes if nodes is None else nodes)
+
+    async def save_async(self):
+        """save() in a worker thread, writes done in the order of the calls."""
+        if self._save_lock is None:
+            self._save_lock = asyncio.Lock()
+        nodes = dict(self.nodes)
+        async with self._save_lock:
+            await asyncio.get_running_loop().run_in_executor(None, self.save, nodes)
+
+    def add(self, name: str, url: str, save: bool = True):
+        self.nodes[name] = url.rstrip("/")
+        if save:
+            self.save()
+
+    def remove(self, name: str, save: bool = True) -> bool:
+        if self.nodes.pop(name, None) is None:
+            return False
+        if save:
+            self.save()
+        return True
+
+    def select(self, names=None) -> dict:
+        """Return {name: url} for the given node names ('*' or None for every node)."""
+        if names is None or names == "*" or names == ["*"]:
+            return dict(self.nodes)
+        if isinstance(names, str):
+            names = [names]
+        return {n: self.nodes[n] for n in names if n in self.nodes}
+
+class FleetClient:
+    def __init__(self, registry: FleetRegistry, timeout: float = 2.0, per_node: int = 4):
+        """
+            Args:
+                registry = fleet registry
+                timeout = HTTP timeout per request in seconds
+                per_node = max concurrent requests per node (its serial bus serializes them anyway)
+        """
+        self.registry = registry
+        self.timeout = timeout
+        self.per_node = per_node
+        self.panic_timeout = 60.0
+        self._client = None
+
+    def client(self):
+        if self._client is None:
+            import httpx
+            limits = httpx.Limits(max_connections=None, max_keepalive_connections=64, keepalive_expiry=60)
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=limits)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _get(self, name, url, path, params=None, timeout=None):
+        try:
+            r = await self.client().get(f"{url}{path}", params=params, timeout=timeout or self.timeout)
+            return {"node": name, "ok": r.status_code == 200, "status": r.status_code, "reply": r.json()}
+        except Exception as e:
+            return {"node": name, "ok": False, "error": f"{type(e).__name__}: {e}"}
+
+    async def _run_node(self, name, url, commands):
+        results = []
+        for c in commands:
+            res = await self._get(name, url, c["path"], c.get("params"))
+            res["path"] = c["path"]
+            results.append(res)
+        return results
+
+    async def batch(self, commands: list) -> list:
+        """
+            Send a batch of commands. Each command is {"node": name | [names] | "*", "path": "/m/gotopos", "params": {...}}.
+            Nodes are driven concurrently, the commands of a given node keep their order.
+        """
+        per_node = {}
+        for c in commands:
+            for name, url in self.registry.select(c.get("node", "*")).items():
+                per_node.setdefault((name, url), []).append(c)
+        results = await asyncio.gather(*(self._run_node(name, url, cmds) for (name, url), cmds in per_node.items()))
+        return [r for node_results in results for r in node_results]
+
+    async def fan_out(self, path: str, params=None, nodes=None, timeout=None) -> dict:
+        """Send the same request to many nodes in parallel, return {node: result}."""
+        targets = self.registry.select(nodes)
+        results = await asyncio.gather(*(self._get(name, url, path, params, timeout) for name, url in targets.items()))
+        return {r["node"]: r for r in results}
+
+    async def connected(self, nodes=None) -> dict:
+        results = await self.fan_out("/p/connected", nodes=nodes)
+        return {name: (r["reply"] if r["ok"] else {"error": r.get("error", r.get("status"))}) for name, r in results.items()}
+
+    async def _node_telemetry(self, name, url):
+        conn = await self._get(name, url, "/p/connected")
+        if not conn["ok"]:
+            return name, {"error": conn.get("error", conn.get("status"))}
+        sem = asyncio.Semaphore(self.per_node)
+        async def read(addr):
+            async with sem:
+                pos = await self._get(name, url, "/p/getpos", {"addr": addr})
+                temp = await self._get(name, url, "/p/gettemp", {"addr": addr})
+            value = lambda r: r["reply"]["reply"][4] if r["ok"] and r["reply"].get("reply") else None
+            return addr, {"pos": value(pos), "temp": value(temp)}
+        motors = await asyncio.gather(*(read(int(a)) for a in conn["reply"]))
+        return name, dict(motors)
+
+    async def telemetry(self, nodes=None) -> dict:
+        """Read position and temperature of every motor of every node."""
+        targets = self.registry.select(nodes)
+        results = await asyncio.gather(*(self._node_telemetry(name, url) for name, url in targets.items()))
+        return dict(results)
+
+    async def panic(self, nodes=None) -> dict:
+        """Stop every motor of every node, all nodes in parallel."""
+        # /p/panic returns after sweeping all 256 addresses, known motors are stopped first
+        results = await self.fan_out("/p/panic", nodes=nodes, timeout=self.panic_timeout)
+        failed = [n for n, r in results.items() if not r["ok"]]
+        if failed:
+            logging.error(f"Fleet panic failed on nodes {failed}")
+        return results
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser("fleet")
+    parser.add_argument("action", choices=["list", "add", "remove", "connected", "telemetry", "panic", "get"])
+    parser.add_argument("args", nargs="*", help="add: NAME URL, remove: NAME, get: PATH [key=value ...]")
+    args = parser.parse_args()
+    registry = FleetRegistry()
+
+    async def run():
+        client = FleetClient(registry)
+        try:
+            if args.action == "connected":
+                return await client.connected()
+            if args.action == "telemetry":
+                return await client.telemetry()
+            if args.action == "panic":
+                return await client.panic()
+            if args.action == "get":
+                params = dict(a.split("=", 1) for a in args.args[1:])
+                return await client.fan_out(args.args[0], params)
+        finally:
+            await client.close()
+
+    if args.action == "list":
+        print(json.dumps(registry.nodes, indent=2))
+    elif args.action == "add":
+        registry.add(args.args[0], args.args[1])
+    elif args.action == "remove":
+        registry.remove(args.args[0])
+    else:
+        print(json.dumps(asyncio.run(run()), indent=2))
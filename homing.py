@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import time
+
+"""
+
+Homing
+Written for STRUCTURALS, 2025
+
+Reference search (TMCL RFS) of many motors at once. The search is started on every
+motor back to back (one pipelined batch, MotorManager.send_batch), then the status
+of every motor still searching is read in a single sweep (RFS 2, pipelined) every
+`poll_interval` seconds. A motor whose search is over gets its actual position set
+as the reference (SAP 1 = 0) in the next batch. Re-homing the rig takes as long as
+its slowest axis, not the sum of all of them.
+
+The search itself (mode, speeds, switches) is configured on the modules, axis
+parameters 193-196 (see paramsnapshot.AXIS_PARAMS).
+
+A motor fails when it stops answering (MISS_LIMIT sweeps in a row) and times out
+after `timeout` seconds, its search is then stopped (RFS 1). /h/status reports the
+progress of the whole run and of every motor.
+
+"""
+
+MISS_LIMIT = 5 # status sweeps in a row without reply before a motor is given up
+
+class HomingAxis:
+    __slots__ = ("addr", "state", "started", "finished", "misses")
+
+    def __init__(self, addr, now):
+        self.addr = addr
+        self.state = "searching" # searching, done, failed, timeout, stopped
+        self.started = now
+        self.finished = None
+        self.misses = 0
+
+    def to_dict(self, now):
+        return {"state": self.state, "elapsed": round((self.finished or now) - self.started, 3)}
+
+class Homing:
+    def __init__(self, motor_manager, poll_interval: float = 0.1, timeout: float = 120.0, set_reference: bool = True):
+        """
+            Args:
+                motor_manager = MotorManager driving the bus
+                poll_interval = seconds between two status sweeps
+                timeout = seconds before a motor still searching is stopped
+                set_reference = set the position of each motor to 0 (SAP 1) when its search is over
+        """
+        self.motor_manager = motor_manager
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.set_reference = set_reference
+        self.axes = {} # addr -> HomingAxis of the current (or last) run
+        self.started = None
+        self.finished = None
+        self.sweeps = 0
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self, addrs=None):
+        """Start the reference search of the given motors (every connected motor by default)."""
+        if self.running:
+            raise RuntimeError("Homing already running")
+        mm = self.motor_manager
+        addrs = sorted(mm.connected) if addrs is None else [a for a in addrs if a in mm.connected]
+        if not addrs:
+            raise ValueError("No connected motor to home")
+        now = time.monotonic()
+        self.axes = {addr: HomingAxis(addr, now) for addr in addrs}
+        self.started, self.finished, self.sweeps = now, None, 0
+        # the run is marked started (task created) before the first await: a concurrent start sees it running
+        launched = asyncio.get_running_loop().create_future()
+        self._task = asyncio.create_task(self._run(addrs, launched))
+        # back once the RFS batch is answered, so the motors that did not take it are already reported failed
+        await asyncio.wait([launched, self._task], return_when=asyncio.FIRST_COMPLETED)
+
+    def stop(self):
+        """Stop the reference search of every motor still searching."""
+        if not self.running:
+            return
+        self._task.cancel()
+        searching = [a.addr for a in self.axes.values() if a.state == "searching"]
+        now = time.monotonic()
+        for addr in searching:
+            self._finish(self.axes[addr], "stopped", now)
+        if searching:
+            asyncio.create_task(self.motor_manager.send_batch([(addr, 13, 1, 0, 0) for addr in searching]))
+        self.finished = now
+        logging.info(f"Homing stopped, {len(searching)} motors were still searching")
+
+    def _finish(self, axis, state, now):
+        axis.state = state
+        axis.finished = now
+        if state != "done":
+            logging.warning(f"Homing of motor {axis.addr}: {state}")
+
+    async def _run(self, addrs, launched):
+        mm = self.motor_manager
+        try:
+            replies = await mm.send_batch([(addr, 13, 0, 0, 0) for addr in addrs])
+            for addr, reply in zip(addrs, replies):
+                if reply is None:
+                    self._finish(self.axes[addr], "failed", time.monotonic())
+            logging.info(f"Homing {len(addrs)} motors")
+            launched.set_result(None)
+            while True:
+                searching = [a for a in self.axes.values() if a.state == "searching"]
+                if not searching:
+                    break
+                await asyncio.sleep(self.poll_interval)
+                # one status sweep over every motor still searching
+                replies = await mm.transact_many([mm.tmcl_packet_builder(a.addr, 13, 2, 0, 0) for a in searching])
+                self.sweeps += 1
+                now = time.monotonic()
+                done, expired = [], []
+                for axis, reply in zip(searching, replies):
+                    if reply is None:
+                        axis.misses += 1
+                        if axis.misses >= MISS_LIMIT:
+                            self._finish(axis, "failed", now)
+                        continue
+                    axis.misses = 0
+                    if reply[4] == 0:
+                        done.append(axis)
+                    elif now - axis.started > self.timeout:
+                        expired.append(axis)
+                commands = [(a.addr, 5, 1, 0, 0) for a in done] if self.set_reference else []
+                commands += [(a.addr, 13, 1, 0, 0) for a in expired]
+                if commands:
+                    await mm.send_batch(commands)
+                for axis in done:
+                    self._finish(axis, "done", now)
+                for axis in expired:
+                    self._finish(axis, "timeout", now)
+        except Exception as e:
+            logging.error(f"Homing failed: {e}")
+            for axis in self.axes.values():
+                if axis.state == "searching":
+                    self._finish(axis, "failed", time.monotonic())
+        self.finished = time.monotonic()
+        states = [a.state for a in self.axes.values()]
+        logging.info(f"Homing over in {self.finished - self.started:.1f}s: {states.count('done')}/{len(states)} motors referenced")
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        states = [a.state for a in self.axes.values()]
+        over = len(states) - states.count("searching")
+        return {
+            "running": self.running,
+            "total": len(states),
+            "searching": states.count("searching"),
+            "done": states.count("done"),
+            "failed": len(states) - states.count("searching") - states.count("done"),
+            "progress": round(over / len(states), 3) if states else None,
+            "elapsed": round((self.finished or now) - self.started, 3) if self.started else None,
+            "sweeps": self.sweeps,
+            "motors": {addr: axis.to_dict(now) for addr, axis in self.axes.items()},
+        }
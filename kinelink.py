@@ -1,27 +1,53 @@
+import time
+_started = time.perf_counter() # startup report: the imports below are its first phase
 import asyncio
 import logging
+import TMCL
 from TMCL import MotorManager
-from artnet import ArtNetProtocol
-import web_api
-import uvicorn
-from rich.logging import RichHandler
-from rich.console import Console
+from artnet import ArtNetProtocol, start_batched_artnet
+from control import ControlLoop
+import warmstart
 import os
 import argparse
 from pathlib import Path
 import json
+# web API (FastAPI, uvicorn) and console (Rich) modules are imported in main/utils, not at all in headless mode
 
 BASE_DIR = Path(__file__).resolve().parent
 CONFIG_DIR = BASE_DIR / "configs"
 
 #CHANGE VERSION NUMBER HERE
 version=1.4
-console=Console()
+console=None # rich Console, created by utils.console_mode
+
+class StartupTimer:
+    def __init__(self, started):
+        """Time spent in each phase of the startup, logged once the inputs listen."""
+        self.started = started
+        self.last = started
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        phases = ", ".join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in self.phases)
+        logging.info(f"Started in {(self.last - self.started) * 1000:.0f} ms: {phases}")
+
+startup = StartupTimer(_started)
+startup.mark("imports")
 
 class utils: 
     def clear():
         """clear system console"""
         os.system('cls' if os.name=='nt' else 'clear')
+
+    def console_mode():
+        global console
+        from rich.console import Console
+        console = Console()
     
     def art():
         console.print("""
@@ -35,12 +61,18 @@ class utils:
         console.print("by STRUCTURALS", style="bold red reverse", justify="center")
         console.print(f"\ndevelopped by e-garbage 2025, v{version}\n\n", style="italic red", justify="center", highlight=False)
 
-    def verbose_mode(verbose:bool):
+    def verbose_mode(verbose:bool, headless:bool=False):
         if verbose == True:
             log_mod=logging.DEBUG
         else:
             log_mod=logging.INFO
 
+        if headless:
+            # plain lines for journald/syslog, no Rich import
+            TMCL.log_markup = False
+            logging.basicConfig(level=log_mod, format='%(asctime)s %(levelname)s %(message)s')
+            return
+        from rich.logging import RichHandler
         LOGGING_FORMAT='%(message)s'
         logging.basicConfig(level=log_mod, format=LOGGING_FORMAT, handlers=[RichHandler(rich_tracebacks=False, show_path=False, markup=True)])
     
@@ -75,7 +107,9 @@ def define_artnet_universe(arg_universe=None):
 
     return 0
 
-async def start_artnet(interface, port, universe, motor_manager=None):
+async def start_artnet(interface, port, universe, motor_manager=None, batched=False):
+    if batched:
+        return await start_batched_artnet(interface, port, universe, motor_manager)
     loop= asyncio.get_running_loop()
     transport, protocol = await loop.create_datagram_endpoint(
         lambda: ArtNetProtocol(motor_manager, universe),
@@ -85,30 +119,119 @@ async def start_artnet(interface, port, universe, motor_manager=None):
 
 async def start_api():
     """ web_api.app.state.univers=ARTNET_UNIVERSE """
+    import uvicorn
+    import web_api
     config =uvicorn.Config(web_api.app, host=API_IP, port=API_PORT, log_level="debug")
     server = uvicorn.Server(config)
     await server.serve()
 
-async def main():
-    motor_manager= MotorManager(port=SERIAL_PORT, baudrate=BAUDRATE, default_accel=ACC, default_maxspeed=MAXSPEED, default_minspeed=MINSPEED, module_range=MODULE_RANGE)
+def setup_api(motor_manager, events, notifier):
+    """Import the web API and hand it the running objects (not done in headless mode)."""
+    import web_api
+    from motion import MotionTracker
+    from sequencer import Sequencer
+    from homing import Homing
+    from tmclprog import ProgramManager
+    from ratelimit import RateLimiter
+    import diagnostics
+    motor_manager.motion = MotionTracker(motor_manager)
+    web_api.events = events
+    web_api.notifier = notifier
     web_api.motor_manager=motor_manager
+    web_api.motion_tracker=motor_manager.motion
+    web_api.sequencer=Sequencer(motor_manager)
+    web_api.homing=Homing(motor_manager)
+    web_api.programs=ProgramManager(motor_manager)
+    web_api.rate_limiter=RateLimiter(rate=RATE_LIMIT, burst=2*RATE_LIMIT)
     web_api.app.state.version=version
+    web_api.loop_monitor = diagnostics.LoopMonitor()
+    return web_api
+
+async def main():
+    simulator = None
+    if SIMULATE:
+        import simbus
+        simulator = simbus.SimulatedBus(simbus.parse_spec(SIMULATE))
+    motor_manager= MotorManager(port=SERIAL_PORT, baudrate=BAUDRATE, default_accel=ACC, default_maxspeed=MAXSPEED, default_minspeed=MINSPEED, module_range=MODULE_RANGE, simulator=simulator, broker=BROKER_CONNECT)
+    motor_manager.bus.threshold = BUS_THRESHOLD
+    if CONTROL_TICK > 0:
+        motor_manager.control = ControlLoop(motor_manager, rate=CONTROL_TICK, budget=CONTROL_BUDGET or None)
+    web_api = None
+    notifier = None
+    if not HEADLESS:
+        from events import EventBus
+        import telegramnotif
+        events = EventBus()
+        motor_manager.events = events
+        notifier = telegramnotif.notifier_from_env(events, motor_manager)
+        web_api = setup_api(motor_manager, events, notifier)
+        startup.mark("web imports")
+    # simulated buses and broker clients never warm start, several of them may run from the same directory
+    shared = bool(SIMULATE or BROKER_CONNECT)
+    snapshot = None if (COLD_START or shared) else warmstart.load_snapshot(port=SERIAL_PORT)
+    universe = ARTNET_UNIVERSE
     await motor_manager.start()
-    await asyncio.sleep(1)
-    await motor_manager.initialize()
-    transport, artnet_protocol = await start_artnet(ARTNET_IP, ARTNET_PORT,ARTNET_UNIVERSE, motor_manager)
+    broker_server = None
+    if BROKER_SOCKET:
+        import broker
+        broker_server = broker.BrokerServer(motor_manager, BROKER_SOCKET)
+        await broker_server.start()
+    startup.mark("serial open")
+    if snapshot:
+        # warm start: known motors are usable right away, the bus is checked in background
+        motor_manager.restore(snapshot)
+        if snapshot.get("universe") is not None:
+            universe = int(snapshot["universe"])
+        asyncio.create_task(motor_manager.validate_topology())
+        startup.mark("warm start")
+    else:
+        await asyncio.sleep(1)
+        await motor_manager.initialize()
+        startup.mark("scan")
+    dmx_inputs = []
+    if DMX_INPUT in ("artnet", "both"):
+        transport, artnet_protocol = await start_artnet(ARTNET_IP, ARTNET_PORT, universe, motor_manager, batched=BATCHED_INGEST)
+        dmx_inputs.append(artnet_protocol)
+    if DMX_INPUT in ("sacn", "both"):
+        import sacn
+        sacn_transport, sacn_protocol = await sacn.start_sacn(ARTNET_IP, universe, motor_manager, merge=SACN_MERGE)
+        dmx_inputs.append(sacn_protocol)
+    artnet_protocol = dmx_inputs[0]
+    osc_protocol = None
+    if OSC_PORT:
+        import osc
+        limits = {} if web_api is None else {"max_speed": web_api.top_speed, "max_accel": web_api.top_accel}
+        osc_transport, osc_protocol = await osc.start_osc(ARTNET_IP, OSC_PORT, motor_manager, **limits)
+    startup.mark("listener bind")
+    if not shared:
+        snapshot_writer = warmstart.SnapshotWriter(motor_manager, artnet_protocol)
+        snapshot_writer.start()
+    if motor_manager.control:
+        motor_manager.control.start()
+    startup.report()
+    if HEADLESS:
+        await asyncio.Event().wait() # serial and DMX paths only, until interrupted
+        return
+    if not shared:
+        from telemetry import TelemetryHistory
+        web_api.history = TelemetryHistory(motor_manager)
+        web_api.history.start()
+    if isinstance(notifier.sender, telegramnotif.TelegramSender):
+        notifier.enable_notifications()
+    web_api.osc_protocol = osc_protocol
+    web_api.broker_server = broker_server
+    web_api.loop_monitor.start()
     web_api.artnet_protocol =artnet_protocol
+    web_api.dmx_inputs = dmx_inputs
     web_api.app.state.motor_manager=motor_manager
     web_api.app.state.artnet=artnet_protocol
-    await start_api()
+    try:
+        await start_api()
+    finally:
+        if web_api.history:
+            await web_api.history.stop() # last batch of history records
 
 if __name__ == "__main__":
-    #clear terminal
-    utils.clear()
-    if os.name=="nt":
-        console.print("THIS PROGRAM IS NOT DEVELOPPED FOR WINDOWS\nit may not work as intended\nThis program has been developped and tested for Debian/Rasbian Linux systems\n", style="bold red", justify="center")
-    #print cool stuff
-    utils.art()
     #define command line flags and help
     parser=argparse.ArgumentParser('')
     parser.add_argument("-ap",
@@ -126,6 +249,23 @@ if __name__ == "__main__":
                         type=int,
                         default=0,
                         help="Artnet listening Universe, default 0")
+    parser.add_argument("-bi",
+                        "--batched_ingest",
+                        action="store_true",
+                        default=False,
+                        help="Drain the Art-Net socket in batches and only decode the newest frame, for networks with many universes or high packet rates")
+    parser.add_argument("-in",
+                        "--dmx_input",
+                        type=str,
+                        choices=["artnet", "sacn", "both"],
+                        default="artnet",
+                        help="DMX input protocol: Art-Net, sACN (E1.31 multicast, Art-Net universe N is sACN universe N+1) or both")
+    parser.add_argument("-sm",
+                        "--sacn_merge",
+                        type=str,
+                        choices=["htp", "ltp"],
+                        default="htp",
+                        help="How sACN sources of equal priority are merged: highest value per channel (htp) or latest packet (ltp)")
     parser.add_argument("-sp",
                         "--serial_port",
                         type=str,
@@ -176,13 +316,76 @@ if __name__ == "__main__":
                         type=int,
                         default=255,
                         help="Size of the module range to scan at boot. Max is 255 due to TMCL limitations. For debug purposes mainly.")
+    parser.add_argument("-cs",
+                        "--cold_start",
+                        action="store_true",
+                        default=False,
+                        help="Ignore the runtime snapshot of the previous run and do a full bus scan at boot")
+    parser.add_argument("-sim",
+                        "--simulate",
+                        type=str,
+                        default=None,
+                        help="Run against a simulated TMCL bus instead of the serial port, with modules at the given addresses, ie 10-19 or 10,12,15. For tests and development.")
+    parser.add_argument("-rl",
+                        "--rate_limit",
+                        type=float,
+                        default=0.0,
+                        help="Max sustained API requests per second and per client on motor routes (/m, /p), bursts of twice this are allowed. 0 (default) disables the limit. The web UI polls about 1 request/s per motor, keep it above that")
+    parser.add_argument("-ct",
+                        "--control_tick",
+                        type=float,
+                        default=0,
+                        help="Send DMX motion through a fixed-rate control loop running at this rate in Hz, ie 100. 0 (default) sends every DMX change right away")
+    parser.add_argument("-cb",
+                        "--control_budget",
+                        type=int,
+                        default=0,
+                        help="Max frames sent per control tick, 0 (default) derives it from the baudrate and the tick rate")
+    parser.add_argument("-hl",
+                        "--headless",
+                        action="store_true",
+                        default=False,
+                        help="Art-Net/sACN receiver only: no web API, no console art, plain log lines, web and Rich modules never imported")
+    parser.add_argument("-bs",
+                        "--broker_socket",
+                        type=str,
+                        default=None,
+                        help="Also serve the TMCL bus on this Unix socket (ie /run/kinelink/bus.sock), for scripts and other Kinelink instances started with -bc")
+    parser.add_argument("-bc",
+                        "--broker_connect",
+                        type=str,
+                        default=None,
+                        help="Use the bus of another Kinelink through its broker socket instead of opening the serial port")
+    parser.add_argument("-bt",
+                        "--bus_threshold",
+                        type=float,
+                        default=0.8,
+                        help="Serial bus utilization (0-1) above which telemetry reads are merged, deferred or shed and repeated SAPs merged, so motion commands keep the bus. 0 disables admission")
+    parser.add_argument("-osc",
+                        "--osc_port",
+                        type=int,
+                        default=0,
+                        help="UDP port of the OSC and binary control input (ie 9000), on the Art-Net IP. 0 (default) disables it")
     args = parser.parse_args()
+    if not args.headless:
+        utils.console_mode()
+        #clear terminal
+        utils.clear()
+        if os.name=="nt":
+            console.print("THIS PROGRAM IS NOT DEVELOPPED FOR WINDOWS\nit may not work as intended\nThis program has been developped and tested for Debian/Rasbian Linux systems\n", style="bold red", justify="center")
+        #print cool stuff
+        utils.art()
     #define logging mode (verbose for full log, or default user-friendly)
-    utils.verbose_mode(args.verbose)
+    utils.verbose_mode(args.verbose, args.headless)
+    if args.headless:
+        logging.info(f"Kinelink v{version} headless, serial and DMX inputs only")
     #define constants:
     ARTNET_PORT=args.artnet_port
     ARTNET_IP=args.artnet_ip
     ARTNET_UNIVERSE=define_artnet_universe()
+    BATCHED_INGEST=args.batched_ingest
+    DMX_INPUT=args.dmx_input
+    SACN_MERGE=args.sacn_merge
     SERIAL_PORT=args.serial_port
     BAUDRATE=args.baudrate
     API_IP=args.api_ip
@@ -191,5 +394,19 @@ if __name__ == "__main__":
     MINSPEED=args.min_speed
     MODULE_RANGE=args.module_range
     ACC=args.acceleration
+    COLD_START=args.cold_start
+    SIMULATE=args.simulate
+    RATE_LIMIT=args.rate_limit
+    CONTROL_TICK=args.control_tick
+    CONTROL_BUDGET=args.control_budget
+    OSC_PORT=args.osc_port
+    BUS_THRESHOLD=args.bus_threshold
+    HEADLESS=args.headless
+    BROKER_SOCKET=args.broker_socket
+    BROKER_CONNECT=args.broker_connect
+    startup.mark("setup")
 
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logging.info("Stopped")
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+from TMCL import PPS_PER_VELOCITY_UNIT
+
+"""
+
+Motion completion tracking
+Written for STRUCTURALS, 2025
+
+MotorManager notifies the tracker of every MVP (see MotorManager.mvp). Clients can
+then await the end of a move (MotionTracker.wait, /m/wait long polling, /ws/motion
+events) instead of polling /p/getpos themselves.
+
+The bus is only polled for motors that are moving AND that someone is waiting for
+(a waiter or an event subscriber). The polling interval follows the estimated
+remaining travel time: far from the target the motor is checked rarely, close to
+it more often, so a move is reported within a few tens of milliseconds of its end
+with only a handful of GAP round trips.
+
+"""
+
+POLL_MIN = 0.02 # seconds
+POLL_MAX = 0.5
+MOVE_TIMEOUT = 120.0 # moves not completed after this are reported as timed out
+
+class Move:
+    __slots__ = ("addr", "target", "speed", "started", "next_poll", "pos", "waiters")
+
+    def __init__(self, addr, target, speed, now):
+        self.addr = addr
+        self.target = target
+        self.speed = max(int(speed or 1), 1)
+        self.started = now
+        self.next_poll = now + POLL_MIN
+        self.pos = None
+        self.waiters = []
+
+    def estimate(self):
+        """Estimated remaining travel time in seconds, None when unknown."""
+        if self.pos is None or self.target is None:
+            return None
+        return abs(self.target - self.pos) / (self.speed * PPS_PER_VELOCITY_UNIT)
+
+class MotionTracker:
+    def __init__(self, motor_manager):
+        self.motor_manager = motor_manager
+        self.moves = {} # addr -> Move
+        self.subscribers = set()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def _speed(self, addr):
+        state = self.motor_manager.last_commanded.get(addr, {})
+        return state.get("maxspeed") or self.motor_manager.connected.get(addr, {}).get("maxspeed") or self.motor_manager.default_maxspeed
+
+    def notify_move(self, addr, target):
+        """A positioning move was commanded. target is None for relative moves."""
+        loop = asyncio.get_running_loop()
+        previous = self.moves.get(addr)
+        move = Move(addr, target, self._speed(addr), loop.time())
+        if previous is not None:
+            # a new target replaces the previous one, waiters follow the motor to its new target
+            move.waiters = previous.waiters
+            move.pos = previous.pos
+        self.moves[addr] = move
+        self._wake()
+
+    def notify_stop(self, addr, reason="stopped"):
+        """The move was interrupted (MST, ROR, ROL)."""
+        move = self.moves.pop(addr, None)
+        if move is not None:
+            self._finish(move, reached=False, reason=reason)
+
+    def subscribe(self, maxsize=256):
+        q = asyncio.Queue(maxsize=maxsize)
+        self.subscribers.add(q)
+        self._wake()
+        return q
+
+    def unsubscribe(self, q):
+        self.subscribers.discard(q)
+
+    async def wait(self, addr, timeout=None):
+        """Wait until the current move of a motor ends. Returns immediately if it is not moving."""
+        move = self.moves.get(addr)
+        if move is None:
+            return {"addr": addr, "moving": False}
+        future = asyncio.get_running_loop().create_future()
+        move.waiters.append(future)
+        self._wake()
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return {"addr": addr, "moving": True, "reached": False, "reason": "wait timeout", "pos": move.pos}
+        finally:
+            current = self.moves.get(addr)
+            if current is not None and future in current.waiters:
+                current.waiters.remove(future)
+
+    def _wake(self):
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._poll_loop())
+
+    def _watched(self):
+        if self.subscribers:
+            return list(self.moves.values())
+        return [m for m in self.moves.values() if m.waiters]
+
+    def _finish(self, move, reached, reason):
+        loop = asyncio.get_running_loop()
+        result = {
+            "addr": move.addr,
+            "moving": False,
+            "reached": reached,
+            "reason": reason,
+            "target": move.target,
+            "pos": move.pos,
+            "elapsed": round(loop.time() - move.started, 3),
+        }
+        for future in move.waiters:
+            if not future.done():
+                future.set_result(result)
+        move.waiters = []
+        for q in list(self.subscribers):
+            if q.full():
+                try:
+                    q.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+            q.put_nowait(dict(result, event="move_complete"))
+
+    async def _poll(self, move, now):
+        mm = self.motor_manager
+        reached = await mm.gap(move.addr, 8)
+        pos = await mm.gap(move.addr, 1)
+        if pos is not None:
+            move.pos = pos[4]
+        if self.moves.get(move.addr) is not move:
+            return # replaced by a new move while polling
+        if reached is not None and reached[4] == 1:
+            del self.moves[move.addr]
+            self._finish(move, reached=True, reason="target reached")
+            return
+        if now - move.started > MOVE_TIMEOUT:
+            del self.moves[move.addr]
+            self._finish(move, reached=False, reason="move timeout")
+            logging.warning(f"Motor {move.addr} did not reach {move.target} after {MOVE_TIMEOUT}s")
+            return
+        estimate = move.estimate()
+        interval = POLL_MAX if estimate is None else estimate / 2
+        move.next_poll = asyncio.get_running_loop().time() + min(max(interval, POLL_MIN), POLL_MAX)
+
+    async def _poll_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            watched = self._watched()
+            if not watched:
+                if not self.moves:
+                    return
+                await self._wakeup.wait() # moves without anybody waiting for them, nothing to poll
+                continue
+            move = min(watched, key=lambda m: m.next_poll)
+            delay = move.next_poll - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                    continue # something changed, pick again
+                except asyncio.TimeoutError:
+                    pass
+            try:
+                await self._poll(move, loop.time())
+            except Exception as e:
+                logging.debug(f"Motion poll of motor {move.addr} failed: {e}")
+                move.next_poll = loop.time() + POLL_MAX
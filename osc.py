@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import struct
+import time
+
+"""
+
+OSC and binary UDP control input
+Written for STRUCTURALS, 2025
+
+Show control software (QLab, ...) can drive motors with one UDP datagram per cue
+instead of an HTTP request. Datagrams are decoded in datagram_received and sent to
+the bus right away (MotorManager.send_batch), without going through the web API.
+
+OSC messages, int or float arguments:
+
+    /kinelink/<addr>/goto   pos [speed]     MVP ABS, with speed: SAP 4 first
+    /kinelink/<addr>/move   steps [speed]   MVP REL
+    /kinelink/<addr>/right  velocity        ROR
+    /kinelink/<addr>/left   velocity        ROL
+    /kinelink/<addr>/stop                   MST
+    /kinelink/<addr>/speed  speed           SAP 4
+    /kinelink/<addr>/accel  accel           SAP 5
+    /kinelink/<addr>/home                   RFS START
+
+<addr> can be `all` (every connected motor). The commands of an OSC bundle (and of
+a binary packet) are sent as one batch, back to back under the send lock of the bus:
+nothing else is interleaved, a multi-motor cue starts on every motor within a few
+frame times. Time tags are ignored, bundles are executed when received.
+
+Binary packets, for controllers without OSC, all big endian:
+
+    "KL" | version (1) | count    then count records of: addr (u8) | op (u8) | value (i32)
+
+    ops: 1 goto, 2 move, 3 right, 4 left, 5 stop, 6 speed, 7 accel, 8 home
+
+Motors that are not connected and out of range values are rejected (counted in the
+stats), nothing of the packet is sent then.
+
+"""
+
+OSC_ROOT = "kinelink"
+BINARY_MAGIC = b"KL"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct(">2sBB")
+BINARY_RECORD = struct.Struct(">BBi")
+BINARY_OPS = {1: "goto", 2: "move", 3: "right", 4: "left", 5: "stop", 6: "speed", 7: "accel", 8: "home"}
+POS_LIMIT = 100000 # same limits as the web API
+HOST_PARAMS = {4: "maxspeed", 5: "accel"} # SAP types mirrored in the motor parameters of the registry
+
+class OscError(ValueError):
+    pass
+
+def _osc_string(data, i):
+    end = data.index(b"\x00", i)
+    return data[i:end].decode("ascii"), (end + 4) & ~3
+
+def _osc_message(data):
+    address, i = _osc_string(data, 0)
+    if i >= len(data):
+        return address, [] # no type tag string, old style message without arguments
+    tags, i = _osc_string(data, i)
+    if not tags.startswith(","):
+        raise OscError(f"Invalid OSC type tags {tags!r}")
+    args = []
+    for tag in tags[1:]:
+        if tag == "i":
+            args.append(struct.unpack_from(">i", data, i)[0])
+            i += 4
+        elif tag == "f":
+            args.append(struct.unpack_from(">f", data, i)[0])
+            i += 4
+        elif tag == "h":
+            args.append(struct.unpack_from(">q", data, i)[0])
+            i += 8
+        elif tag == "d":
+            args.append(struct.unpack_from(">d", data, i)[0])
+            i += 8
+        elif tag == "s":
+            value, i = _osc_string(data, i)
+            args.append(value)
+        elif tag in "TF":
+            args.append(tag == "T")
+        else:
+            raise OscError(f"Unsupported OSC type tag {tag!r}")
+    return address, args
+
+def parse_osc(data: bytes) -> list:
+    """OSC packet -> [(address, args), ...], bundles flattened in order."""
+    try:
+        if data.startswith(b"#bundle\x00"):
+            messages = []
+            i = 16 # "#bundle\0" + time tag
+            while i < len(data):
+                size = struct.unpack_from(">i", data, i)[0]
+                i += 4
+                if size <= 0 or i + size > len(data):
+                    raise OscError("Truncated OSC bundle element")
+                messages.extend(parse_osc(data[i:i + size]))
+                i += size
+            return messages
+        return [_osc_message(data)]
+    except (struct.error, ValueError, UnicodeDecodeError) as e:
+        raise OscError(f"Invalid OSC packet: {e}") from e
+
+def parse_binary(data: bytes) -> list:
+    """Binary packet -> [(addr, op name, value), ...]"""
+    if len(data) < BINARY_HEADER.size:
+        raise OscError("Truncated binary packet")
+    magic, version, count = BINARY_HEADER.unpack_from(data)
+    if version != BINARY_VERSION or len(data) != BINARY_HEADER.size + count * BINARY_RECORD.size:
+        raise OscError(f"Invalid binary packet (version {version}, {count} records, {len(data)} bytes)")
+    records = []
+    for k in range(count):
+        addr, op, value = BINARY_RECORD.unpack_from(data, BINARY_HEADER.size + k * BINARY_RECORD.size)
+        if op not in BINARY_OPS:
+            raise OscError(f"Unknown binary op {op}")
+        records.append((addr, BINARY_OPS[op], value))
+    return records
+
+class OscStats:
+    __slots__ = ("packets", "commands", "rejected", "overhead_ns", "max_overhead_ns")
+
+    def __init__(self):
+        self.packets = 0
+        self.commands = 0
+        self.rejected = 0
+        self.overhead_ns = 0 # decoding + batching time on the host, from datagram to the batch handed to the bus
+        self.max_overhead_ns = 0
+
+    def report(self):
+        accepted = self.packets - self.rejected
+        return {
+            "packets": self.packets,
+            "commands": self.commands,
+            "rejected": self.rejected,
+            "mean_overhead_us": round(self.overhead_ns / accepted / 1000, 1) if accepted else None,
+            "max_overhead_us": round(self.max_overhead_ns / 1000, 1),
+        }
+
+class OscProtocol(asyncio.DatagramProtocol):
+    def __init__(self, motor_manager, max_speed: int = 1000, max_accel: int = 1000):
+        """
+            Args:
+                motor_manager = MotorManager driving the bus
+                max_speed, max_accel = highest speed and acceleration accepted (web_api.top_speed, top_accel)
+        """
+        self.motor_manager = motor_manager
+        self.max_speed = max_speed
+        self.max_accel = max_accel
+        self.stats = OscStats()
+        self.transport = None
+        self._tasks = set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        logging.info(f"OSC listener listening on {transport.get_extra_info('sockname')}")
+
+    def datagram_received(self, data: bytes, addr):
+        t0 = time.perf_counter_ns()
+        self.stats.packets += 1
+        try:
+            if data[:2] == BINARY_MAGIC:
+                commands = [c for a, op, value in parse_binary(data) for c in self._commands(a, op, [value])]
+            else:
+                commands = [c for address, args in parse_osc(data) for c in self._osc_commands(address, args)]
+        except OscError as e:
+            self.stats.rejected += 1
+            logging.debug(f"OSC packet from {addr} rejected: {e}")
+            return
+        if commands:
+            self._update_params(commands)
+            task = asyncio.ensure_future(self.motor_manager.send_batch(commands))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            self.stats.commands += len(commands)
+        elapsed = time.perf_counter_ns() - t0
+        self.stats.overhead_ns += elapsed
+        self.stats.max_overhead_ns = max(self.stats.max_overhead_ns, elapsed)
+
+    def error_received(self, exc):
+        logging.error(f"OSC receive error: {exc}")
+
+    def _update_params(self, commands):
+        """Host side maxspeed/accel follow the SAPs sent, like /p/setmaxspeed and /p/setaccel (DMX speed tables, ROR/ROL mapping)."""
+        mm = self.motor_manager
+        for a, cmd, param, _, value in commands:
+            if cmd != 5 or param not in HOST_PARAMS:
+                continue
+            key = HOST_PARAMS[param]
+            try:
+                if mm.connected[a][key] != value:
+                    mm.set_motor_param(a, key, value)
+            except (KeyError, ValueError) as e:
+                logging.warning(f"OSC {key} of motor {a} not updated: {e}")
+
+    def _osc_commands(self, address, args):
+        parts = address.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != OSC_ROOT:
+            raise OscError(f"Unknown OSC address {address}")
+        target, op = parts[1], parts[2]
+        if target == "all":
+            return [c for a in self.motor_manager.connected.addrs for c in self._commands(a, op, args)]
+        try:
+            a = int(target)
+        except ValueError:
+            raise OscError(f"Invalid motor address in {address}")
+        return self._commands(a, op, args)
+
+    def _value(self, args, i, low, high, what):
+        if len(args) <= i or isinstance(args[i], str):
+            raise OscError(f"Missing {what}")
+        try:
+            value = int(args[i])
+        except (ValueError, OverflowError):
+            raise OscError(f"Invalid {what} {args[i]}") # NaN, inf
+        if not (low <= value <= high):
+            raise OscError(f"{what} {value} out of range {low}-{high}")
+        return value
+
+    def _commands(self, a, op, args):
+        """Commands (addr, cmd, type, bank, value) of one operation on one motor."""
+        if a not in self.motor_manager.connected:
+            raise OscError(f"Motor {a} is not connected")
+        if op in ("goto", "move"):
+            commands = []
+            if len(args) > 1:
+                commands.append((a, 5, 4, 0, self._value(args, 1, 1, self.max_speed, "speed")))
+            commands.append((a, 4, 0 if op == "goto" else 1, 0, self._value(args, 0, -POS_LIMIT, POS_LIMIT, "position")))
+            return commands
+        if op in ("right", "left"):
+            return [(a, 1 if op == "right" else 2, 0, 0, self._value(args, 0, 0, self.max_speed, "velocity"))]
+        if op == "stop":
+            return [(a, 3, 0, 0, 0)]
+        if op == "speed":
+            return [(a, 5, 4, 0, self._value(args, 0, 1, self.max_speed, "speed"))]
+        if op == "accel":
+            return [(a, 5, 5, 0, self._value(args, 0, 1, self.max_accel, "acceleration"))]
+        if op == "home":
+            return [(a, 13, 0, 0, 0)]
+        raise OscError(f"Unknown operation {op}")
+
+async def start_osc(interface, port, motor_manager, max_speed=1000, max_accel=1000):
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: OscProtocol(motor_manager, max_speed=max_speed, max_accel=max_accel),
+        local_addr=(interface, port)
+    )
+    return transport, protocol
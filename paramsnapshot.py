@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from configstore import ConfigRepository, write_json_atomic
+
+"""
+
+Parameter snapshots
+Written for STRUCTURALS, 2025
+
+Reads every relevant axis parameter (GAP) and global parameter (GGP) of one motor
+or of the whole rig, with pipelined transactions (MotorManager.transact_many): one
+frame right after the other, instead of going through the command queue one call
+at a time. 40 motors x 30 parameters take a few seconds.
+
+Snapshots are stored in configs/snapshots/<name>.json as a compact document:
+
+    {"kind": "kinelink-param-snapshot", "version": 1, "taken": 1735689600.0, "port": "/dev/ttyUSB0",
+     "motors": {"10": {"axis": {"4": 100, "5": 100, ...}, "global": {"65": 0, ...}, "missing": [...]}}}
+
+Parameters are stored by number, names are in AXIS_PARAMS / GLOBAL_PARAMS. Two
+snapshots, or a snapshot and a configuration file, can be compared with diff().
+
+"""
+
+BASE_DIR = Path(__file__).resolve().parent
+SNAPSHOT_DIR = BASE_DIR / "configs" / "snapshots"
+SNAPSHOT_KIND = "kinelink-param-snapshot"
+SNAPSHOT_VERSION = 1
+
+# TMCM-1161 axis parameters (firmware manual, chapter 4)
+AXIS_PARAMS = {
+    0: "target position",
+    1: "actual position",
+    2: "target speed",
+    3: "actual speed",
+    4: "max positioning speed",
+    5: "max acceleration",
+    6: "absolute max current",
+    7: "standby current",
+    8: "target pos reached",
+    9: "ref switch status",
+    10: "right limit switch status",
+    11: "left limit switch status",
+    12: "right limit switch disable",
+    13: "left limit switch disable",
+    130: "minimum speed",
+    135: "actual acceleration",
+    138: "ramp mode",
+    140: "microstep resolution",
+    149: "soft stop flag",
+    153: "ramp divisor",
+    154: "pulse divisor",
+    193: "reference search mode",
+    194: "reference search speed",
+    195: "reference switch speed",
+    196: "end switch distance",
+    204: "freewheeling",
+    206: "actual load value",
+    208: "driver error flags",
+    209: "encoder position",
+    210: "encoder prescaler",
+    214: "power down delay",
+}
+# values that change while the motor runs, left out of diffs unless asked for
+VOLATILE_AXIS = frozenset((0, 1, 2, 3, 8, 9, 10, 11, 135, 206, 208, 209))
+
+# global parameters, bank 0
+GLOBAL_PARAMS = {
+    65: "serial baud rate",
+    66: "serial address",
+    73: "configuration EEPROM lock",
+    75: "telegram pause time",
+    76: "serial host address",
+    77: "auto start mode",
+    81: "TMCL code protection",
+    132: "tick timer",
+}
+
+# configuration file keys stored on the module
+CONFIG_AXIS = {"maxspeed": 4, "accel": 5} # minspeed is host side only (DMX speed mapping), never written to the module
+
+async def take(motor_manager, addrs=None, port=None) -> dict:
+    """Read the axis and global parameters of the given motors (every connected motor by default)."""
+    mm = motor_manager
+    addrs = sorted(mm.connected) if addrs is None else list(addrs)
+    params = [(6, p, 0) for p in AXIS_PARAMS] + [(10, p, 0) for p in GLOBAL_PARAMS]
+    started = time.monotonic()
+    motors = {}
+    for addr in addrs:
+        # one probe first, so a module gone from the bus costs one timeout instead of one per parameter
+        probe = await mm.transact_many([mm.tmcl_packet_builder(addr, 6, 1, 0, 0)])
+        if probe[0] is None:
+            motors[str(addr)] = {"error": "no reply"}
+            continue
+        replies = await mm.transact_many([mm.tmcl_packet_builder(addr, cmd, typ, bank, 0) for cmd, typ, bank in params])
+        entry = {"axis": {}, "global": {}, "missing": []}
+        for (cmd, typ, _), reply in zip(params, replies):
+            if reply is None:
+                entry["missing"].append(f"{'axis' if cmd == 6 else 'global'}:{typ}")
+            else:
+                entry["axis" if cmd == 6 else "global"][str(typ)] = reply[4]
+        if not entry["missing"]:
+            del entry["missing"]
+        motors[str(addr)] = entry
+    elapsed = time.monotonic() - started
+    logging.info(f"Parameter snapshot of {len(addrs)} motors in {elapsed:.2f}s")
+    return {
+        "kind": SNAPSHOT_KIND,
+        "version": SNAPSHOT_VERSION,
+        "taken": round(time.time(), 3),
+        "port": port if port is not None else mm.port,
+        "elapsed": round(elapsed, 3),
+        "motors": motors,
+    }
+
+def from_config(config: dict) -> dict:
+    """Partial snapshot holding the module parameters of a configuration file, to diff a snapshot against it."""
+    motors = {}
+    for addr, params in config.items():
+        if not isinstance(params, dict):
+            continue
+        axis = {str(CONFIG_AXIS[k]): int(v) for k, v in params.items() if k in CONFIG_AXIS}
+        motors[str(addr)] = {"axis": axis, "global": {}}
+    return {"kind": SNAPSHOT_KIND, "version": SNAPSHOT_VERSION, "partial": True, "motors": motors}
+
+def diff(a: dict, b: dict, volatile: bool = False) -> dict:
+    """
+        Compare two snapshots. Returns {addr: {"axis:4 max positioning speed": [a, b], ...}} for every value that differs,
+        and the motors found in only one of them. When b is partial (from_config), only the parameters it holds are compared.
+    """
+    partial = b.get("partial", False)
+    motors_a, motors_b = a.get("motors", {}), b.get("motors", {})
+    changes = {}
+    for addr in sorted(set(motors_a) & set(motors_b), key=int):
+        ma, mb = motors_a[addr], motors_b[addr]
+        if "error" in ma or "error" in mb:
+            changes[addr] = {"error": ma.get("error") or mb.get("error")}
+            continue
+        motor_changes = {}
+        for section, names in (("axis", AXIS_PARAMS), ("global", GLOBAL_PARAMS)):
+            va, vb = ma.get(section, {}), mb.get(section, {})
+            keys = set(vb) if partial else set(va) | set(vb)
+            for key in sorted(keys, key=int):
+                if section == "axis" and not volatile and int(key) in VOLATILE_AXIS:
+                    continue
+                if va.get(key) != vb.get(key):
+                    motor_changes[f"{section}:{key} {names.get(int(key), '')}".rstrip()] = [va.get(key), vb.get(key)]
+        if motor_changes:
+            changes[addr] = motor_changes
+    return {
+        "changed": changes,
+        "only_in_a": sorted(set(motors_a) - set(motors_b), key=int),
+        "only_in_b": [] if partial else sorted(set(motors_b) - set(motors_a), key=int),
+    }
+
+def _save(name, snapshot):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    write_json_atomic(SNAPSHOT_DIR / f"{name}.json", snapshot, indent=None)
+
+def _load(name):
+    path = SNAPSHOT_DIR / f"{name}.json"
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        snapshot = json.load(f)
+    if snapshot.get("kind") != SNAPSHOT_KIND or snapshot.get("version", 0) > SNAPSHOT_VERSION:
+        raise ValueError(f"{name} is not a parameter snapshot this version can read")
+    return snapshot
+
+def _list():
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return []
+    return sorted(f[:-len(".json")] for f in os.listdir(SNAPSHOT_DIR) if f.endswith(".json") and not f.startswith("."))
+
+async def save(name: str, snapshot: dict):
+    if not ConfigRepository.valid_name(name):
+        raise ValueError(f"Invalid snapshot name {name!r}")
+    await asyncio.get_running_loop().run_in_executor(None, _save, name, snapshot)
+
+async def load(name: str):
+    if not ConfigRepository.valid_name(name):
+        return None
+    return await asyncio.get_running_loop().run_in_executor(None, _load, name)
+
+async def list_snapshots():
+    return await asyncio.get_running_loop().run_in_executor(None, _list)
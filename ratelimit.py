@@ -0,0 +1,64 @@
+import time
+
+"""
+
+Per-client rate limiting of the web API
+Written for STRUCTURALS, 2025
+
+Every API call on a motor (/m, /p) ends up as one or more transactions on a single
+serial bus. A token bucket per client address keeps one client (a runaway script,
+a dashboard polling too fast) from filling the serial queue for everybody else.
+
+Each client gets `burst` tokens, refilled at `rate` tokens per second, and every
+limited request takes one. Requests finding an empty bucket are answered 429 with
+a Retry-After header.
+
+"""
+
+class TokenBucket:
+    __slots__ = ("tokens", "stamp")
+
+    def __init__(self, tokens, stamp):
+        self.tokens = tokens
+        self.stamp = stamp
+
+class RateLimiter:
+    def __init__(self, rate: float = 20.0, burst: float = 40.0, max_clients: int = 4096):
+        """
+            Args:
+                rate = tokens refilled per second and per client (sustained requests/s)
+                burst = bucket size (requests a client can send at once)
+                max_clients = buckets kept, full buckets of idle clients are dropped beyond it
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets = {}
+        self.limited = 0 # requests answered 429
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def acquire(self, client: str, now: float | None = None) -> float:
+        """Take a token for a client. Returns 0 if the request is allowed, else the seconds to wait."""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            if len(self.buckets) >= self.max_clients:
+                self._prune(now)
+            bucket = self.buckets[client] = TokenBucket(self.burst, now)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.stamp) * self.rate)
+            bucket.stamp = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0.0
+        self.limited += 1
+        return (1 - bucket.tokens) / self.rate
+
+    def _prune(self, now):
+        for client in [c for c, b in self.buckets.items() if b.tokens + (now - b.stamp) * self.rate >= self.burst]:
+            del self.buckets[client]
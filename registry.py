@@ -0,0 +1,148 @@
+from array import array
+from collections.abc import MutableMapping
+
+"""
+
+Motor registry
+Written for STRUCTURALS, 2025
+
+Fixed 256-slot registry of the motors of a bus, indexed by TMCL module address.
+The fields read for every motor of every DMX frame live in parallel typed arrays
+(present, maxspeed, accel, maxpos, minspeed), next to per-slot lookup tables and
+command queues, so the Art-Net hot path indexes arrays instead of chaining dict
+lookups, and memory does not grow with the number of motors.
+
+For everything else the registry behaves like the former `connected` dict:
+registry[addr] is a MotorView, a dict-like view of the parameters of a motor
+(reads and writes go to the arrays, and bump `version`), `addr in registry`, len(), iteration over
+the present addresses in order. as_dict() returns plain dicts for JSON.
+
+"""
+
+SLOTS = 256
+HOT_FIELDS = ("maxspeed", "accel", "maxpos", "minspeed") # stored in typed arrays, in `connected` key order
+
+class MotorView(MutableMapping):
+    """Dict-like view of the parameters of one motor."""
+    __slots__ = ("_registry", "addr")
+
+    def __init__(self, registry, addr):
+        self._registry = registry
+        self.addr = addr
+
+    def __getitem__(self, key):
+        return self._registry.get_param(self.addr, key)
+
+    def __setitem__(self, key, value):
+        self._registry.set_param(self.addr, key, value)
+
+    def __delitem__(self, key):
+        if key in HOT_FIELDS:
+            raise KeyError(f"{key} can not be removed")
+        del self._registry.extra[self.addr][key]
+        self._registry.version += 1
+
+    def __iter__(self):
+        yield from HOT_FIELDS
+        yield from self._registry.extra[self.addr] or ()
+
+    def __len__(self):
+        return len(HOT_FIELDS) + len(self._registry.extra[self.addr] or ())
+
+    def __repr__(self):
+        return f"MotorView({self.addr}, {dict(self)})"
+
+class MotorRegistry(MutableMapping):
+    def __init__(self):
+        self.present = bytearray(SLOTS)
+        self.maxspeed = array("i", bytes(4 * SLOTS))
+        self.accel = array("i", bytes(4 * SLOTS))
+        self.maxpos = array("i", bytes(4 * SLOTS))
+        self.minspeed = array("i", bytes(4 * SLOTS))
+        self.extra = [None] * SLOTS # other parameters (response curves, ...), dict per present slot
+        self.luts = [None] * SLOTS # DMX lookup tables, see MotorManager.rebuild_luts
+        self.queues = [None] * SLOTS # per motor command queues, see MotorManager.add_motor
+        self.addrs = () # present addresses, ascending
+        self.version = 0 # bumped on every change (motors added/removed, parameters written), used for API ETags
+
+    # explicit API
+    def add(self, addr: int, params) -> bool:
+        """Store the parameters of a motor, returns True if the slot was empty."""
+        if not (0 <= addr < SLOTS):
+            raise KeyError(f"Motor address {addr} out of range 0-{SLOTS - 1}")
+        new = not self.present[addr]
+        extra = {}
+        for key, value in params.items():
+            if key in HOT_FIELDS:
+                getattr(self, key)[addr] = int(value)
+            else:
+                extra[key] = value
+        self.extra[addr] = extra
+        self.version += 1
+        if new:
+            self.present[addr] = 1
+            self.addrs = tuple(sorted(self.addrs + (addr,)))
+        return new
+
+    def remove(self, addr: int) -> bool:
+        """Empty the slot of a motor, returns False if it was not present."""
+        if addr not in self:
+            return False
+        self.present[addr] = 0
+        for key in HOT_FIELDS:
+            getattr(self, key)[addr] = 0
+        self.extra[addr] = None
+        self.luts[addr] = None
+        self.queues[addr] = None
+        self.addrs = tuple(a for a in self.addrs if a != addr)
+        self.version += 1
+        return True
+
+    def get_param(self, addr: int, key: str):
+        if addr not in self:
+            raise KeyError(addr)
+        if key in HOT_FIELDS:
+            return getattr(self, key)[addr]
+        return self.extra[addr][key]
+
+    def set_param(self, addr: int, key: str, value):
+        if addr not in self:
+            raise KeyError(addr)
+        if key in HOT_FIELDS:
+            getattr(self, key)[addr] = int(value)
+        else:
+            self.extra[addr][key] = value
+        self.version += 1
+
+    def params(self, addr: int) -> dict:
+        """Plain dict copy of the parameters of a motor."""
+        return dict(MotorView(self, addr)) if addr in self else None
+
+    def as_dict(self) -> dict:
+        """{addr: params} plain dicts, the former `connected` layout, for JSON and config files."""
+        return {addr: dict(MotorView(self, addr)) for addr in self.addrs}
+
+    # dict compatibility
+    def __contains__(self, addr):
+        return type(addr) is int and 0 <= addr < SLOTS and self.present[addr] == 1
+
+    def __getitem__(self, addr):
+        if addr not in self:
+            raise KeyError(addr)
+        return MotorView(self, addr)
+
+    def __setitem__(self, addr, params):
+        self.add(addr, params)
+
+    def __delitem__(self, addr):
+        if not self.remove(addr):
+            raise KeyError(addr)
+
+    def __iter__(self):
+        return iter(self.addrs)
+
+    def __len__(self):
+        return len(self.addrs)
+
+    def __repr__(self):
+        return f"MotorRegistry({self.as_dict()})"
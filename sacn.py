@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import socket
+import struct
+import sys
+import time
+from itertools import zip_longest
+from artnet import ArtNetProtocol
+
+"""
+
+sACN (ANSI E1.31) receiver
+Written for STRUCTURALS, 2025
+
+Receives DMX over sACN multicast and feeds the same motor pipeline as Art-Net
+(ArtNetProtocol._process_dmx, same 5 channels per motor mapping).
+
+Only the multicast groups of the patched universe are joined, so the kernel drops
+every other universe before it reaches Python. Sources are merged per E1.31:
+the highest priority wins, sources with equal priority are merged HTP (highest
+value per channel) or LTP (latest packet wins). A source that stops sending for
+2.5 s or sends a stream terminated packet is dropped from the merge.
+
+Kinelink universes follow the Art-Net numbering (0 based), Art-Net universe N is
+received as sACN universe N+1.
+
+"""
+
+SACN_PORT = 5568
+ACN_PACKET_ID = b"ASC-E1.17\x00\x00\x00"
+VECTOR_ROOT_E131_DATA = 0x00000004
+VECTOR_E131_DATA_PACKET = 0x00000002
+VECTOR_DMP_SET_PROPERTY = 0x02
+OPTION_PREVIEW = 0x80
+OPTION_TERMINATED = 0x40
+SOURCE_TIMEOUT = 2.5
+IP_MULTICAST_ALL = getattr(socket, "IP_MULTICAST_ALL", 49) # linux only, not exposed by every python build
+
+ROOT = struct.Struct(">HH12sHI16s") # preamble, postamble, ACN id, flags&length, vector, CID
+FRAMING = struct.Struct(">HI64sBHBBH") # flags&length, vector, source name, priority, sync, sequence, options, universe
+DMP = struct.Struct(">HBBHHH") # flags&length, vector, address type, first address, increment, value count
+
+def sacn_universe(universe: int) -> int:
+    """sACN universe number used for a Kinelink (Art-Net numbered) universe."""
+    return universe + 1
+
+def multicast_group(sacn_univ: int) -> str:
+    return f"239.255.{(sacn_univ >> 8) & 0xFF}.{sacn_univ & 0xFF}"
+
+def create_socket(interface: str = "0.0.0.0", port: int = SACN_PORT) -> socket.socket:
+    """UDP socket for sACN: bound to the sACN port, receiving only the multicast groups it joins."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if sys.platform.startswith("linux"):
+        # otherwise linux delivers groups joined by any other socket of the host too
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, IP_MULTICAST_ALL, 0)
+        except OSError:
+            pass
+    sock.bind(("", port))
+    sock.setblocking(False)
+    return sock
+
+class SACNSource:
+    __slots__ = ("cid", "name", "priority", "sequence", "data", "last_seen")
+
+    def __init__(self, cid, name):
+        self.cid = cid
+        self.name = name
+        self.priority = 100
+        self.sequence = None
+        self.data = b""
+        self.last_seen = 0.0
+
+class SACNProtocol(ArtNetProtocol):
+    source = "sacn"
+
+    def __init__(self, motor_manager=None, universe=0, merge="htp", interface="0.0.0.0"):
+        super().__init__(motor_manager, universe)
+        if merge not in ("htp", "ltp"):
+            raise ValueError(f"Unknown sACN merge mode {merge!r}, expected htp or ltp")
+        self.merge = merge
+        self.interface = interface
+        self.sources = {}
+        self.sock = None
+        self._joined = set()
+        self._last_source = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.sock = transport.get_extra_info("socket")
+        self._join(sacn_universe(self.universe))
+        logging.info(f"sACN listener listening on {transport.get_extra_info('sockname')}, universe {sacn_universe(self.universe)} ({self.merge.upper()} merge)")
+
+    def _membership(self, option, sacn_univ):
+        if self.sock is None:
+            return
+        mreq = socket.inet_aton(multicast_group(sacn_univ)) + socket.inet_aton(self.interface)
+        try:
+            self.sock.setsockopt(socket.IPPROTO_IP, option, mreq)
+        except OSError as e:
+            logging.error(f"sACN multicast membership change for universe {sacn_univ} failed: {e}")
+            return False
+        return True
+
+    def _join(self, sacn_univ):
+        if sacn_univ not in self._joined and self._membership(socket.IP_ADD_MEMBERSHIP, sacn_univ):
+            self._joined.add(sacn_univ)
+
+    def _leave(self, sacn_univ):
+        if sacn_univ in self._joined:
+            self._membership(socket.IP_DROP_MEMBERSHIP, sacn_univ)
+            self._joined.discard(sacn_univ)
+
+    def set_universe(self, new_universe: int):
+        """Dynamically update the universe, and move the multicast membership with it"""
+        self._leave(sacn_universe(self.universe))
+        super().set_universe(new_universe)
+        self.sources.clear()
+        self._join(sacn_universe(new_universe))
+
+    def datagram_received(self, data: bytes, addr):
+        if not self.enabled or len(data) < 126:
+            return
+        _, _, acn_id, _, root_vector, cid = ROOT.unpack_from(data, 0)
+        if acn_id != ACN_PACKET_ID or root_vector != VECTOR_ROOT_E131_DATA:
+            return
+        _, vector, name, priority, _, sequence, options, univ = FRAMING.unpack_from(data, 38)
+        if vector != VECTOR_E131_DATA_PACKET or univ != sacn_universe(self.universe):
+            return
+        if options & OPTION_PREVIEW:
+            return
+        now = time.monotonic()
+        if options & OPTION_TERMINATED:
+            if self.sources.pop(cid, None) is not None:
+                logging.info(f"sACN source {name.rstrip(bytes(1)).decode(errors='replace')} terminated its stream")
+                self._output(now)
+            return
+        _, dmp_vector, _, _, _, count = DMP.unpack_from(data, 115)
+        if dmp_vector != VECTOR_DMP_SET_PROPERTY or data[125] != 0: # only DMX null start code
+            return
+        source = self.sources.get(cid)
+        if source is None:
+            source = SACNSource(cid, name.rstrip(bytes(1)).decode(errors="replace"))
+            self.sources[cid] = source
+            logging.info(f"New sACN source {source.name} at priority {priority}")
+        elif source.sequence is not None:
+            # E1.31 6.7.2: drop out of order packets
+            diff = (sequence - source.sequence) & 0xFF
+            if diff == 0 or diff > 236:
+                return
+        source.sequence = sequence
+        source.priority = priority
+        source.data = data[126:125 + count]
+        source.last_seen = now
+        self._last_source = cid
+        self._output(now)
+
+    def _merge(self, now):
+        for cid in [c for c, s in self.sources.items() if now - s.last_seen > SOURCE_TIMEOUT]:
+            logging.warning(f"sACN source {self.sources[cid].name} timed out")
+            del self.sources[cid]
+        if not self.sources:
+            return None
+        top = max(s.priority for s in self.sources.values())
+        winners = [s for s in self.sources.values() if s.priority == top]
+        if len(winners) == 1:
+            return winners[0].data
+        if self.merge == "ltp":
+            latest = self.sources.get(self._last_source)
+            if latest is not None and latest.priority == top:
+                return latest.data
+            return max(winners, key=lambda s: s.last_seen).data
+        return bytes(max(values) for values in zip_longest(*(s.data for s in winners), fillvalue=0))
+
+    def _output(self, now):
+        merged = self._merge(now)
+        if merged is not None:
+            self._process_dmx(merged, self.motor_manager)
+
+async def start_sacn(interface, universe, motor_manager=None, merge="htp"):
+    loop = asyncio.get_running_loop()
+    sock = create_socket(interface)
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: SACNProtocol(motor_manager, universe, merge=merge, interface=interface),
+        sock=sock
+    )
+    return transport, protocol
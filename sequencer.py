@@ -0,0 +1,262 @@
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+
+"""
+
+Timeline sequencer
+Written for STRUCTURALS, 2025
+
+Plays timelines of per-motor moves stored in configs/timelines/<name>.json:
+
+    {
+        "loop": true,
+        "duration": 60.0,
+        "cues": [
+            {"t": 0.0, "addr": 10, "pos": 2000, "speed": 300, "accel": 100},
+            {"t": 12.5, "addr": 10, "pos": 0}
+        ]
+    }
+
+t is the start time of the move in seconds from the start of the timeline, speed and
+accel are optional. With loop, the timeline restarts every `duration` seconds
+(default: time of the last cue).
+
+Every deadline is computed from the start time of the playback on the monotonic
+event loop clock (start + iteration * duration + t) and scheduled with loop.call_at,
+so errors never accumulate, an 8 hour loop is as precise as its first iteration.
+Speed and acceleration of a cue are sent `lead` seconds ahead of its deadline, so
+only the MVP itself is sent at the deadline. Lateness of every MVP (deadline to
+reply of the module, serial queue included) is recorded in a histogram.
+
+"""
+
+BASE_DIR = Path(__file__).resolve().parent
+TIMELINE_DIR = BASE_DIR / "configs" / "timelines"
+LATENESS_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+class LatenessHistogram:
+    def __init__(self, buckets=LATENESS_BUCKETS_MS):
+        self.buckets = buckets
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, lateness_ms: float):
+        lateness_ms = max(lateness_ms, 0.0)
+        self.count += 1
+        self.total += lateness_ms
+        self.max = max(self.max, lateness_ms)
+        for i, bound in enumerate(self.buckets):
+            if lateness_ms < bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def percentile(self, p: float):
+        """Upper bound (ms) of the bucket holding the p-th percentile."""
+        if self.count == 0:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def report(self):
+        labels = [f"<{b}ms" for b in self.buckets] + [f">={self.buckets[-1]}ms"]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else None,
+            "max_ms": round(self.max, 3),
+            "p99_ms": self.percentile(99),
+            "histogram": dict(zip(labels, self.counts)),
+        }
+
+class Cue:
+    __slots__ = ("t", "addr", "pos", "speed", "accel")
+
+    def __init__(self, t, addr, pos, speed=None, accel=None):
+        self.t = float(t)
+        self.addr = int(addr)
+        self.pos = int(pos)
+        self.speed = None if speed is None else int(speed)
+        self.accel = None if accel is None else int(accel)
+        if self.t < 0 or not (0 <= self.addr <= 255):
+            raise ValueError(f"Invalid cue t={t} addr={addr}")
+
+class Timeline:
+    def __init__(self, name, cues, loop=False, duration=None):
+        self.name = name
+        self.cues = sorted(cues, key=lambda c: c.t)
+        self.loop = loop
+        last = self.cues[-1].t if self.cues else 0.0
+        self.duration = float(duration) if duration is not None else last
+        if self.loop and self.duration <= 0:
+            raise ValueError("A looping timeline needs a duration > 0")
+        if self.duration < last:
+            raise ValueError(f"Timeline duration {self.duration}s is shorter than its last cue at {last}s")
+
+    @classmethod
+    def from_dict(cls, name, data):
+        cues = [Cue(c["t"], c["addr"], c["pos"], c.get("speed"), c.get("accel")) for c in data.get("cues", [])]
+        if not cues:
+            raise ValueError(f"Timeline {name} has no cue")
+        return cls(name, cues, loop=bool(data.get("loop", False)), duration=data.get("duration"))
+
+class Sequencer:
+    def __init__(self, motor_manager, timeline_dir=TIMELINE_DIR, lead: float = 0.1, start_delay: float = 0.2):
+        """
+            Args:
+                motor_manager = MotorManager driving the bus
+                timeline_dir = directory of the timeline files
+                lead = seconds ahead of a deadline where speed/accel of a cue are sent
+                start_delay = seconds between the start request and the first deadline, leaves room for staging
+        """
+        self.motor_manager = motor_manager
+        self.timeline_dir = Path(timeline_dir)
+        self.lead = lead
+        self.start_delay = start_delay
+        self.timeline = None
+        self.started = None # loop time of t=0 of the first iteration
+        self.base = None # loop time of t=0 of the iteration being staged
+        self.iteration = 0
+        self.index = 0
+        self.lateness = LatenessHistogram()
+        self._handles = set()
+        self._staged = {} # cue id -> task sending its speed/accel
+        self._tasks = set()
+
+    def _read(self, name):
+        path = self.timeline_dir / f"{name}.json"
+        with open(path, "r") as f:
+            return Timeline.from_dict(name, json.load(f))
+
+    def _list(self):
+        if not os.path.isdir(self.timeline_dir):
+            return []
+        return sorted(f[:-len(".json")] for f in os.listdir(self.timeline_dir) if f.endswith(".json") and not f.startswith("."))
+
+    async def list(self):
+        return await asyncio.get_running_loop().run_in_executor(None, self._list)
+
+    async def load(self, name: str) -> Timeline:
+        if not name or "/" in name or name.startswith("."):
+            raise ValueError(f"Invalid timeline name {name!r}")
+        return await asyncio.get_running_loop().run_in_executor(None, self._read, name)
+
+    @property
+    def running(self):
+        return self.timeline is not None
+
+    async def start(self, name: str, loop=None):
+        """Load a timeline and start playing it. loop overrides the loop flag of the file."""
+        timeline = await self.load(name)
+        if loop is not None:
+            timeline.loop = loop
+        self.stop()
+        self.timeline = timeline
+        self.iteration = 0
+        self.index = 0
+        self.lateness.reset()
+        self.started = asyncio.get_running_loop().time() + self.start_delay
+        self.base = self.started
+        logging.info(f"Sequencer playing {name}: {len(timeline.cues)} cues, {timeline.duration}s{' looped' if timeline.loop else ''}")
+        self._schedule_next()
+
+    def stop(self):
+        for handle in self._handles:
+            handle.cancel()
+        self._handles.clear()
+        for task in list(self._tasks):
+            task.cancel()
+        self._staged.clear()
+        if self.timeline is not None:
+            logging.info(f"Sequencer stopped {self.timeline.name}")
+        self.timeline = None
+
+    def _call_at(self, when, fn, *args):
+        handle = None
+        def run():
+            self._handles.discard(handle)
+            fn(*args)
+        handle = asyncio.get_running_loop().call_at(when, run)
+        self._handles.add(handle)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _schedule_next(self):
+        timeline = self.timeline
+        if timeline is None:
+            return
+        if self.index >= len(timeline.cues):
+            if not timeline.loop:
+                # let the last moves go out, then report the end
+                self._call_at(self.base + timeline.duration, self._finish)
+                return
+            self.index = 0
+            self.iteration += 1
+            self.base += timeline.duration
+        cue = timeline.cues[self.index]
+        deadline = self.base + cue.t
+        key = (self.iteration, self.index)
+        self.index += 1
+        self._call_at(deadline - self.lead, self._stage, cue, key, deadline)
+
+    def _finish(self):
+        if self.timeline is not None and not self._tasks:
+            logging.info(f"Sequencer finished {self.timeline.name}, lateness {self.lateness.report()}")
+            self.timeline = None
+        elif self.timeline is not None:
+            self._call_at(asyncio.get_running_loop().time() + 0.05, self._finish)
+
+    def _stage(self, cue, key, deadline):
+        if cue.speed is not None or cue.accel is not None:
+            self._staged[key] = self._spawn(self._send_params(cue))
+        self._call_at(deadline, self._fire, cue, key, deadline)
+        self._schedule_next()
+
+    async def _send_params(self, cue):
+        if cue.speed is not None:
+            await self.motor_manager.sap(cue.addr, 4, cue.speed)
+        if cue.accel is not None:
+            await self.motor_manager.sap(cue.addr, 5, cue.accel)
+
+    def _fire(self, cue, key, deadline):
+        self._spawn(self._send_move(cue, key, deadline))
+
+    async def _send_move(self, cue, key, deadline):
+        staged = self._staged.pop(key, None)
+        if staged is not None and not staged.done():
+            logging.debug(f"Sequencer cue for motor {cue.addr} still staging at its deadline")
+            await staged
+        await self.motor_manager.mvp(cue.addr, 0, 0, cue.pos)
+        # measured once the MVP is through the serial queue and answered (or timed out): what the motor actually saw
+        self.lateness.add((asyncio.get_running_loop().time() - deadline) * 1000)
+
+    def status(self):
+        timeline = self.timeline
+        iteration, position = None, None
+        if timeline is not None:
+            elapsed = max(asyncio.get_running_loop().time() - self.started, 0.0)
+            iteration, position = divmod(elapsed, timeline.duration) if timeline.loop else (0, elapsed)
+        return {
+            "running": timeline is not None,
+            "timeline": timeline.name if timeline else None,
+            "loop": timeline.loop if timeline else None,
+            "iteration": None if iteration is None else int(iteration),
+            "position_s": None if position is None else round(position, 3),
+            "lateness": self.lateness.report(),
+        }
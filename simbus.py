@@ -0,0 +1,319 @@
+import asyncio
+import logging
+import struct
+import time
+from TMCL import PPS_PER_VELOCITY_UNIT
+
+"""
+
+Simulated TMCL bus
+Written for STRUCTURALS, 2025
+
+Stands in for the USB-RS485 adapter so Kinelink can run without hardware
+(development, fleet tests on loopback, soak tests). Each simulated module answers
+9-byte TMCL frames like a TMCM-1161 would, with a configurable reply latency.
+Addresses without a simulated module never answer, exactly like an empty bus slot.
+
+Motion is integrated lazily from the elapsed time, `time_scale` speeds up the
+simulated clock (time_scale=10 makes a 10 s move complete in 1 s).
+
+TMCL programs can be downloaded (132/133, instructions answered with status 101)
+and run (129/128/135, see tmclprog.py). A running program is stepped at the exact
+simulated times its waits end, whenever the module is queried.
+
+"""
+
+PROGRAM_STEPS_MAX = 10000 # instructions executed in a row before a program without wait is considered runaway
+
+def parse_spec(spec: str) -> list:
+    """Parse a simulated bus description like '10-19' or '10,11,20-22' into a list of addresses."""
+    addrs = []
+    for part in str(spec).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            addrs.extend(range(int(lo), int(hi) + 1))
+        else:
+            addrs.append(int(part))
+    return [a for a in addrs if 0 <= a <= 255]
+
+class SimulatedMotor:
+    def __init__(self, addr: int, clock):
+        self.addr = addr
+        self.clock = clock
+        self.pos = 0.0
+        self.target = 0
+        self.velocity = 0.0 # signed microsteps/s in velocity mode
+        self.mode = "idle" # idle, position, velocity, rfs
+        self.axis = {4: 100, 5: 100, 6: 128, 7: 8, 130: 10, 138: 0, 140: 6, 153: 7, 154: 3, 193: 1, 194: 100, 195: 10}
+        self.globals = {(65, 0): 0, (66, 0): addr, (77, 0): 0}
+        self.temp = 25
+        self.rfs_until = None
+        self.program = [] # (cmd, type, motor, value) stored in the program EEPROM
+        self.program_running = False
+        self.pc = 0
+        self.downloading = None # next program address while in download mode
+        self._wait = None # ("ticks", end time), ("pos",) or ("rfs",): WAIT instruction the program is blocked on
+        self._t = clock()
+
+    def update(self):
+        now = self.clock()
+        for _ in range(PROGRAM_STEPS_MAX):
+            t = self._program_event(now)
+            if t is None:
+                break
+            self._advance(t)
+            self._wait = None
+            self._step_program()
+        self._advance(now)
+
+    def _motion_end(self):
+        """Simulated time the current move ends, None for endless rotation."""
+        if self.mode == "position":
+            return self._t + abs(self.target - self.pos) / (self.axis[4] * PPS_PER_VELOCITY_UNIT)
+        if self.mode == "rfs":
+            return self.rfs_until
+        if self.mode == "velocity":
+            return None
+        return self._t
+
+    def _program_event(self, now):
+        """Time (<= now) at which the running program can execute its next instruction, None if it can not yet."""
+        if not self.program_running:
+            return None
+        if self._wait is None:
+            return self._t
+        end = self._wait[1] if self._wait[0] == "ticks" else self._motion_end()
+        return end if end is not None and end <= now else None
+
+    def _step_program(self):
+        """Execute program instructions until a WAIT blocks or the program stops."""
+        for _ in range(PROGRAM_STEPS_MAX):
+            if self.pc >= len(self.program):
+                self.program_running = False
+                return
+            cmd, typ, motor, value = self.program[self.pc]
+            self.pc += 1
+            if cmd == 28: # STOP
+                self.program_running = False
+                return
+            if cmd == 22: # JA
+                self.pc = value
+            elif cmd == 27: # WAIT
+                if typ == 0:
+                    self._wait = ("ticks", self._t + value * 0.01)
+                elif typ == 1:
+                    self._wait = ("pos",)
+                elif typ == 4:
+                    self._wait = ("rfs",)
+                if self._wait is not None:
+                    return
+            else:
+                self._execute(cmd, typ, motor, value)
+        self.program_running = False # runaway program without any wait
+        logging.warning(f"Simulated module {self.addr}: program stopped, {PROGRAM_STEPS_MAX} instructions without a wait")
+
+    def _advance(self, now):
+        dt = now - self._t
+        if dt <= 0:
+            return
+        self._t = now
+        if self.mode == "velocity":
+            self.pos += self.velocity * dt
+        elif self.mode == "position":
+            step = self.axis[4] * PPS_PER_VELOCITY_UNIT * dt
+            delta = self.target - self.pos
+            if abs(delta) <= step + 1e-6: # float error of _motion_end
+                self.pos = float(self.target)
+                self.mode = "idle"
+            else:
+                self.pos += step if delta > 0 else -step
+        elif self.mode == "rfs" and now >= self.rfs_until:
+            self.pos = 0.0
+            self.target = 0
+            self.mode = "idle"
+            self.rfs_until = None
+
+    def actual_speed(self):
+        if self.mode == "velocity":
+            return int(self.velocity / PPS_PER_VELOCITY_UNIT)
+        if self.mode in ("position", "rfs"):
+            return self.axis[4] if self.target >= self.pos else -self.axis[4]
+        return 0
+
+    def execute(self, cmd, typ, bank, value):
+        """Run one TMCL instruction, return (status, value)."""
+        self.update()
+        if self.downloading is not None and cmd != 133:
+            # download mode: the instruction is stored at the next program address, not executed
+            del self.program[self.downloading:]
+            self.program.append((cmd, typ, bank, value))
+            self.downloading += 1
+            return 101, value
+        if cmd == 132: # enter download mode
+            self.program_running = False
+            self.downloading = value
+            return 100, value
+        if cmd == 133: # exit download mode
+            self.downloading = None
+            return 100, 0
+        if cmd == 128: # stop application
+            self.program_running = False
+            return 100, 0
+        if cmd == 129: # run application, from address `value` with type 1
+            if typ == 1:
+                self.pc = value
+            self._wait = None
+            self.program_running = bool(self.program)
+            self.update()
+            return 100, 0
+        if cmd == 131: # reset application
+            self.program_running = False
+            self.pc = 0
+            self._wait = None
+            return 100, 0
+        if cmd == 135: # application status: 0 stopped, 1 running
+            return 100, int(self.program_running)
+        return self._execute(cmd, typ, bank, value)
+
+    def _execute(self, cmd, typ, bank, value):
+        if cmd in (1, 2): # ROR / ROL
+            self.mode = "velocity"
+            self.velocity = (value if cmd == 1 else -value) * PPS_PER_VELOCITY_UNIT
+            return 100, value
+        if cmd == 3: # MST
+            self.mode = "idle"
+            self.velocity = 0.0
+            self.target = int(self.pos)
+            return 100, 0
+        if cmd == 4: # MVP
+            if typ == 0:
+                self.target = value
+            elif typ == 1:
+                self.target = int(self.pos) + value
+            else:
+                return 3, 0
+            self.mode = "position"
+            return 100, value
+        if cmd == 5: # SAP
+            if typ == 0:
+                self.target = value
+                self.mode = "position"
+            elif typ == 1:
+                self.pos = float(value)
+            else:
+                self.axis[typ] = value
+            return 100, value
+        if cmd == 6: # GAP
+            if typ == 0:
+                return 100, int(self.target)
+            if typ == 1:
+                return 100, int(self.pos)
+            if typ == 3:
+                return 100, self.actual_speed()
+            if typ == 8:
+                return 100, int(self.mode == "idle" and int(self.pos) == self.target)
+            return 100, self.axis.get(typ, 0)
+        if cmd in (7, 8, 11, 12): # STAP, RSAP, STGP, RSGP
+            return 100, 0
+        if cmd == 9: # SGP
+            self.globals[(typ, bank)] = value
+            return 100, value
+        if cmd == 10: # GGP
+            return 100, self.globals.get((typ, bank), 0)
+        if cmd == 13: # RFS
+            if typ == 0:
+                self.mode = "rfs"
+                self.target = 0
+                distance = abs(self.pos) + 2000
+                self.rfs_until = self._t + distance / (self.axis.get(194, 100) * PPS_PER_VELOCITY_UNIT)
+                return 100, 0
+            if typ == 1:
+                self.mode = "idle"
+                self.rfs_until = None
+                return 100, 0
+            return 100, int(self.mode == "rfs")
+        if cmd == 14: # SIO
+            return 100, value
+        if cmd == 15: # GIO
+            if typ == 9 and bank == 1:
+                return 100, self.temp
+            return 100, 0
+        return 2, 0
+
+class SimulatedBus:
+    def __init__(self, addrs, latency: float = 0.002, time_scale: float = 1.0):
+        """
+            Args:
+                addrs = module addresses present on the simulated bus
+                latency = reply delay of a module in seconds (wire time + turnaround)
+                time_scale = simulated seconds per real second
+        """
+        self.latency = latency
+        self.time_scale = time_scale
+        self._t0 = time.monotonic()
+        self.motors = {a: SimulatedMotor(a, self.clock) for a in addrs}
+        self.frames = 0
+
+    def clock(self):
+        return (time.monotonic() - self._t0) * self.time_scale
+
+    def reply(self, frame: bytes):
+        """Return the 9-byte reply to a TMCL frame, or None when no module answers."""
+        if len(frame) != 9 or sum(frame[:8]) & 0xFF != frame[8]:
+            return None
+        addr, cmd, typ, bank, value = struct.unpack(">BBBBi", frame[:8])
+        motor = self.motors.get(addr)
+        if motor is None:
+            return None
+        self.frames += 1
+        status, value = motor.execute(cmd, typ, bank, value)
+        data = bytearray(9)
+        data[0:8] = struct.pack(">BBBBi", 2, addr, status, cmd, value)
+        data[8] = sum(data[0:8]) & 0xFF
+        return bytes(data)
+
+class SimulatedSerialTransport(asyncio.Transport):
+    def __init__(self, loop, protocol, bus: SimulatedBus):
+        super().__init__()
+        self._loop = loop
+        self._protocol = protocol
+        self._bus = bus
+        self._closing = False
+
+    def write(self, data):
+        if self._closing:
+            return
+        data = bytes(data)
+        for i in range(0, len(data) - 8, 9):
+            reply = self._bus.reply(data[i:i + 9])
+            if reply is not None:
+                self._loop.call_later(self._bus.latency, self._deliver, reply)
+
+    def _deliver(self, reply):
+        if not self._closing:
+            self._protocol.data_received(reply)
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        if not self._closing:
+            self._closing = True
+            self._loop.call_soon(self._protocol.connection_lost, None)
+
+    def abort(self):
+        self.close()
+
+    def get_extra_info(self, name, default=None):
+        return {"serial": None, "simulated": True}.get(name, default)
+
+async def create_simulated_connection(loop, protocol_factory, bus: SimulatedBus):
+    """Same contract as serial_asyncio.create_serial_connection, backed by a SimulatedBus."""
+    protocol = protocol_factory()
+    transport = SimulatedSerialTransport(loop, protocol, bus)
+    protocol.connection_made(transport)
+    logging.info(f"Simulated TMCL bus with {len(bus.motors)} modules")
+    return transport, protocol
@@ -0,0 +1,317 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import struct
+import sys
+import time
+import tracemalloc
+import httpx
+import simbus
+import web_api
+from TMCL import MotorManager
+from artnet import ArtNetProtocol, ARTNET_HEADER, OPCODE_DMX
+from events import EventBus
+from motion import MotionTracker
+from ratelimit import RateLimiter
+
+"""
+
+Soak test
+Written for STRUCTURALS, 2025
+
+Runs Kinelink for hours against a simulated TMCL bus (simbus) and watches for what
+only shows up after weeks in an installation: memory growth, tasks piling up,
+command latency drifting.
+
+Load:
+    - Art-Net: 44 ArtDmx packets/s through ArtNetProtocol.datagram_received, every
+      motor sweeping its position (CH4) and changing its speed (CH1), which keeps
+      the serial bus saturated
+    - API: /p/getpos, /p/gettemp, /p/connected, /m/gotopos and /p/setmaxspeed
+      through the FastAPI app
+    - probe: one GAP every 50 ms, its round trip is the command latency
+    - churn: a motor is removed and added back every `churn` seconds (worker tasks)
+
+The serial bus can not be accelerated and DMX already keeps it busy, so `speed`
+accelerates the rest: the simulated motors move `speed` times faster (moves
+complete, motion tracking and position polling see `speed` times more moves) and
+motors are churned `speed` times more often.
+
+Every `interval` seconds a sample is printed as a JSON line: traced memory
+(tracemalloc), task count, p99 command latency of the interval, queue and buffer
+sizes. After `warmup` seconds the first sample becomes the baseline; the run fails
+(exit code 1) when memory grows more than `max_mem_growth` MB, the task count more
+than `max_task_growth`, or the p99 latency more than `max_latency_ratio` times the
+baseline, or when more DMX commands are dropped (motor queue full, ArtNetStats.dropped)
+or more API requests fail (non-200 answers) in an interval than `max_dropped` and
+`max_api_errors`. The allocations that grew the most since the baseline are in the report.
+
+    python soak.py --hours 2 --motors 1,6,11,16 --speed 10 --report soak.json
+
+"""
+
+DMX_RATE = 44 # frames/s of a typical console
+API_RATE = 5 # requests/s
+PROBE_INTERVAL = 0.05
+LATENCY_FLOOR_MS = 2.0 # p99 drifts smaller than this are noise
+
+def artdmx_packet(universe: int, data: bytes, sequence: int = 0) -> bytes:
+    """ArtDmx packet carrying `data` (up to 512 channels) on `universe`."""
+    return ARTNET_HEADER + struct.pack("<HBBBBH", OPCODE_DMX, 0, 14, sequence, 0, universe) + struct.pack(">H", len(data)) + bytes(data)
+
+def dmx_frame(addrs, k: int, hold: int) -> bytearray:
+    """
+        Frame k of the synthetic show: speed (CH1) and position (CH4) of every motor change every `hold` frames,
+        together, like a console cue. Commands that do not fit the motor queue are counted by ArtNetStats.dropped.
+    """
+    data = bytearray(512)
+    for addr in addrs:
+        base = addr - 1
+        if base + 4 >= 512:
+            continue
+        step = k // hold + addr * 7
+        data[base] = 100 + step % 100
+        data[base + 3] = 2 + step % 250
+    return data
+
+def p99(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, math.ceil(0.99 * len(ordered)) - 1)]
+
+class Soak:
+    def __init__(self, addrs, speed=1.0, interval=60.0, warmup=120.0, churn=60.0, max_mem_growth=5.0, max_task_growth=5, max_latency_ratio=2.0, max_dropped=0, max_api_errors=0, fail_fast=False):
+        self.addrs = addrs
+        self.speed = speed
+        self.interval = interval
+        self.warmup = warmup
+        self.churn = churn
+        self.max_mem_growth = max_mem_growth
+        self.max_task_growth = max_task_growth
+        self.max_latency_ratio = max_latency_ratio
+        self.max_dropped = max_dropped
+        self.max_api_errors = max_api_errors
+        self.fail_fast = fail_fast
+        self.bus = None
+        self.mm = None
+        self.artnet = None
+        self.client = None
+        self.latencies = [] # ms, command latency of the current interval
+        self.api_latencies = []
+        self.api_errors = 0 # of the current interval
+        self._dropped_at = 0 # ArtNetStats.dropped at the previous sample
+        self.baseline = None
+        self._baseline_snapshot = None
+        self.samples = []
+        self.failures = []
+        self._tasks = []
+        self._started = None
+
+    async def setup(self):
+        tracemalloc.start()
+        self.bus = simbus.SimulatedBus(self.addrs, time_scale=self.speed)
+        mm = MotorManager(port="soak", module_range=max(self.addrs) + 1, simulator=self.bus)
+        mm.motion = MotionTracker(mm)
+        mm.events = EventBus()
+        await mm.start()
+        await mm.initialize()
+        self.mm = mm
+        self.artnet = ArtNetProtocol(mm, 0)
+        web_api.motor_manager = mm
+        web_api.motion_tracker = mm.motion
+        web_api.events = mm.events
+        web_api.artnet_protocol = self.artnet
+        web_api.rate_limiter = RateLimiter(rate=0) # the load generator is one client
+        # route exceptions are answered 500 and counted as API errors
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=web_api.app, raise_app_exceptions=False), base_url="http://soak")
+
+    async def _dmx_load(self):
+        loop = asyncio.get_running_loop()
+        period = 1 / DMX_RATE
+        hold = DMX_RATE // 4 # 4 position changes per second
+        start, k = loop.time(), 0
+        while True:
+            self.artnet.datagram_received(artdmx_packet(0, dmx_frame(self.mm.connected.addrs, k, hold), k & 0xFF), ("127.0.0.1", 6454))
+            k += 1
+            await asyncio.sleep(max(0, start + k * period - loop.time()))
+
+    async def _api_load(self):
+        routes = ("/p/getpos", "/p/gettemp", "/p/connected", "/m/gotopos", "/p/setmaxspeed")
+        n = 0
+        while True:
+            await asyncio.sleep(1 / API_RATE)
+            addr = self.addrs[n % len(self.addrs)]
+            route = routes[n % len(routes)]
+            params = {"addr": addr}
+            if route == "/m/gotopos":
+                params["pos"] = (n * 37) % 1000
+            elif route == "/p/setmaxspeed":
+                params["speed"] = 100 + n % 200
+            n += 1
+            t0 = time.perf_counter()
+            try:
+                r = await self.client.get(route, params=params)
+                if r.status_code != 200:
+                    logging.warning(f"Soak API request {route} {params} answered {r.status_code}")
+                    self.api_errors += 1
+            except Exception as e:
+                logging.warning(f"Soak API request {route} failed: {e}")
+                self.api_errors += 1
+            self.api_latencies.append((time.perf_counter() - t0) * 1000)
+
+    async def _probe(self):
+        n = 0
+        while True:
+            await asyncio.sleep(PROBE_INTERVAL)
+            addrs = self.mm.connected.addrs
+            if not addrs:
+                continue
+            t0 = time.perf_counter()
+            await self.mm.gap(addrs[n % len(addrs)], 1)
+            self.latencies.append((time.perf_counter() - t0) * 1000)
+            n += 1
+
+    async def _churn(self):
+        n = 0
+        while True:
+            await asyncio.sleep(self.churn / self.speed)
+            addr = self.addrs[n % len(self.addrs)]
+            n += 1
+            params = self.mm.connected.params(addr)
+            if params is None:
+                continue
+            self.mm.remove_motor(addr)
+            await asyncio.sleep(0.5)
+            self.mm.add_motor(addr, params)
+
+    def sample(self) -> dict:
+        mm = self.mm
+        current, peak = tracemalloc.get_traced_memory()
+        latency, api_latency = p99(self.latencies), p99(self.api_latencies)
+        sample = {
+            "t": round(time.monotonic() - self._started, 1),
+            "mem_mb": round(current / 1e6, 3),
+            "mem_peak_mb": round(peak / 1e6, 3),
+            "tasks": len(asyncio.all_tasks()),
+            "p99_ms": round(latency, 3) if latency is not None else None,
+            "api_p99_ms": round(api_latency, 3) if api_latency is not None else None,
+            "commands": len(self.latencies),
+            "api_requests": len(self.api_latencies),
+            "api_errors": self.api_errors,
+            "dmx_dropped": self.artnet.stats.dropped - self._dropped_at,
+            "command_queue": mm.command_queue.qsize(),
+            "serial_buffer": len(mm.protocol.buffer) if mm.protocol else None,
+            "inflight_reads": len(mm._inflight_reads),
+            "recent_reads": sum(len(r) for r in mm._recent_reads.values()),
+            "motor_tasks": len(mm._motor_tasks),
+            "motors": len(mm.connected),
+            "bus_frames": self.bus.frames,
+        }
+        self.latencies, self.api_latencies = [], []
+        self.api_errors, self._dropped_at = 0, self.artnet.stats.dropped
+        return sample
+
+    def check(self, sample) -> list:
+        base = self.baseline
+        failures = []
+        growth = sample["mem_mb"] - base["mem_mb"]
+        if growth > self.max_mem_growth:
+            failures.append(f"memory grew {growth:.2f} MB since the baseline (max {self.max_mem_growth})")
+        if sample["tasks"] - base["tasks"] > self.max_task_growth:
+            failures.append(f"{sample['tasks']} tasks, {base['tasks']} at the baseline (max growth {self.max_task_growth})")
+        if sample["p99_ms"] is not None and base["p99_ms"] is not None:
+            limit = max(base["p99_ms"] * self.max_latency_ratio, base["p99_ms"] + LATENCY_FLOOR_MS)
+            if sample["p99_ms"] > limit:
+                failures.append(f"p99 command latency {sample['p99_ms']:.2f} ms, {base['p99_ms']:.2f} ms at the baseline (limit {limit:.2f})")
+        if sample["dmx_dropped"] > self.max_dropped:
+            failures.append(f"{sample['dmx_dropped']} DMX commands dropped (max {self.max_dropped})")
+        if sample["api_errors"] > self.max_api_errors:
+            failures.append(f"{sample['api_errors']} API errors (max {self.max_api_errors})")
+        return failures
+
+    def top_growth(self, limit=10) -> list:
+        if self._baseline_snapshot is None:
+            return []
+        ignore = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"))
+        snapshot = tracemalloc.take_snapshot().filter_traces(ignore)
+        return [str(stat) for stat in snapshot.compare_to(self._baseline_snapshot, "lineno")[:limit]]
+
+    async def run(self, duration: float) -> dict:
+        await self.setup()
+        self._started = time.monotonic()
+        self._tasks = [asyncio.create_task(self._dmx_load()), asyncio.create_task(self._api_load()), asyncio.create_task(self._probe())]
+        if self.churn > 0:
+            self._tasks.append(asyncio.create_task(self._churn()))
+        logging.info(f"Soak test of {len(self.addrs)} simulated motors for {duration:.0f}s at speed {self.speed:g}")
+        try:
+            await asyncio.sleep(min(self.warmup, duration))
+            self.baseline = self.sample()
+            self._baseline_snapshot = tracemalloc.take_snapshot()
+            print(json.dumps({"baseline": self.baseline}), flush=True)
+            end = self._started + duration
+            while time.monotonic() < end:
+                await asyncio.sleep(min(self.interval, end - time.monotonic()))
+                sample = self.sample()
+                failures = self.check(sample)
+                sample["failures"] = failures
+                self.samples.append(sample)
+                print(json.dumps(sample), flush=True)
+                self.failures.extend(f"t={sample['t']}s: {f}" for f in failures)
+                if failures and self.fail_fast:
+                    break
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await self.client.aclose()
+        return {
+            "passed": not self.failures,
+            "failures": self.failures,
+            "baseline": self.baseline,
+            "last": self.samples[-1] if self.samples else None,
+            "top_growth": self.top_growth(),
+            "coalesced_reads": self.mm.coalesced_reads,
+        }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser("soak.py", description="Long running soak test of Kinelink against a simulated TMCL bus")
+    parser.add_argument("-H", "--hours", type=float, default=1.0, help="Duration of the test in hours (real time)")
+    parser.add_argument("-m", "--motors", type=str, default="1,6,11,16,21,26,31,36,41,46", help="Simulated module addresses, ie 10-29 or 10,12,15. Each motor uses 5 DMX channels from its address, keep them 5 apart")
+    parser.add_argument("-x", "--speed", type=float, default=1.0, help="Time acceleration of the simulated motors and of the churn")
+    parser.add_argument("-i", "--interval", type=float, default=60.0, help="Seconds between samples")
+    parser.add_argument("-w", "--warmup", type=float, default=120.0, help="Seconds before the baseline sample")
+    parser.add_argument("-c", "--churn", type=float, default=60.0, help="Remove and add back a motor every N simulated seconds, 0 disables")
+    parser.add_argument("-mm", "--max_mem_growth", type=float, default=5.0, help="Max traced memory growth since the baseline, MB")
+    parser.add_argument("-mt", "--max_task_growth", type=int, default=5, help="Max task count growth since the baseline")
+    parser.add_argument("-ml", "--max_latency_ratio", type=float, default=2.0, help="Max p99 command latency, as a multiple of the baseline")
+    parser.add_argument("-md", "--max_dropped", type=int, default=0, help="Max DMX commands dropped per interval (motor queue full)")
+    parser.add_argument("-me", "--max_api_errors", type=int, default=0, help="Max API errors (non-200 answers) per interval")
+    parser.add_argument("-ff", "--fail_fast", action="store_true", default=False, help="Stop at the first failed sample")
+    parser.add_argument("-r", "--report", type=str, default=None, help="Write the final report to this JSON file")
+    parser.add_argument("-v", "--verbose", action="store_true", default=False, help="Log Kinelink at info level")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    soak = Soak(
+        simbus.parse_spec(args.motors),
+        speed=args.speed,
+        interval=args.interval,
+        warmup=args.warmup,
+        churn=args.churn,
+        max_mem_growth=args.max_mem_growth,
+        max_task_growth=args.max_task_growth,
+        max_latency_ratio=args.max_latency_ratio,
+        max_dropped=args.max_dropped,
+        max_api_errors=args.max_api_errors,
+        fail_fast=args.fail_fast,
+    )
+    report = asyncio.run(soak.run(args.hours * 3600))
+    print(json.dumps({"report": report}, indent=2), flush=True)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if report["passed"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,121 +1,224 @@
 import asyncio
 import logging
+import os
+import time
 from datetime import datetime
-from typing import Dict, Any
-#import telegram
-from TMCL import MotorManager  # Assuming this is your motor manager module
-motor_manager: MotorManager | None = None
-class TelegramNotifier:
-    def __init__(self, bot_token: str, chat_id: str, motor_manager: MotorManager):
+from events import TemperatureUpdated, MotorLost, MotorFound, CommError
+
+"""
+
+Notifier
+Written for STRUCTURALS, 2025
+
+Watches the rig through the event bus (events.EventBus) and the telemetry cache of
+MotorManager, never through the serial bus: it only sees what other parts of Kinelink
+read anyway (UI polling of /p/gettemp and /p/getpos, motion tracking, topology checks).
+
+Rules:
+    - temperature at or above temp_max (cleared 5 below it)
+    - motor lost (removed from the bus by a topology check), cleared when it comes back
+    - communication errors: error rate over the last minute above error_rate, or
+      10 transactions in a row without reply
+
+Alerts are batched: the first one waits batch_delay seconds for others, then all of
+them are sent as one message. A summary of every motor is sent every `interval`
+seconds while notifications are enabled.
+
+Messages go through a sender: TelegramSender (Bot API over HTTPS), LogSender (log
+only) or MemorySender (keeps them, for tests). notifier_from_env() builds the
+notifier from environment variables:
+    KINELINK_TELEGRAM_TOKEN, KINELINK_TELEGRAM_CHAT   Telegram sender, log only without them
+    KINELINK_NOTIFY_TEMP_MAX       default 70
+    KINELINK_NOTIFY_ERROR_RATE     default 0.2 (20% of the transactions of a motor)
+    KINELINK_NOTIFY_BATCH          seconds, default 10
+    KINELINK_NOTIFY_INTERVAL       summary period in seconds, default 300
+
+"""
+
+TEMP_HYSTERESIS = 5
+ERROR_WINDOW = 60.0 # seconds
+ERROR_MIN_TX = 20 # transactions in the window before the error rate is trusted
+UNRESPONSIVE_AFTER = 10 # transactions in a row without reply
+
+class LogSender:
+    async def send(self, text: str):
+        logging.warning(f"Notification:\n{text}")
+
+class MemorySender:
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, text: str):
+        self.messages.append(text)
+
+class TelegramSender:
+    def __init__(self, bot_token: str, chat_id: str, timeout: float = 10.0):
         self.bot_token = bot_token
         self.chat_id = chat_id
+        self.timeout = timeout
+        self._client = None
+
+    async def send(self, text: str):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        try:
+            r = await self._client.post(f"https://api.telegram.org/bot{self.bot_token}/sendMessage", data={"chat_id": self.chat_id, "text": text})
+            if r.status_code != 200:
+                logging.error(f"Telegram notification refused: {r.status_code} {r.text[:200]}")
+        except Exception as e:
+            logging.error(f"Failed to send telegram notification: {e}")
+
+class Notifier:
+    def __init__(self, events, motor_manager, sender=None, temp_max: float = 70, error_rate: float = 0.2, batch_delay: float = 10.0, interval: float = 300.0):
+        self.events = events
         self.motor_manager = motor_manager
-        self.bot = telegram.Bot(token=bot_token)
+        self.sender = sender or LogSender()
+        self.temp_max = temp_max
+        self.error_rate = error_rate
+        self.batch_delay = batch_delay
+        self.interval = interval
         self.is_running = False
-        self.interval = 300  # Default 5 minutes in seconds
-        self.task = None
-        
-        # Setup logging
-        self.logger = logging.getLogger(__name__)
-    
-    def set_interval(self, seconds: int):
-        """Set the interval for notifications"""
+        self.active = {} # (rule, addr) -> alert message, raised and not cleared yet
+        self.pending = [] # messages waiting for the next batch
+        self._windows = {} # addr -> (start time, tx, errors) of the error rate window
+        self._queue = None
+        self._tasks = []
+        self._flush_handle = None
+
+    def set_interval(self, seconds: float):
+        """Set the interval of the summary notifications"""
         self.interval = seconds
-        self.logger.info(f"Notification interval set to {seconds} seconds")
-    
+        logging.info(f"Notification interval set to {seconds} seconds")
+
     def enable_notifications(self):
-        """Enable telegram notifications"""
-        if not self.is_running:
-            self.is_running = True
-            self.logger.info("Telegram notifications enabled")
-            # Start the notification loop
-            asyncio.create_task(self._notification_loop())
-    
+        if self.is_running:
+            return
+        self.is_running = True
+        self._queue = self.events.subscribe(types=(TemperatureUpdated, MotorLost, MotorFound, CommError))
+        self._tasks = [asyncio.create_task(self._event_loop()), asyncio.create_task(self._summary_loop())]
+        logging.info(f"Notifications enabled ({type(self.sender).__name__})")
+
     def disable_notifications(self):
-        """Disable telegram notifications"""
         self.is_running = False
-        if self.task:
-            self.task.cancel()
-        self.logger.info("Telegram notifications disabled")
-    
-    async def _notification_loop(self):
-        """Main loop for sending notifications"""
-        while self.is_running:
+        if self._queue is not None:
+            self.events.unsubscribe(self._queue)
+            self._queue = None
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        logging.info("Notifications disabled")
+
+    async def _event_loop(self):
+        while True:
+            event = await self._queue.get()
             try:
-                # Execute motor scan
-                scan_result = self.motor_manager.scan()
-                
-                # Process and send notification
-                await self._process_and_send_notification(scan_result)
-                
-                # Wait for next interval
-                await asyncio.sleep(self.interval)
-                
+                self.evaluate(event)
             except Exception as e:
-                self.logger.error(f"Error in notification loop: {e}")
-                # Continue running even if one iteration fails
-                await asyncio.sleep(self.interval)
-    
-    async def _process_and_send_notification(self, scan_result: Dict[str, Any]):
-        """Process scan result and send telegram notification"""
-        try:
-            if not scan_result:
-                message = "No devices found during scan"
+                logging.error(f"Notification rule failed on {event}: {e}")
+
+    async def _summary_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self._check_error_rates()
+            await self.sender.send(self.summary())
+
+    # rules
+    def evaluate(self, event):
+        addr = event.addr
+        if isinstance(event, TemperatureUpdated):
+            if event.temp >= self.temp_max:
+                self._raise(("temp", addr), f"Motor {addr} temperature {event.temp} (max {self.temp_max})")
+            elif event.temp < self.temp_max - TEMP_HYSTERESIS:
+                self._clear(("temp", addr), f"Motor {addr} temperature back to {event.temp}")
+        elif isinstance(event, MotorLost):
+            self.active.pop(("comm", addr), None) # superseded
+            self._raise(("lost", addr), f"Motor {addr} lost: not answering on the bus anymore")
+        elif isinstance(event, MotorFound):
+            self._clear(("lost", addr), f"Motor {addr} is back on the bus")
+            self._clear(("comm", addr), f"Motor {addr} is back on the bus")
+        elif isinstance(event, CommError):
+            if event.consecutive >= UNRESPONSIVE_AFTER:
+                self._raise(("comm", addr), f"Motor {addr} unresponsive: {event.consecutive} commands in a row without reply")
             else:
-                message = self._format_scan_result(scan_result)
-            
-            # Send notification
-            await self.bot.send_message(
-                chat_id=self.chat_id,
-                text=message,
-                parse_mode='HTML'
-            )
-            
-            self.logger.info("Telegram notification sent successfully")
-            
-        except Exception as e:
-            self.logger.error(f"Failed to send telegram notification: {e}")
-    
-    def _format_scan_result(self, scan_result: Dict[str, Any]) -> str:
-        """Format the scan result into a readable message"""
-        if not scan_result:
-            return "No devices found during scan"
-        
-        message = f"Scan Results ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')}):\n\n"
-        
-        for addr, data in scan_result.items():
-            message += f"Device: {addr}\n"
-            if 'temp' in data:
-                message += f"  Temperature: {data['temp']}°C\n"
-            if 'humidity' in data:
-                message += f"  Humidity: {data['humidity']}%\n"
-            if 'status' in data:
-                message += f"  Status: {data['status']}\n"
-            message += "\n"
-        
-        return message
-    
-    async def send_manual_notification(self, message: str):
-        """Send a manual notification (useful for testing)"""
-        try:
-            await self.bot.send_message(
-                chat_id=self.chat_id,
-                text=message,
-                parse_mode='HTML'
-            )
-            self.logger.info("Manual notification sent")
-        except Exception as e:
-            self.logger.error(f"Failed to send manual notification: {e}")
+                self._check_error_rate(addr)
+
+    def _check_error_rate(self, addr):
+        t = self.motor_manager.telemetry.get(addr)
+        if t is None:
+            return
+        now = time.monotonic()
+        start, tx0, err0 = self._windows.get(addr, (now, t["tx"], t["errors"]))
+        if now - start > ERROR_WINDOW:
+            start, tx0, err0 = now, t["tx"], t["errors"]
+        self._windows[addr] = (start, tx0, err0)
+        tx, errors = t["tx"] - tx0, t["errors"] - err0
+        if tx < ERROR_MIN_TX:
+            return
+        rate = errors / tx
+        if rate >= self.error_rate:
+            self._raise(("comm", addr), f"Motor {addr} communication errors: {errors}/{tx} commands without reply")
+        elif rate < self.error_rate / 2 and t["consecutive_errors"] == 0:
+            self._clear(("comm", addr), f"Motor {addr} communication back to normal")
+
+    def _check_error_rates(self):
+        for rule, addr in list(self.active):
+            if rule == "comm":
+                self._check_error_rate(addr)
+
+    def _raise(self, key, message):
+        if key in self.active:
+            return
+        self.active[key] = message
+        self._queue_message(f"⚠ {message}")
+
+    def _clear(self, key, message):
+        if self.active.pop(key, None) is not None:
+            self._queue_message(f"✓ {message}")
 
-# Global instance
-telegram_notifier = None
+    # batching
+    def _queue_message(self, message):
+        self.pending.append(message)
+        if self._flush_handle is None and self.is_running:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.batch_delay, lambda: asyncio.create_task(self.flush()))
 
-def initialize_telegram_notifier(bot_token: str, chat_id: str, motor_manager: MotorManager):
-    """Initialize the telegram notifier instance"""
-    global telegram_notifier
-    telegram_notifier = TelegramNotifier(bot_token, chat_id, motor_manager)
-    return telegram_notifier
+    async def flush(self):
+        self._flush_handle = None
+        if not self.pending:
+            return
+        messages, self.pending = self.pending, []
+        header = f"Kinelink {self.motor_manager.port} ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')})"
+        await self.sender.send("\n".join([header] + messages))
+
+    def summary(self) -> str:
+        mm = self.motor_manager
+        lines = [f"Kinelink {mm.port} summary ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')}): {len(mm.connected)} motors"]
+        for addr in sorted(mm.connected):
+            t = mm.telemetry.get(addr, {})
+            temp = t.get("temp")
+            lines.append(f"  {addr}: pos {t.get('pos', '-')}, temp {temp if temp is not None else '-'}, errors {t.get('errors', 0)}/{t.get('tx', 0)}")
+        if self.active:
+            lines.append("Active alerts:")
+            lines.extend(f"  {m}" for m in self.active.values())
+        return "\n".join(lines)
+
+    async def send_manual_notification(self, message: str):
+        """Send a manual notification (useful for testing)"""
+        await self.sender.send(message)
 
-def get_telegram_notifier():
-    """Get the global telegram notifier instance"""
-    return telegram_notifier
+def notifier_from_env(events, motor_manager, env=os.environ) -> Notifier:
+    token, chat = env.get("KINELINK_TELEGRAM_TOKEN"), env.get("KINELINK_TELEGRAM_CHAT")
+    sender = TelegramSender(token, chat) if token and chat else LogSender()
+    return Notifier(
+        events,
+        motor_manager,
+        sender,
+        temp_max=float(env.get("KINELINK_NOTIFY_TEMP_MAX", 70)),
+        error_rate=float(env.get("KINELINK_NOTIFY_ERROR_RATE", 0.2)),
+        batch_delay=float(env.get("KINELINK_NOTIFY_BATCH", 10)),
+        interval=float(env.get("KINELINK_NOTIFY_INTERVAL", 300)),
+    )
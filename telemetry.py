@@ -0,0 +1,288 @@
+import asyncio
+import bisect
+import logging
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+
+"""
+
+Telemetry history
+Written for STRUCTURALS, 2025
+
+Position and temperature history of every motor, to diagnose thermal drift and
+missed positions after the fact. Fed from the telemetry cache of the MotorManager
+(MotorManager.telemetry, filled by the reads other parts already do): recording
+the history never adds a transaction to the bus.
+
+Every metric of every motor has one ring file per resolution, in state/telemetry:
+
+    <addr>_<metric>_raw.ring    every value read on the bus
+    <addr>_<metric>_1s.ring     mean/min/max per second
+    <addr>_<metric>_1m.ring     mean/min/max per minute
+
+A ring file is a fixed size header + `capacity` records (time f64, mean/min/max f32),
+memory-mapped, oldest records overwritten. Records are kept in time order, values
+stamped before the newest record (wall clock stepped back) are dropped. With the default capacities a motor takes
+~630 KB for both metrics, whatever the uptime.
+
+New records are kept in memory and copied into the files every `flush_interval`
+seconds, then synced, in one go: the SD card sees one batch of page writes per
+flush instead of one per sample. Records not flushed yet are served by queries too,
+a power cut loses at most `flush_interval` seconds of history.
+
+"""
+
+BASE_DIR = Path(__file__).resolve().parent
+HISTORY_DIR = BASE_DIR / "state" / "telemetry"
+METRICS = ("pos", "temp")
+RESOLUTIONS = {"raw": 0, "1s": 1, "1m": 60} # bucket width in seconds, 0: no downsampling
+CAPACITIES = {"raw": 2048, "1s": 3600, "1m": 10080} # records per file: ~2048 reads, 1 hour, 1 week
+
+HEADER = struct.Struct("<4sHxxIII") # magic, version, capacity, head (next write slot), count
+RECORD = struct.Struct("<dfff") # time, mean, min, max
+MAGIC = b"KLTR"
+VERSION = 1
+
+class RingFile:
+    def __init__(self, path, capacity: int):
+        """Fixed size memory-mapped ring of records, created (or recreated when its layout changed) on open."""
+        self.path = Path(path)
+        self.capacity = capacity
+        size = HEADER.size + capacity * RECORD.size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fresh = os.fstat(fd).st_size != size
+            if fresh:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        magic, version, cap, self.head, self.count = HEADER.unpack_from(self.map)
+        if fresh or magic != MAGIC or version != VERSION or cap != capacity or self.head >= capacity or self.count > capacity:
+            self.head, self.count = 0, 0
+            self._write_header()
+
+    def _write_header(self):
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, self.capacity, self.head, self.count)
+
+    def _slot(self, i):
+        """Offset of the i-th oldest record."""
+        return HEADER.size + ((self.head - self.count + i) % self.capacity) * RECORD.size
+
+    def append_many(self, records):
+        for record in records[-self.capacity:]:
+            RECORD.pack_into(self.map, HEADER.size + self.head * RECORD.size, *record)
+            self.head = (self.head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+        self._write_header()
+
+    def _time(self, i):
+        return struct.unpack_from("<d", self.map, self._slot(i))[0]
+
+    def read(self, start=None, end=None) -> list:
+        """Records with start <= time <= end, oldest first."""
+        first = 0 if start is None else bisect.bisect_left(range(self.count), start, key=self._time)
+        last = self.count if end is None else bisect.bisect_right(range(self.count), end, key=self._time)
+        return [RECORD.unpack_from(self.map, self._slot(i)) for i in range(first, last)]
+
+    def oldest(self):
+        return self._time(0) if self.count else None
+
+    def newest(self):
+        return self._time(self.count - 1) if self.count else None
+
+    def sync(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+
+class _Bucket:
+    __slots__ = ("start", "total", "n", "low", "high")
+
+    def __init__(self, start, value):
+        self.start = start
+        self.total = value
+        self.n = 1
+        self.low = value
+        self.high = value
+
+    def add(self, value):
+        self.total += value
+        self.n += 1
+        self.low = min(self.low, value)
+        self.high = max(self.high, value)
+
+    def record(self):
+        return (self.start, self.total / self.n, self.low, self.high)
+
+class TelemetryHistory:
+    def __init__(self, motor_manager, directory=HISTORY_DIR, sample_interval: float = 0.1, flush_interval: float = 30.0, capacities=None):
+        """
+            Args:
+                motor_manager = MotorManager whose telemetry cache is recorded
+                directory = where the ring files are kept
+                sample_interval = seconds between two looks at the telemetry cache (no bus traffic)
+                flush_interval = seconds between two batched writes to the ring files
+                capacities = records per ring file, per resolution (CAPACITIES)
+        """
+        self.motor_manager = motor_manager
+        self.directory = Path(directory)
+        self.sample_interval = sample_interval
+        self.flush_interval = flush_interval
+        self.capacities = dict(CAPACITIES, **(capacities or {}))
+        self.rings = {} # (addr, metric, resolution) -> RingFile, opened on first use
+        self.pending = {} # (addr, metric, resolution) -> records not written to the ring yet
+        self.buckets = {} # (addr, metric, resolution) -> _Bucket being downsampled
+        self.seen = {} # (addr, metric) -> time of the last value recorded
+        self.newest = {} # (addr, metric) -> time of the newest record, rings are sorted by time (see _add)
+        self.out_of_order = 0 # values dropped because the wall clock went back
+        self.flushes = 0
+        self._task = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for key, bucket in self.buckets.items():
+            self.pending.setdefault(key, []).append(bucket.record()) # partial last second / minute
+        self.buckets.clear()
+        await self.flush()
+        for ring in self.rings.values():
+            ring.close()
+        self.rings.clear()
+
+    def _ring(self, key):
+        ring = self.rings.get(key)
+        if ring is None:
+            addr, metric, resolution = key
+            ring = self.rings[key] = RingFile(self.directory / f"{addr}_{metric}_{resolution}.ring", self.capacities[resolution])
+        return ring
+
+    def sample(self):
+        """Record the values read on the bus since the last call."""
+        for addr, t in self.motor_manager.telemetry.items():
+            for metric in METRICS:
+                at = t.get(f"{metric}_at")
+                value = t.get(metric)
+                if at is None or value is None or self.seen.get((addr, metric)) == at:
+                    continue
+                self.seen[(addr, metric)] = at
+                self._add(addr, metric, at, float(value))
+
+    def _add(self, addr, metric, at, value):
+        # stamps are wall clock times (they survive restarts), but a Pi without RTC can step its clock back at
+        # boot or NTP sync: a value older than the newest record is dropped, queries bisect on sorted rings
+        newest = self.newest.get((addr, metric))
+        if newest is None and self._exists((addr, metric, "raw")):
+            newest = self._ring((addr, metric, "raw")).newest()
+        if newest is not None and at < newest:
+            self.out_of_order += 1
+            if self.out_of_order % 1000 == 1:
+                logging.warning(f"Telemetry history: clock went back {newest - at:.1f}s, values older than the history dropped ({self.out_of_order} so far)")
+            return
+        self.newest[(addr, metric)] = at
+        self.pending.setdefault((addr, metric, "raw"), []).append((at, value, value, value))
+        for resolution, width in RESOLUTIONS.items():
+            if not width:
+                continue
+            key = (addr, metric, resolution)
+            start = at - at % width
+            bucket = self.buckets.get(key)
+            if bucket is not None and bucket.start == start:
+                bucket.add(value)
+                continue
+            if bucket is not None:
+                self.pending.setdefault(key, []).append(bucket.record())
+            self.buckets[key] = _Bucket(start, value)
+
+    async def flush(self):
+        """Write the pending records to the ring files and sync them, one batch."""
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        rings = []
+        for key, records in pending.items():
+            ring = self._ring(key)
+            ring.append_many(records)
+            rings.append(ring)
+        # the copy into the maps above is in memory, only the sync touches the SD card
+        await asyncio.get_running_loop().run_in_executor(None, lambda: [ring.sync() for ring in rings])
+        self.flushes += 1
+        logging.debug(f"Telemetry history flushed: {sum(len(r) for r in pending.values())} records in {len(rings)} files")
+
+    async def _loop(self):
+        last_flush = time.monotonic()
+        while True:
+            await asyncio.sleep(self.sample_interval)
+            try:
+                self.sample()
+                if time.monotonic() - last_flush >= self.flush_interval:
+                    last_flush = time.monotonic()
+                    await self.flush()
+            except Exception as e:
+                logging.warning(f"Telemetry history failed: {e}")
+
+    def _records(self, key, start, end):
+        records = self._ring(key).read(start, end) if key in self.rings or self._exists(key) else []
+        records += [r for r in self.pending.get(key, ()) if (start is None or r[0] >= start) and (end is None or r[0] <= end)]
+        return records
+
+    def _exists(self, key):
+        addr, metric, resolution = key
+        return (self.directory / f"{addr}_{metric}_{resolution}.ring").exists()
+
+    def _covers(self, key, start):
+        """True when the resolution still holds everything recorded since `start` (or since ever)."""
+        if not (key in self.rings or self._exists(key)):
+            return True # nothing flushed yet, the pending records are all there is
+        ring = self._ring(key)
+        if ring.count < ring.capacity:
+            return True # never wrapped
+        return start is not None and ring.oldest() <= start
+
+    def query(self, addr: int, metric: str, start: float = None, end: float = None, resolution: str = "auto", max_points: int = 1000) -> dict:
+        """
+            History of one metric of one motor, records [time, mean, min, max], oldest first.
+            resolution "auto" picks the finest resolution that still covers `start` with at
+            most max_points records, larger results are decimated to max_points.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric}, one of {', '.join(METRICS)}")
+        if resolution != "auto" and resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution {resolution}, one of auto, {', '.join(RESOLUTIONS)}")
+        if max_points < 1:
+            raise ValueError("max_points must be at least 1")
+        if resolution == "auto":
+            resolution, records = "1m", None
+            for candidate in RESOLUTIONS:
+                key = (addr, metric, candidate)
+                found = self._records(key, start, end)
+                if self._covers(key, start) and len(found) <= max_points:
+                    resolution, records = candidate, found
+                    break
+            if records is None:
+                records = self._records((addr, metric, "1m"), start, end)
+        else:
+            records = self._records((addr, metric, resolution), start, end)
+        total = len(records)
+        if total > max_points:
+            step = total / max_points
+            records = [records[int(i * step)] for i in range(max_points)]
+        return {
+            "addr": addr,
+            "metric": metric,
+            "resolution": resolution,
+            "total": total,
+            "records": [[round(t, 3), round(mean, 3), low, high] for t, mean, low, high in records],
+        }
@@ -0,0 +1,199 @@
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+
+"""
+
+Module-resident TMCL programs
+Written for STRUCTURALS, 2025
+
+Compiles a short motion sequence into a TMCL standalone program, downloads it to the
+program EEPROM of a module and starts/stops it. A repetitive kinetic loop then runs on
+the module itself, without any traffic on the serial bus, leaving the bandwidth to
+live DMX control.
+
+Sequences are stored in configs/programs/<name>.json:
+
+    {
+        "loop": true,
+        "steps": [
+            {"speed": 300, "accel": 100},
+            {"move": 2000},
+            {"wait": 1.5},
+            {"repeat": 3, "steps": [{"rel": 500}, {"rel": -500}]},
+            {"home": true},
+            {"move": 0, "wait_pos": false}
+        ]
+    }
+
+Steps:
+    speed, accel    SAP 4 / SAP 5 (can share a step with a move)
+    move            MVP ABS, then WAIT POS until the target is reached (unless wait_pos is false)
+    rel             MVP REL, same
+    wait            WAIT TICKS, seconds (10 ms resolution)
+    home            RFS START, then WAIT RFS
+    repeat          the inner steps N times (unrolled, TMCM-1161 has no loop counter instruction)
+
+The program ends with STOP, or jumps back to its first instruction (JA 0) with loop.
+Downloading: 132 (enter download mode at address 0), one frame per instruction, each
+answered with status 101 (stored, not executed), 133 (exit download mode). Programs
+are started with 129 (run from address 0), stopped with 128, polled with 135.
+The frames go out in chunks of DOWNLOAD_CHUNK under the send lock, commands to other
+modules (panic, DMX) are sent in between. Commands to the module being downloaded are
+refused meanwhile (MotorManager.downloading), they would be stored in its program. The
+download stops at the first frame without reply, and on a panic, and always ends
+with 133.
+
+While a program runs, DMX or API commands to the same module fight with it: unpatch
+the motor or switch Art-Net off (/p/set_artnet).
+
+"""
+
+BASE_DIR = Path(__file__).resolve().parent
+PROGRAM_DIR = BASE_DIR / "configs" / "programs"
+PROGRAM_SIZE_MAX = 2048 # instructions, TMCM-1161 program EEPROM
+TICK = 0.01 # seconds per WAIT TICKS tick
+DOWNLOAD_CHUNK = 16 # frames per hold of the send lock, a panic waits for at most one chunk
+
+# TMCL opcodes used by programs
+MVP, SAP, RFS, JA, WAIT, STOP = 4, 5, 13, 22, 27, 28
+RUN_APPLICATION, STOP_APPLICATION, ENTER_DOWNLOAD, EXIT_DOWNLOAD, APPLICATION_STATUS = 129, 128, 132, 133, 135
+
+NAMES = {MVP: "MVP", SAP: "SAP", RFS: "RFS", JA: "JA", WAIT: "WAIT", STOP: "STOP"}
+
+def _steps(steps, out, depth=0):
+    if depth > 8:
+        raise ValueError("repeat nested too deep")
+    for step in steps:
+        if not isinstance(step, dict):
+            raise ValueError(f"Invalid step {step!r}")
+        unknown = set(step) - {"speed", "accel", "move", "rel", "wait", "wait_pos", "home", "repeat", "steps"}
+        if unknown:
+            raise ValueError(f"Unknown step keys {sorted(unknown)}")
+        if "repeat" in step:
+            count = int(step["repeat"])
+            if count < 0 or not isinstance(step.get("steps"), list):
+                raise ValueError("repeat needs a count >= 0 and a list of steps")
+            for _ in range(count):
+                _steps(step["steps"], out, depth + 1)
+            continue
+        if "speed" in step:
+            out.append((SAP, 4, 0, int(step["speed"])))
+        if "accel" in step:
+            out.append((SAP, 5, 0, int(step["accel"])))
+        if "move" in step or "rel" in step:
+            out.append((MVP, 0, 0, int(step["move"])) if "move" in step else (MVP, 1, 0, int(step["rel"])))
+            if step.get("wait_pos", True):
+                out.append((WAIT, 1, 0, 0))
+        if step.get("home"):
+            out.extend([(RFS, 0, 0, 0), (WAIT, 4, 0, 0)])
+        if "wait" in step:
+            ticks = round(float(step["wait"]) / TICK)
+            if ticks < 0:
+                raise ValueError(f"Negative wait {step['wait']}")
+            out.append((WAIT, 0, 0, ticks))
+        if len(out) > PROGRAM_SIZE_MAX:
+            raise ValueError(f"Program longer than {PROGRAM_SIZE_MAX} instructions")
+
+def compile_sequence(sequence: dict) -> list:
+    """Compile a sequence into TMCL instructions [(cmd, type, motor, value), ...]."""
+    steps = sequence.get("steps")
+    if not isinstance(steps, list) or not steps:
+        raise ValueError("A sequence needs a list of steps")
+    out = []
+    _steps(steps, out)
+    if sequence.get("loop"):
+        if not any(cmd == WAIT for cmd, *_ in out):
+            raise ValueError("A looping program needs at least one wait or move, it would spin the module")
+        out.append((JA, 0, 0, 0))
+    else:
+        out.append((STOP, 0, 0, 0))
+    if len(out) > PROGRAM_SIZE_MAX:
+        raise ValueError(f"Program longer than {PROGRAM_SIZE_MAX} instructions")
+    return out
+
+def listing(program) -> list:
+    """Human readable program, one "address: instruction" line per instruction."""
+    return [f"{i}: {NAMES.get(cmd, cmd)} {typ}, {motor}, {value}" for i, (cmd, typ, motor, value) in enumerate(program)]
+
+class ProgramManager:
+    def __init__(self, motor_manager, program_dir=PROGRAM_DIR):
+        self.motor_manager = motor_manager
+        self.program_dir = Path(program_dir)
+        self.downloaded = {} # addr -> name of the sequence downloaded by this run
+
+    def _read(self, name):
+        with open(self.program_dir / f"{name}.json", "r") as f:
+            return json.load(f)
+
+    def _list(self):
+        if not os.path.isdir(self.program_dir):
+            return []
+        return sorted(f[:-len(".json")] for f in os.listdir(self.program_dir) if f.endswith(".json") and not f.startswith("."))
+
+    async def list(self):
+        return await asyncio.get_running_loop().run_in_executor(None, self._list)
+
+    async def compile(self, name: str) -> list:
+        if not name or "/" in name or name.startswith("."):
+            raise ValueError(f"Invalid program name {name!r}")
+        return compile_sequence(await asyncio.get_running_loop().run_in_executor(None, self._read, name))
+
+    async def download(self, addr: int, name: str) -> dict:
+        """Compile a sequence and store it in the program EEPROM of a module (the program running there is stopped)."""
+        mm = self.motor_manager
+        if mm.broker:
+            # the broker interleaves the frames of its clients with other traffic, the module would store that too
+            raise RuntimeError("Program download is not possible through a bus broker, run it on the Kinelink owning the serial port")
+        program = await self.compile(name)
+        # stopping the program first doubles as a probe: a module gone from the bus costs one timeout
+        probe = await mm.transact_many([mm.tmcl_packet_builder(addr, STOP_APPLICATION, 0, 0, 0)])
+        if probe[0] is None or mm.protocol is None:
+            raise RuntimeError(f"Motor {addr} does not answer")
+        frames = [mm.tmcl_packet_builder(addr, ENTER_DOWNLOAD, 0, 0, 0)]
+        frames += [mm.tmcl_packet_builder(addr, cmd, typ, motor, value) for cmd, typ, motor, value in program]
+        # sent DOWNLOAD_CHUNK frames per hold of the send lock: queued commands to the other modules (panic, DMX)
+        # get through in between, the ones to this module are refused while it is in download mode
+        panics = mm.panics
+        stored, error = 0, None
+        mm.downloading.add(addr)
+        try:
+            for i in range(0, len(frames), DOWNLOAD_CHUNK):
+                if mm.panics != panics:
+                    error = "aborted by a panic"
+                    break
+                if mm.protocol is None:
+                    error = "serial link lost"
+                    break
+                replies = await mm.protocol.transact_many(frames[i:i + DOWNLOAD_CHUNK], stop_on_missing=True)
+                acknowledged = next((j for j, reply in enumerate(replies) if reply is None), len(replies))
+                stored += acknowledged
+                if acknowledged < len(replies):
+                    error = f"frame {i + acknowledged} not acknowledged"
+                    break
+        finally:
+            # always leave download mode, even after a failure (a module stuck in it ignores every command)
+            exit_reply = await mm.protocol.transact_many([mm.tmcl_packet_builder(addr, EXIT_DOWNLOAD, 0, 0, 0)]) if mm.protocol else [None]
+            mm.downloading.discard(addr)
+        if error is None and exit_reply[0] is None:
+            error = "exit download mode not acknowledged"
+        if error is not None:
+            self.downloaded.pop(addr, None)
+            raise RuntimeError(f"Download to motor {addr} failed, {error} ({max(stored - 1, 0)} of {len(program)} instructions stored)")
+        self.downloaded[addr] = name
+        logging.info(f"Program {name} downloaded to motor {addr}: {len(program)} instructions")
+        return {"addr": addr, "name": name, "instructions": len(program)}
+
+    async def start(self, addr: int):
+        self.motor_manager._remember(addr, target=None) # do not replay a host target over the program after a reconnect
+        return await self.motor_manager.tmcl_command_builder(addr=addr, cmd=RUN_APPLICATION, param=1, bank=0, value=0, name="RUN")
+
+    async def stop(self, addr: int):
+        return await self.motor_manager.tmcl_command_builder(addr=addr, cmd=STOP_APPLICATION, param=0, bank=0, value=0, name="STOP_APP")
+
+    async def status(self, addr: int) -> dict:
+        reply = await self.motor_manager.tmcl_command_builder(addr=addr, cmd=APPLICATION_STATUS, param=0, bank=0, value=0, name="APP_STATUS")
+        running = None if reply is None else bool(reply[4] & 0xFF)
+        return {"addr": addr, "running": running, "program": self.downloaded.get(addr)}
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from configstore import write_json_atomic, fsync_dir
+
+"""
+
+Runtime snapshot for warm starts
+Written for STRUCTURALS, 2025
+
+Kinelink periodically persists a compact snapshot of its runtime state
+(bus topology, per-motor params, last commanded positions, Art-Net universe).
+On boot the snapshot is restored right away, so Art-Net and the API are up in a
+couple of seconds, and the topology is validated against the bus in background
+(see MotorManager.restore and MotorManager.validate_topology).
+
+"""
+
+BASE_DIR = Path(__file__).resolve().parent
+STATE_DIR = BASE_DIR / "state"
+SNAPSHOT_PATH = STATE_DIR / "runtime_snapshot.json"
+SNAPSHOT_VERSION = 1
+
+def build_snapshot(motor_manager, artnet_protocol=None) -> dict:
+    targets = {}
+    for addr, state in motor_manager.last_commanded.items():
+        if addr in motor_manager.connected and state.get("target") is not None:
+            targets[str(addr)] = state["target"]
+    return {
+        "version": SNAPSHOT_VERSION,
+        "port": motor_manager.port,
+        "universe": artnet_protocol.universe if artnet_protocol is not None else None,
+        "motors": {str(addr): params for addr, params in motor_manager.connected.as_dict().items()},
+        "targets": targets,
+    }
+
+def load_snapshot(path=SNAPSHOT_PATH, port=None):
+    """
+        Read the runtime snapshot written by a previous run.
+        Returns None if there is none, if it is unreadable, or if it was taken on another serial port.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            snapshot = json.load(f)
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable runtime snapshot {path}: {e}")
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        logging.warning(f"Ignoring runtime snapshot {path} with unknown format")
+        return None
+    if port is not None and snapshot.get("port") != port:
+        logging.info(f"Runtime snapshot was taken on {snapshot.get('port')}, not {port}; ignoring it")
+        return None
+    return snapshot
+
+class SnapshotWriter:
+    def __init__(self, motor_manager, artnet_protocol=None, path=SNAPSHOT_PATH, interval: float = 10.0):
+        """Persist the runtime snapshot every `interval` seconds, only when it changed."""
+        self.motor_manager = motor_manager
+        self.artnet_protocol = artnet_protocol
+        self.path = Path(path)
+        self.interval = interval
+        self.task = None
+        self._last = None
+
+    def start(self):
+        os.makedirs(self.path.parent, exist_ok=True)
+        if self.task is None:
+            self.task = asyncio.create_task(self._loop())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def _write(self, snapshot):
+        snapshot = dict(snapshot, saved_at=time.time())
+        write_json_atomic(self.path, snapshot, indent=None)
+        fsync_dir(self.path.parent)
+
+    async def save_now(self):
+        snapshot = build_snapshot(self.motor_manager, self.artnet_protocol)
+        if snapshot == self._last:
+            return False
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write, snapshot)
+        self._last = snapshot
+        logging.debug(f"Runtime snapshot saved to {self.path}")
+        return True
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.save_now()
+            except Exception as e:
+                logging.warning(f"Failed to save runtime snapshot: {e}")
@@ -1,30 +1,102 @@
-from fastapi import FastAPI, Query, Request
+from fastapi import FastAPI, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, Response
 from TMCL import MotorManager
 from artnet import ArtNetProtocol
+from configstore import ConfigRepository
+from fleet import FleetRegistry, FleetClient
+from motion import MotionTracker
+from sequencer import Sequencer
+from homing import Homing
+from tmclprog import ProgramManager, listing
+from osc import OscProtocol
+from telemetry import TelemetryHistory
+from broker import BrokerServer
+from ratelimit import RateLimiter
+import paramsnapshot
+import diagnostics
 from pathlib import Path
 import logging
-import os, json
-#from telegramnotif import initialize_telegram_notifier, get_telegram_notifier
+import os, json, time
+try:
+    import orjson
+except ImportError: # orjson is optional, fall back to the stdlib json encoder
+    orjson = None
+from telegramnotif import Notifier
+from events import EventBus
+
+class FastJSONResponse(JSONResponse):
+    """Default response class: orjson encoding (several times faster than the stdlib json on the Pi)"""
+    def render(self, content) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
 
 BASE_DIR = Path(__file__).resolve().parent
 CONFIG_DIR = BASE_DIR / "configs"
 os.makedirs(CONFIG_DIR, exist_ok=True)
+config_repo = ConfigRepository(CONFIG_DIR)
+fleet_registry = FleetRegistry()
+fleet_client = FleetClient(fleet_registry)
 app = FastAPI(
     title="Kinelink",
     description="Kinelink API",
-    version=1
+    version=1,
+    default_response_class=FastJSONResponse
 )
+app.add_middleware(GZipMiddleware, minimum_size=1024) # large lists (connected, snapshots) to many clients
 
 motor_manager: MotorManager | None = None
 artnet_protocol: ArtNetProtocol | None = None
+dmx_inputs: list[ArtNetProtocol] = [] # every DMX input (Art-Net, sACN), artnet_protocol is the first one
+motion_tracker: MotionTracker | None = None
+sequencer: Sequencer | None = None
+homing: Homing | None = None
+programs: ProgramManager | None = None
+osc_protocol: OscProtocol | None = None # started with -osc
+history: TelemetryHistory | None = None # not kept for simulated buses and broker clients
+broker_server: BrokerServer | None = None # started with -bs
+notifier: Notifier | None = None # configured from the environment, see telegramnotif.py
+events: EventBus | None = None
+loop_monitor: diagnostics.LoopMonitor | None = None # started by kinelink.py
+profiler = diagnostics.Profiler()
+slow_callbacks = diagnostics.SlowCallbackLog()
+rate_limiter = RateLimiter(rate=0) # replaced by kinelink.py from the -rl flag, off by default
+TRUSTED_PROXIES = ("127.0.0.1", "::1") # Apache proxies the API from localhost, X-Forwarded-For is only believed from there
+RATE_LIMITED_PREFIXES = ("/m/", "/p/") # routes ending on the serial bus
+RATE_LIMIT_EXEMPT = ("/p/panic",) # never delay an emergency stop
+BOOT_ID = format(int(time.time()), "x") # ETags of a previous run never match
+_response_cache = {} # key -> (version, serialized body)
 top_speed=1000 ### TMCL motors allows speed from 1 to 2047, for safety reason it can be limited here to avoid crazy behaviour due to internet loss or bugs
 top_accel=1000 ### Same as top speed, top accel in TMCL is in the range of 1 to 2047, but limited here for safety reasons
 
-""" telegram_notifier = initialize_telegram_notifier(
-    bot_token="8510225780:AAEb1whfYLUgXxCHVPPF5fnUgdzmcdsmZsE",  # Replace with actual token
-    chat_id="-5097806322",       # Replace with actual chat ID
-    motor_manager=motor_manager
-) """
+
+def _client_address(request: Request) -> str:
+    """Address of the client for rate limiting: the one added by the proxy when the request comes through it."""
+    host = request.client.host if request.client else "unknown"
+    if host in TRUSTED_PROXIES:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[-1].strip() or host # rightmost entry, the one the proxy appended
+    return host
+
+def _dmx_inputs():
+    return dmx_inputs or [artnet_protocol]
+
+@app.middleware("http")
+async def rate_limit(request: Request, call_next):
+    path = request.url.path
+    if path.startswith(RATE_LIMITED_PREFIXES) and path not in RATE_LIMIT_EXEMPT:
+        client = _client_address(request)
+        wait = rate_limiter.acquire(client)
+        if wait > 0:
+            logging.debug(f"Rate limited {client} on {path}")
+            return JSONResponse(
+                status_code=429,
+                headers={"Retry-After": str(max(1, round(wait)))},
+                content={"call from":"rate_limit","reply":None, "api error":f"Too many requests, retry in {wait:.2f}s"}
+            )
+    return await call_next(request)
 
 @app.on_event("startup") ######### on_event deprecated, change for lifespan if possible (check)
 async def startup_event():
@@ -83,10 +155,12 @@ async def m_setref(
     reply = await motor_manager.sap(addr,1,0)
     return {"call from":"m_setref","reply":reply, "api error":e}
 
-@app.get("/m/gotopos", description="Go to a relative position")
+@app.get("/m/gotopos", description="Go to a relative position. With wait=true the call returns when the move is over")
 async def m_gotopos(
     addr: int = Query(..., description="Module (motor) Address 0-255"),
-    pos: int = Query(..., description="position to go -100000 - 100000")
+    pos: int = Query(..., description="position to go -100000 - 100000"),
+    wait: bool = Query(False, description="Wait for the end of the move before replying"),
+    timeout: float = Query(30.0, description="Max seconds to wait when wait=true")
     ):
     e:str|None=None
     if not (-100000<=pos<=100000):
@@ -96,8 +170,159 @@ async def m_gotopos(
         addr=0
         e=(e or "")+f"Wrong input address. address set to {addr}. "
     reply = await motor_manager.mvp(addr, 0, 0, pos)
+    if wait and reply is not None and motion_tracker is not None:
+        return {"call from":"m_gotopos","reply":reply, "motion":await motion_tracker.wait(addr, timeout), "api error":e}
     return {"call from":"m_gotopos","reply":reply, "api error":e}
 
+@app.get("/m/wait", description="Long polling: return when the current move of a motor is over (or right away if it is not moving)")
+async def m_wait(
+    addr: int = Query(..., description="Module (motor) Address 0-255"),
+    timeout: float = Query(30.0, description="Max seconds to wait")
+    ):
+    reply = await motion_tracker.wait(addr, timeout)
+    return {"call from":"m_wait","reply":reply}
+
+@app.websocket("/ws/motion")
+async def ws_motion(websocket: WebSocket):
+    """Push a move_complete event every time a positioning move ends"""
+    await websocket.accept()
+    q = motion_tracker.subscribe()
+    try:
+        while True:
+            await websocket.send_json(await q.get())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        motion_tracker.unsubscribe(q)
+
+@app.websocket("/ws/events")
+async def ws_events(websocket: WebSocket):
+    """
+        Push internal events as JSON. Query parameter types = comma separated event types (every event if omitted),
+        ie /ws/events?types=position,motor_lost,motor_found. A client too slow to keep up loses its oldest events.
+    """
+    await websocket.accept()
+    types = websocket.query_params.get("types")
+    try:
+        sub = events.subscribe(types.split(",") if types else None, maxsize=256)
+    except ValueError as ex:
+        await websocket.close(code=1008, reason=str(ex))
+        return
+    try:
+        while True:
+            await websocket.send_json((await sub.get()).to_dict())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        events.unsubscribe(sub)
+
+@app.get("/p/events", description="Event bus statistics: events published, subscribers, queued and dropped events")
+async def p_events():
+    return {"call from":"p_events","reply":events.stats()}
+
+# timeline sequencer
+@app.get("/s/list", description="List the timelines stored in configs/timelines")
+async def s_list():
+    e:str|None=None
+    reply=None
+    try:
+        reply = await sequencer.list()
+    except Exception as ex:
+        e=str(ex)
+    return {"call from":"s_list","reply":reply, "api error":e}
+
+@app.get("/s/start", description="Start playing a timeline, replaces the timeline playing")
+async def s_start(
+    name: str = Query(..., description="Timeline name (configs/timelines/<name>.json)"),
+    loop: bool | None = Query(None, description="Override the loop flag of the timeline")
+    ):
+    e:str|None=None
+    try:
+        await sequencer.start(name, loop)
+    except FileNotFoundError:
+        e=f"Timeline {name} not found. "
+    except Exception as ex:
+        e=f"Timeline {name} not started: {ex}"
+    return {"call from":"s_start","reply":sequencer.status(), "api error":e}
+
+@app.get("/s/stop", description="Stop the timeline playing. Motors finish their current move")
+async def s_stop():
+    sequencer.stop()
+    return {"call from":"s_stop","reply":sequencer.status(), "api error":None}
+
+@app.get("/s/status", description="Timeline playing, iteration, and lateness histogram of the moves (deadline to reply of the module)")
+async def s_status():
+    return {"call from":"s_status","reply":sequencer.status(), "api error":None}
+
+# homing
+@app.get("/h/start", description="Start the reference search (RFS) of the given motors, or of every connected motor, all in parallel. Each motor gets position 0 when its search is over")
+async def h_start(
+    addrs: str | None = Query(None, description="Comma separated module addresses, ie 10,11,12. Every connected motor if omitted")
+    ):
+    e:str|None=None
+    try:
+        await homing.start(None if not addrs else [int(a) for a in addrs.split(",") if a.strip()])
+    except Exception as ex:
+        e=f"Homing not started: {ex}"
+    return {"call from":"h_start","reply":homing.status(), "api error":e}
+
+@app.get("/h/stop", description="Stop the reference search of every motor still searching")
+async def h_stop():
+    homing.stop()
+    return {"call from":"h_stop","reply":homing.status(), "api error":None}
+
+@app.get("/h/status", description="Homing progress: motors searching, done and failed, and the state and duration of each motor")
+async def h_status():
+    return {"call from":"h_status","reply":homing.status(), "api error":None}
+
+# module-resident TMCL programs
+@app.get("/t/list", description="List the motion sequences stored in configs/programs")
+async def t_list():
+    return {"call from":"t_list","reply":await programs.list(), "api error":None}
+
+@app.get("/t/compile", description="Compile a motion sequence and return the TMCL program listing, without downloading it")
+async def t_compile(name: str = Query(..., description="Sequence name (configs/programs/<name>.json)")):
+    try:
+        reply = listing(await programs.compile(name))
+    except FileNotFoundError:
+        return {"call from":"t_compile","reply":None, "api error":f"Sequence {name} not found. "}
+    except Exception as ex:
+        return {"call from":"t_compile","reply":None, "api error":f"Sequence {name} not compiled: {ex}"}
+    return {"call from":"t_compile","reply":reply, "api error":None}
+
+@app.get("/t/download", description="Compile a motion sequence and download it to the program EEPROM of a module. The program running on the module is stopped")
+async def t_download(
+    addr: int = Query(..., description="Module (motor) Address 0-255"),
+    name: str = Query(..., description="Sequence name (configs/programs/<name>.json)")
+    ):
+    if not (0<=addr<=255):
+        return {"call from":"t_download","reply":None, "api error":f"Wrong input address {addr}. "}
+    try:
+        reply = await programs.download(addr, name)
+    except FileNotFoundError:
+        return {"call from":"t_download","reply":None, "api error":f"Sequence {name} not found. "}
+    except Exception as ex:
+        return {"call from":"t_download","reply":None, "api error":str(ex)}
+    return {"call from":"t_download","reply":reply, "api error":None}
+
+@app.get("/t/start", description="Run the program stored on a module from its first instruction")
+async def t_start(addr: int = Query(..., description="Module (motor) Address 0-255")):
+    if not (0<=addr<=255):
+        return {"call from":"t_start","reply":None, "api error":f"Wrong input address {addr}. "}
+    return {"call from":"t_start","reply":await programs.start(addr), "api error":None}
+
+@app.get("/t/stop", description="Stop the program running on a module. The motor finishes its current move, use /m/stop to stop it")
+async def t_stop(addr: int = Query(..., description="Module (motor) Address 0-255")):
+    if not (0<=addr<=255):
+        return {"call from":"t_stop","reply":None, "api error":f"Wrong input address {addr}. "}
+    return {"call from":"t_stop","reply":await programs.stop(addr), "api error":None}
+
+@app.get("/t/status", description="Whether the program of a module is running, and the sequence downloaded to it by this run")
+async def t_status(addr: int = Query(..., description="Module (motor) Address 0-255")):
+    if not (0<=addr<=255):
+        return {"call from":"t_status","reply":None, "api error":f"Wrong input address {addr}. "}
+    return {"call from":"t_status","reply":await programs.status(addr), "api error":None}
+
 # motor parameters command
 @app.get("/p/setmaxpos", description="Set maximum position possible (limit switch) using SAP command")
 async def p_setmaxpos(
@@ -111,7 +336,12 @@ async def p_setmaxpos(
     if not (0<=addr<=255):
         addr=0
         e=(e or "")+f"Wrong input address. address set to {addr}. "
-    motor_manager.connected[addr]["maxpos"]=int(pos)
+    try:
+        motor_manager.set_motor_param(addr, "maxpos", int(pos))
+    except KeyError:
+        e=(e or "")+f"No motor {addr}, maxpos not updated. "
+    except ValueError as ex:
+        e=(e or "")+f"maxpos not updated: {ex}. "
     return {"call from":"p_setmax", "api error":e}
 
 @app.get("/p/setmaxspeed", description="Set maximum speed for motion command like /m/gotopos using SAP command. /m/left and /m/right overides this with their speed value")
@@ -127,7 +357,12 @@ async def p_setmaxpeed(
         addr=0
         e=(e or "")+f"Wrong input address. address set to {addr}. "
     reply = await motor_manager.sap(addr, 4, speed)
-    motor_manager.connected[addr]["maxspeed"]=int(speed)
+    try:
+        motor_manager.set_motor_param(addr, "maxspeed", int(speed))
+    except KeyError:
+        e=(e or "")+f"No motor {addr}, maxspeed not updated. "
+    except ValueError as ex:
+        e=(e or "")+f"maxspeed not updated: {ex}. "
     return {"call from":"p_setmaxpeed","reply":reply, "api error":e}
 
 @app.get("/p/setminspeed", description="Set minimum speed for motion command like SAP command. This only affects gotopos commands coming from Art-Net dependency on DMX Channel 1")
@@ -142,7 +377,12 @@ async def p_setminspeed(
     if not (0<=addr<=255):
         addr=0
         e=(e or "")+f"Wrong input address. address set to {addr}. "
-    motor_manager.connected[addr]["minspeed"]=int(speed)
+    try:
+        motor_manager.set_motor_param(addr, "minspeed", int(speed))
+    except KeyError:
+        e=(e or "")+f"No motor {addr}, minspeed not updated. "
+    except ValueError as ex:
+        e=(e or "")+f"minspeed not updated: {ex}. "
     return {"call from":"p_setminpeed", "api error":e}
 
 @app.get("/p/setaccel", description="Set maximum acceleration for motion command like /m/gotopos using SAP command.")
@@ -158,9 +398,35 @@ async def p_setaccel(
         addr=0
         e=(e or "")+f"Wrong input address. address set to {addr}. "
     reply = await motor_manager.sap(addr, 5, accel)
-    motor_manager.connected[addr]["accel"] = int(accel)
+    motor_manager.set_motor_param(addr, "accel", int(accel))
     return {"call from":"p_setaccel","reply":reply, "api error":e}
 
+@app.get("/p/setcurve", description="Set the Art-Net response curve of a motor, for speed (DMX CH1) or position (DMX CH4). Curves: linear, exp, scurve, custom")
+async def p_setcurve(
+    addr: int = Query(..., description="Module (motor) Address 0-255"),
+    target: str = Query(..., description="Mapping to shape: speed or pos"),
+    curve: str = Query("linear", description="Curve type: linear, exp, scurve or custom"),
+    k: float | None = Query(None, description="Curve shape factor for exp (>0 finer low values) and scurve (steepness)"),
+    points: str | None = Query(None, description="Custom curve points as x:y pairs between 0 and 1, ie 0:0,0.5:0.2,1:1")
+    ):
+    e:str|None=None
+    if not (0<=addr<=255):
+        addr=0
+        e=(e or "")+f"Wrong input address. address set to {addr}. "
+    if target not in ("speed", "pos"):
+        e=(e or "")+f"Wrong curve target {target}, expected speed or pos. "
+        return {"call from":"p_setcurve", "api error":e}
+    spec = {"type": curve}
+    if k is not None:
+        spec["k"] = k
+    try:
+        if points is not None:
+            spec["points"] = [[float(v) for v in p.split(":")] for p in points.split(",")]
+        motor_manager.set_motor_param(addr, f"{target}_curve", spec)
+    except (ValueError, KeyError) as ex:
+        e=(e or "")+f"Invalid curve: {ex}. "
+    return {"call from":"p_setcurve", "reply":motor_manager.connected.get(addr, {}).get(f"{target}_curve"), "api error":e}
+
 @app.get("/p/gettemp", description="Get temperature of a given motor using GIO command.")
 async def p_gettemp(
     addr: int = Query(..., description="Module (motor) Address 0-255"),
@@ -185,7 +451,8 @@ async def p_getpos(
 
 @app.get("/p/panic", description="stop all motors between 0 to 255 with MST command")
 async def p_panic():
-    artnet_protocol.disable()
+    for dmx_input in _dmx_inputs():
+        dmx_input.disable()
     reply = await motor_manager.panic()
     return{"call from":"p_panic","reply":reply}
     """ for i in range(0,256):
@@ -195,10 +462,12 @@ async def p_panic():
 @app.get("/p/set_artnet", description="Switch between True and False in order to Activate or Deactivate Art-net input, and respond with current state")
 async def p_set_artnet():
     if artnet_protocol.enabled == True:
-        artnet_protocol.disable()
+        for dmx_input in _dmx_inputs():
+            dmx_input.disable()
         r=False
     else:
-        artnet_protocol.enable()
+        for dmx_input in _dmx_inputs():
+            dmx_input.enable()
         r=True
     return {"call from":"p_set_artnet","reply":r}
 
@@ -207,11 +476,83 @@ async def p_get_artnet():
     r= artnet_protocol.enabled
     return{"call from":"p_get_artnet","reply":r}
 
-@app.get("/p/connected", description="return the number of TMCL modules (motors) connected and available after scan")
-async def p_connected():
+@app.get("/p/artnet_stats", description="Art-Net ingestion counters: packets/s, received, decoded, filtered and superseded packets")
+async def p_artnet_stats():
+    return {"call from":"p_artnet_stats","reply":{type(d).__name__: d.stats.report() for d in _dmx_inputs()}}
+
+@app.get("/p/osc_stats", description="OSC / binary UDP input counters: packets, commands sent, rejected packets, host overhead per packet. Null when the input is off (-osc)")
+async def p_osc_stats():
+    return {"call from":"p_osc_stats","reply":osc_protocol.stats.report() if osc_protocol else None}
+
+def _dumps(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data).encode()
+
+def _versioned_response(request: Request, key: str, version, build):
+    """
+        JSON response with an ETag made of a version counter: 304 if the client already has this version,
+        otherwise the body, serialized once per version.
+    """
+    etag = f'"{BOOT_ID}-{key}-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    cached = _response_cache.get(key)
+    if cached is None or cached[0] != version:
+        cached = _response_cache[key] = (version, _dumps(build()))
+    return Response(content=cached[1], media_type="application/json", headers=headers)
+
+@app.get("/p/connected", description="return the number of TMCL modules (motors) connected and available after scan. Supports If-None-Match (304 when unchanged)")
+async def p_connected(request: Request):
     if motor_manager is None:
         return []
-    return motor_manager.connected
+    return _versioned_response(request, "connected", motor_manager.version, lambda: motor_manager.connected.as_dict())
+
+@app.get("/p/commanded", description="Last speed, position or rotation commanded to every motor (replayed after a reconnect). Does not touch the bus, supports If-None-Match (304 when unchanged)")
+async def p_commanded(request: Request):
+    return _versioned_response(request, "commanded", motor_manager.state_version,
+                               lambda: {"call from":"p_commanded","reply":motor_manager.last_commanded, "api error":None})
+
+@app.get("/p/telemetry", description="Last position and temperature read on the bus for every motor, with transaction and error counters. Does not touch the bus")
+async def p_telemetry():
+    return {"call from":"p_telemetry","reply":motor_manager.telemetry}
+
+@app.get("/p/history", description="Position or temperature history of a motor, [time, mean, min, max] records. Recorded from the reads done anyway, does not touch the bus")
+async def p_history(
+    addr: int = Query(..., description="Module (motor) Address 0-255"),
+    metric: str = Query("pos", description="pos or temp"),
+    start: float | None = Query(None, description="Unix time of the first record, default: as far back as kept"),
+    end: float | None = Query(None, description="Unix time of the last record, default: now"),
+    last: float | None = Query(None, description="Seconds back from now, instead of start"),
+    resolution: str = Query("auto", description="raw, 1s, 1m or auto: the finest one covering the range within max_points"),
+    max_points: int = Query(1000, description="Records returned at most, larger results are decimated"),
+    ):
+    e:str|None=None
+    reply=None
+    if history is None:
+        e="Telemetry history is not recorded on this node. "
+    else:
+        if last is not None:
+            start = time.time() - last
+        try:
+            reply = history.query(addr, metric, start=start, end=end, resolution=resolution, max_points=max_points)
+        except ValueError as ex:
+            e=f"{ex}. "
+    return {"call from":"p_history","reply":reply, "api error":e}
+
+@app.get("/p/bus", description="Serial bus budget: utilization over the last second, calibrated time per transaction, commands admitted per priority, merged, deferred and shed under load")
+async def p_bus():
+    return {"call from":"p_bus","reply":motor_manager.bus.report()}
+
+@app.get("/p/broker", description="Bus broker statistics: connected clients, requests served, batches, requests without reply. Null when the broker is off (-bs)")
+async def p_broker():
+    return {"call from":"p_broker","reply":broker_server.stats() if broker_server else None}
+
+@app.get("/p/control", description="Fixed-rate control loop statistics: tick jitter, bus time per tick, overruns, deferred frames. Null when the loop is off (-ct)")
+async def p_control():
+    control = motor_manager.control
+    return {"call from":"p_control","reply":control.stats() if control else None}
 
 @app.get("/p/get_universe", description="gives the current art-net universe in use on the node")
 async def p_get_universe():
@@ -226,7 +567,8 @@ async def p_set_universe(
     if not (0<=val<=1024):
         val=0
         e=(e or "")+f"Wrong input universe value. set to {val}."
-    artnet_protocol.universe=val
+    for dmx_input in _dmx_inputs():
+        dmx_input.set_universe(val)
     return {"call from":"p_set_universe","api error":e}
 
 @app.get("/p/set_addr", description="Set a new address to a given module")
@@ -255,79 +597,174 @@ async def c_save_config(
     if artnet_protocol is None:
         return {"status": "error", "message": "artnet_protocol not initialized"}
 
-    data = motor_manager.connected
+    # copy on the event loop, the files are written from the config worker thread
+    data = motor_manager.connected.as_dict()
     artnet_data = {"universe": artnet_protocol.universe}
-    save_name = name
-    is_default = default
-    path = os.path.join(CONFIG_DIR, f"{save_name}.json")
-    artnet_path = os.path.join(CONFIG_DIR, f"{save_name}_artnet.json")
     try:
-        # write motor configuration
-        with open(path, "w") as f:
-            json.dump(data, f, indent=4)
-
-        # write artnet configuration
-        with open(artnet_path, "w") as f:
-            json.dump(artnet_data, f, indent=4)
-
-        if is_default:
-            default_path = os.path.join(CONFIG_DIR, "default.json")
-            try:
-                if os.path.exists(default_path) or os.path.islink(default_path):
-                    os.remove(default_path)
-            except Exception:
-                pass
-            os.symlink(path, default_path)
-
-            default_artnet = os.path.join(CONFIG_DIR, "default_artnet.json")
-            try:
-                if os.path.exists(default_artnet) or os.path.islink(default_artnet):
-                    os.remove(default_artnet)
-            except Exception:
-                pass
-            os.symlink(artnet_path, default_artnet)
-
-        return {"status": "ok", "message": f"Configuration saved as '{save_name}'"}
+        await config_repo.save(name, data, artnet_data, default)
+        return {"status": "ok", "message": f"Configuration saved as '{name}'"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 
 
 
+### Fleet of Kinelink nodes
+
+@app.get("/f/nodes", description="List the Kinelink nodes registered in the fleet")
+async def f_nodes():
+    return {"call from":"f_nodes","reply":fleet_registry.nodes}
+
+@app.get("/f/add_node", description="Register a Kinelink node in the fleet")
+async def f_add_node(
+    name: str = Query(..., description="Node name"),
+    url: str = Query(..., description="Node API base url, ie http://192.168.1.20:8000")
+    ):
+    e:str|None=None
+    fleet_registry.add(name, url, save=False)
+    try:
+        await fleet_registry.save_async()
+    except Exception as ex:
+        e=f"Node list not saved: {ex}"
+    return {"call from":"f_add_node","reply":fleet_registry.nodes,"api error":e}
+
+@app.get("/f/remove_node", description="Remove a Kinelink node from the fleet")
+async def f_remove_node(
+    name: str = Query(..., description="Node name")
+    ):
+    e:str|None=None
+    if not fleet_registry.remove(name, save=False):
+        e=f"No node named {name}. "
+    else:
+        try:
+            await fleet_registry.save_async()
+        except Exception as ex:
+            e=f"Node list not saved: {ex}"
+    return {"call from":"f_remove_node","reply":fleet_registry.nodes,"api error":e}
+
+@app.post("/f/batch", description="Send a batch of API calls to fleet nodes concurrently. Body: [{\"node\": name or \"*\", \"path\": \"/m/gotopos\", \"params\": {...}}]")
+async def f_batch(request: Request):
+    try:
+        commands = await request.json()
+    except ValueError:
+        return {"call from":"f_batch","reply":None,"api error":"Body must be JSON"}
+    if not isinstance(commands, list):
+        return {"call from":"f_batch","reply":None,"api error":"Body must be a list of commands"}
+    for i, c in enumerate(commands):
+        e:str|None=None
+        if not isinstance(c, dict):
+            e="must be an object"
+        elif not isinstance(c.get("path"), str) or not c["path"].startswith("/"):
+            e="needs a \"path\" starting with /"
+        elif c.get("params") is not None and not isinstance(c["params"], dict):
+            e="\"params\" must be an object"
+        elif "node" in c and not (isinstance(c["node"], str) or (isinstance(c["node"], list) and all(isinstance(n, str) for n in c["node"]))):
+            e="\"node\" must be a name, a list of names or \"*\""
+        if e:
+            return {"call from":"f_batch","reply":None,"api error":f"Command {i} {e}"}
+    reply = await fleet_client.batch(commands)
+    return {"call from":"f_batch","reply":reply,"api error":None}
+
+@app.get("/f/connected", description="Aggregated /p/connected of every fleet node")
+async def f_connected():
+    return {"call from":"f_connected","reply":await fleet_client.connected()}
+
+@app.get("/f/telemetry", description="Position and temperature of every motor of every fleet node")
+async def f_telemetry():
+    return {"call from":"f_telemetry","reply":await fleet_client.telemetry()}
+
+@app.get("/f/panic", description="Stop every motor on every fleet node, all nodes in parallel")
+async def f_panic():
+    return {"call from":"f_panic","reply":await fleet_client.panic()}
+
+
 ## Utility functions
 
 @app.get("/p/version", description="Return application version")
 async def p_version():
     return {"version": getattr(app.state, "version", None)}
 
-""" @app.get("/n/enable", description="enable telegram notifications")
+@app.get("/n/enable", description="enable notifications (alerts and periodic summary)")
 async def n_enable():
-    try:
-        telegram_notifier.enable_notifications()
-        return{"call from":"n_enable", "reply":"notifications enabled"}
-    except Exception as e:
-        return{"call from":"n_enable", "reply":e}
+    notifier.enable_notifications()
+    return {"call from":"n_enable", "reply":"notifications enabled"}
 
-@app.get("/n/disable", description="disable telegram notifications")
+@app.get("/n/disable", description="disable notifications")
 async def n_disable():
-    try:
-        telegram_notifier.disable_notifications()
-        return{"call from":"n_disable", "reply":"notifications disabled"}
-    except Exception as e:
-        return{"call from":"n_disable", "reply":e}
+    notifier.disable_notifications()
+    return {"call from":"n_disable", "reply":"notifications disabled"}
 
-@app.get("/n/interval", description="set notification intervals")
+@app.get("/n/interval", description="set the interval of the summary notifications, in seconds")
 async def set_notification_interval(val: int):
-    try:
-        telegram_notifier.set_interval(val)
-        return {"status": "success", "message": f"Interval set to {val} seconds"}
-    except Exception as e:
-        return{"call from":"n_disable", "reply":e} """
+    if val < 10:
+        return {"call from":"n_interval", "reply":None, "api error":"Interval must be at least 10 seconds"}
+    notifier.set_interval(val)
+    return {"status": "success", "message": f"Interval set to {val} seconds"}
+
+@app.get("/n/status", description="notification state, active alerts and sender")
+async def n_status():
+    reply = {"enabled": notifier.is_running, "sender": type(notifier.sender).__name__, "interval": notifier.interval, "active": list(notifier.active.values())}
+    return {"call from":"n_status", "reply":reply}
+
+@app.get("/n/test", description="send a test notification")
+async def n_test(message: str = Query("Kinelink test notification")):
+    await notifier.send_manual_notification(message)
+    return {"call from":"n_test", "reply":"sent"}
 
 
     
 
 
+## Diagnostics
+
+@app.get("/d/profile", description="Profile the event loop for some seconds. collapsed: sampled stacks, one 'frame;frame;frame count' line per stack (flamegraph.pl, speedscope). pstats: cProfile report of the top functions")
+async def d_profile(
+    seconds: float = Query(5.0, description="Profiling duration, 0.1-60 s"),
+    format: str = Query("collapsed", description="collapsed or pstats"),
+    interval_ms: float = Query(5.0, description="Sampling interval of the collapsed profile, 1-100 ms"),
+    sort: str = Query("cumulative", description="pstats sort key: cumulative, tottime, ncalls, ...")
+    ):
+    if not (0.1<=seconds<=60) or not (1<=interval_ms<=100) or format not in ("collapsed", "pstats"):
+        return {"call from":"d_profile","reply":None, "api error":"seconds must be 0.1-60, interval_ms 1-100, format collapsed or pstats"}
+    try:
+        if format == "pstats":
+            text = await profiler.pstats(seconds, sort=sort)
+        else:
+            text = diagnostics.collapsed(await profiler.sample(seconds, interval_ms / 1000))
+    except Exception as ex:
+        return {"call from":"d_profile","reply":None, "api error":str(ex)}
+    return Response(content=text, media_type="text/plain")
+
+@app.get("/d/slow_callbacks/enable", description="Report loop callbacks running longer than threshold_ms for some time (asyncio debug mode, it slows the loop down)")
+async def d_slow_callbacks_enable(
+    threshold_ms: float = Query(50.0, description="Report callbacks longer than this, ms"),
+    duration: float = Query(60.0, description="Seconds before reporting is turned off again, 1-3600")
+    ):
+    if not (1<=duration<=3600) or threshold_ms <= 0:
+        return {"call from":"d_slow_callbacks_enable","reply":None, "api error":"duration must be 1-3600 s and threshold_ms positive"}
+    slow_callbacks.enable(threshold_ms, duration)
+    return {"call from":"d_slow_callbacks_enable","reply":slow_callbacks.report(), "api error":None}
+
+@app.get("/d/slow_callbacks/disable", description="Turn slow callback reporting off, the log is kept")
+async def d_slow_callbacks_disable():
+    slow_callbacks.disable()
+    return {"call from":"d_slow_callbacks_disable","reply":slow_callbacks.report(), "api error":None}
+
+@app.get("/d/slow_callbacks", description="Slow callbacks reported so far (last 200)")
+async def d_slow_callbacks(clear: bool = Query(False, description="Empty the log after reading it")):
+    reply = slow_callbacks.report()
+    if clear:
+        slow_callbacks.entries.clear()
+    return {"call from":"d_slow_callbacks","reply":reply, "api error":None}
+
+@app.get("/d/loop", description="Event loop lag histogram (ms) and running tasks grouped by coroutine")
+async def d_loop(reset: bool = Query(False, description="Reset the lag histogram after reading it")):
+    lag = loop_monitor.report() if loop_monitor else None
+    if reset and loop_monitor:
+        loop_monitor.lag.reset()
+    tasks = diagnostics.task_counts()
+    return {"call from":"d_loop","reply":{"lag":lag, "tasks":sum(tasks.values()), "tasks_by_coroutine":tasks}, "api error":None}
+
 ## BACKLOG NOT IMPLEMENTED FEATURES YET
 
 @app.get("/p/scan", description="scan for connected motors")
@@ -337,29 +774,63 @@ async def p_scan():
 
 @app.get("/c/list_config")
 async def list_configs():
-    configs = []
-    for file in os.listdir(CONFIG_DIR):
-        if file.endswith(".json"):
-            path = os.path.join(CONFIG_DIR, file)
-            is_default = os.path.islink(path) and os.path.basename(os.readlink(path)) == "default.json"
-            configs.append({
-                "name": file.replace(".json", ""),
-                "is_default": file == "default.json"
-            })
-    return configs
+    return await config_repo.list()
 
 @app.get("/c/load_config/{name}")
 async def load_config(name: str):
-    path = os.path.join(CONFIG_DIR, f"{name}.json")
-    if not os.path.exists(path):
+    data = await config_repo.load(name)
+    if data is None:
         return {"status": "error", "message": f"No config named {name}"}
-    with open(path, "r") as f:
-        return json.load(f)
+    return data
     
 @app.delete("/c/delete_config/{name}")
 async def delete_config(name: str):
-    path = os.path.join(CONFIG_DIR, f"{name}.json")
-    if not os.path.exists(path):
+    if not await config_repo.delete(name):
         return {"status": "error", "message": f"No config named {name}"}
-    os.remove(path)
     return {"status": "ok", "message": f"Deleted {name}.json"} 
+
+@app.get("/c/snapshot", description="Read every axis and global parameter of one motor (addr) or of every connected motor, and store it if a name is given")
+async def c_snapshot(
+    addr: int | None = Query(None, description="Module (motor) Address 0-255, every connected motor if omitted"),
+    name: str | None = Query(None, description="Store the snapshot in configs/snapshots/<name>.json")
+    ):
+    e:str|None=None
+    if addr is not None and not (0<=addr<=255):
+        return {"call from":"c_snapshot","reply":None, "api error":f"Wrong input address {addr}. "}
+    snapshot = await paramsnapshot.take(motor_manager, None if addr is None else [addr])
+    if name:
+        try:
+            await paramsnapshot.save(name, snapshot)
+        except Exception as ex:
+            e=f"Snapshot not saved: {ex}"
+    return {"call from":"c_snapshot","reply":snapshot, "api error":e}
+
+@app.get("/c/snapshots", description="List the stored parameter snapshots")
+async def c_snapshots():
+    return {"call from":"c_snapshots","reply":await paramsnapshot.list_snapshots(), "api error":None}
+
+@app.get("/c/snapshot_diff", description="Compare a stored snapshot (a) with another snapshot (b), with a configuration (config), or with the live motors if neither is given")
+async def c_snapshot_diff(
+    a: str = Query(..., description="Name of the stored snapshot"),
+    b: str | None = Query(None, description="Name of another stored snapshot"),
+    config: str | None = Query(None, description="Name of a configuration to compare the snapshot with"),
+    volatile: bool = Query(False, description="Also compare values that change while running (positions, speeds, switches)")
+    ):
+    try:
+        snap_a = await paramsnapshot.load(a)
+        if snap_a is None:
+            return {"call from":"c_snapshot_diff","reply":None, "api error":f"No snapshot named {a}"}
+        if b:
+            snap_b = await paramsnapshot.load(b)
+            if snap_b is None:
+                return {"call from":"c_snapshot_diff","reply":None, "api error":f"No snapshot named {b}"}
+        elif config:
+            data = await config_repo.load(config)
+            if data is None:
+                return {"call from":"c_snapshot_diff","reply":None, "api error":f"No config named {config}"}
+            snap_b = paramsnapshot.from_config(data)
+        else:
+            snap_b = await paramsnapshot.take(motor_manager, [int(x) for x in snap_a.get("motors", {})])
+    except Exception as ex:
+        return {"call from":"c_snapshot_diff","reply":None, "api error":str(ex)}
+    return {"call from":"c_snapshot_diff","reply":paramsnapshot.diff(snap_a, snap_b, volatile), "api error":None}